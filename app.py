@@ -17,12 +17,21 @@ env = cdk.Environment(
 # The root stack of this project.
 Project1Stack(app, "Project1Stack", env=env)
 
-# 建立 Canary Stack
-CanaryStack(
-    app,
-    "CanaryStack",
-    target_url="https://www.bbc.com/",  # 你要測的網址
-    env=env
-)
+# 建立 Canary Stack（多區域）
+# 每個區域一個 CanaryStack，共用 lambda/sites.json，各自並行量測；
+# 指標、告警、Dashboard 都在主區域（第一個），Availability 告警需要過半區域同時看到不可用。
+# 只想部署單一區域時，把 PROBE_REGIONS 留一個即可。
+PROBE_REGIONS = ["ap-southeast-2", "us-east-1", "eu-west-1"]   # <<< 第一個為主區域
+
+for region in PROBE_REGIONS:
+    CanaryStack(
+        app,
+        # 主區域沿用原本的 stack 名稱，既有部署不會被取代
+        "CanaryStack" if region == env.region else f"CanaryStack-{region}",
+        target_url="https://www.bbc.com/",  # 你要測的網址
+        regions=PROBE_REGIONS,
+        home_region=env.region,
+        env=cdk.Environment(account=env.account, region=region),
+    )
 
 app.synth()
\ No newline at end of file
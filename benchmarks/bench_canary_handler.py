@@ -0,0 +1,193 @@
+# benchmarks/bench_canary_handler.py
+# 功能：離線量測 canary_handler.handler 的吞吐量（不連外網、不呼叫 AWS）。
+# 說明：
+#   - 在本機啟動一組 HTTP stub server（server farm），每個 endpoint 可設定延遲、錯誤率與 hang。
+#   - 產生 N 筆網址的 sites.json（透過 SITES_FILE 指給 handler），CloudWatch client 以 stub 取代。
+#   - 對每個 N 回報：wall time、probes/sec、peak memory（tracemalloc）、延遲 p50/p95/p99。
+#   - 每個 N 輸出一行 JSON（JSON Lines），方便存檔並比較不同版本之間的退化。
+#   - main() 結束時還原它改過的環境變數與 canary_handler.CW，在同一個 process 裡呼叫（例如測試）不會留下副作用。
+#
+# 用法：
+#   python benchmarks/bench_canary_handler.py --sizes 10,100,500 --latency-ms 50 \
+#       --error-rate 0.05 --hang-rate 0.01 --servers 4 > bench_output.txt
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+
+# main() 會設定 / 移除的環境變數（結束時還原）
+ENV_NAMES = ("AWS_DEFAULT_REGION", "SITES_FILE", "SCHEDULE_MODE", "METRIC_MODE", "MAX_CONCURRENCY",
+             "SHARD_QUEUE_URL", "STATE_TABLE")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # 路徑參數：/site?latency=<ms>&status=<code>&hang=<0|1>
+    protocol_version = "HTTP/1.1"
+    hang_seconds = 30
+
+    def setup(self):
+        super().setup()
+        # header 與 body 分兩次寫出；關掉 Nagle 避免 delayed ACK 讓 body 多等 40ms
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if query.get("hang") == ["1"]:
+            time.sleep(self.hang_seconds)
+            return
+        time.sleep(float(query.get("latency", ["0"])[0]) / 1000)
+        status = int(query.get("status", ["200"])[0])
+        body = b"ok" * 512
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerFarm:
+    # 多個 ThreadingHTTPServer，分散連線避免單一 listen queue 成為瓶頸
+
+    def __init__(self, count):
+        self.servers = [ThreadingHTTPServer(("127.0.0.1", 0), StubHandler) for _ in range(count)]
+        for server in self.servers:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def base_urls(self):
+        return [f"http://127.0.0.1:{s.server_address[1]}" for s in self.servers]
+
+    def close(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+class StubCloudWatch:
+    def __init__(self):
+        self.calls = 0
+        self.datapoints = 0
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.calls += 1
+        self.datapoints += len(MetricData)
+
+
+def make_sites(base_urls, n, latency_ms, jitter_ms, error_rate, hang_rate, timeout, rng):
+    sites = []
+    for i in range(n):
+        roll = rng.random()
+        params = {"latency": max(0, latency_ms + rng.uniform(-jitter_ms, jitter_ms))}
+        if roll < hang_rate:
+            params = {"hang": 1}
+        elif roll < hang_rate + error_rate:
+            params["status"] = 500
+        url = f"{base_urls[i % len(base_urls)]}/site{i}?{urllib.parse.urlencode(params)}"
+        sites.append({"url": url, "timeout": timeout})
+    return sites
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return round(values[lo] + (values[hi] - values[lo]) * (k - lo), 2)
+
+
+def run_once(canary_handler, sites, workdir):
+    path = os.path.join(workdir, f"sites-{len(sites)}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(sites, f)
+    os.environ["SITES_FILE"] = path
+
+    stub = StubCloudWatch()
+    canary_handler.CW = stub
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # handler 會把每筆結果印到 stdout；stdout 只留給 benchmark 報表
+        result = canary_handler.handler({}, None)
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [r["latency_ms"] for r in result.get("results", [])]
+    return {
+        "sites": len(sites),
+        "wall_s": round(wall, 3),
+        "probes_per_s": round(len(latencies) / wall, 1) if wall else None,
+        "peak_mem_kb": round(peak / 1024, 1),
+        "latency_ms": {q: percentile(latencies, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "available": sum(r["availability"] for r in result.get("results", [])),
+        "metric_calls": stub.calls,
+        "datapoints": stub.datapoints,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for canary_handler.handler")
+    parser.add_argument("--sizes", default="10,100,500", help="comma separated site counts")
+    parser.add_argument("--servers", type=int, default=4, help="number of stub HTTP servers")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=2.0, help="per-site probe timeout (s)")
+    parser.add_argument("--concurrency", type=int, default=None, help="MAX_CONCURRENCY override")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    import canary_handler
+
+    saved_env = {name: os.environ.get(name) for name in ENV_NAMES}
+    saved_cw = canary_handler.CW
+    # benchmark 只量測 handler 本身：直接量測全部網站，不分片、不用自適應排程
+    for name in ("SHARD_QUEUE_URL", "STATE_TABLE"):
+        os.environ.pop(name, None)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "ap-southeast-2")
+    os.environ["SCHEDULE_MODE"] = "all"
+    os.environ["METRIC_MODE"] = "api"
+    if args.concurrency:
+        os.environ["MAX_CONCURRENCY"] = str(args.concurrency)
+    StubHandler.hang_seconds = args.timeout + 1
+
+    farm = StubServerFarm(args.servers)
+    rng = random.Random(args.seed)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+                sites = make_sites(farm.base_urls(), n, args.latency_ms, args.jitter_ms,
+                                   args.error_rate, args.hang_rate, args.timeout, rng)
+                report = run_once(canary_handler, sites, workdir)
+                report["concurrency"] = canary_handler.max_concurrency()
+                print(json.dumps(report), flush=True)
+    finally:
+        farm.close()
+        canary_handler.CW = saved_cw
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_cold_start.py
+# 功能：量測每個 Lambda handler 模組的 cold start 成本（import / init 時間與記憶體）。
+# 說明：
+#   - 每次量測都在全新的 Python 子行程中進行（等同一次 cold start），不連外網、不呼叫 AWS。
+#   - 每個 handler 回報：
+#       import_ms        import 模組本身的時間（Lambda 的 init 階段）
+#       first_client_ms  第一次建立 boto3 client 的時間（延後建立後，這段移到第一次用到時）
+#       import_peak_kb   import 期間的 peak 記憶體（tracemalloc，另一次子行程量測，避免影響計時）
+#       maxrss_kb        子行程結束前的 RSS 高點
+#       modules          import 後載入的模組數，boto3_loaded 表示 import 時是否已載入 boto3
+#   - 多次量測取中位數，每個 handler 輸出一行 JSON（JSON Lines），方便比較不同版本。
+#
+# 用法：
+#   python benchmarks/bench_cold_start.py --runs 5 > cold_start.txt
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+# handler 模組 → 第一次建立 client 的呼叫
+HANDLERS = {
+    "canary_handler": "cloudwatch_client()",
+    "alarm_logger": "dynamodb_client()",
+}
+
+PROBE = r"""
+import json, resource, sys, time, tracemalloc
+sys.path.insert(0, {lambda_dir!r})
+name, first_use, trace = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+before = len(sys.modules)
+if trace:
+    tracemalloc.start()
+start = time.perf_counter()
+module = __import__(name)
+import_ms = (time.perf_counter() - start) * 1000
+peak = tracemalloc.get_traced_memory()[1] if trace else None
+boto3_loaded = "boto3" in sys.modules
+modules = len(sys.modules) - before
+start = time.perf_counter()
+eval(first_use, vars(module))
+first_client_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{
+    "import_ms": import_ms,
+    "first_client_ms": first_client_ms,
+    "import_peak_kb": None if peak is None else peak / 1024,
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": modules,
+    "boto3_loaded": boto3_loaded,
+}}))
+"""
+
+
+def run_probe(name, first_use, trace):
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "ap-southeast-2")
+    env.setdefault("TABLE_NAME", "WebHealth_AlarmHistory")
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(lambda_dir=LAMBDA_DIR), name, first_use, "1" if trace else "0"],
+        capture_output=True, text=True, check=True, env=env, cwd=LAMBDA_DIR,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(name, first_use, runs):
+    timed = [run_probe(name, first_use, trace=False) for _ in range(runs)]
+    traced = run_probe(name, first_use, trace=True)
+
+    def median(key):
+        return round(statistics.median(r[key] for r in timed), 2)
+
+    return {
+        "handler": name,
+        "runs": runs,
+        "import_ms": median("import_ms"),
+        "first_client_ms": median("first_client_ms"),
+        "import_peak_kb": round(traced["import_peak_kb"], 1),
+        "maxrss_kb": median("maxrss_kb"),
+        "modules": timed[0]["modules"],
+        "boto3_loaded": timed[0]["boto3_loaded"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold start (import / init) benchmark for the Lambda handlers")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreter runs per handler")
+    parser.add_argument("--handler", action="append", choices=sorted(HANDLERS),
+                        help="limit to this handler (repeatable)")
+    args = parser.parse_args(argv)
+
+    for name in args.handler or sorted(HANDLERS):
+        print(json.dumps(measure(name, HANDLERS[name], max(1, args.runs))), flush=True)
+
+
+if __name__ == "__main__":
+    main()
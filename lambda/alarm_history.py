@@ -0,0 +1,337 @@
+# lambda/alarm_history.py
+# 功能：告警歷史資料表（WebHealth_AlarmHistory）的資料格式與查詢 API。
+# 說明：
+#   - 主表 partition key 依時間分桶：Bucket = "<YYYYMMDDHH>#<shard>"，每小時 WRITE_SHARDS 個分區，
+#     sort key = "<ISO 時間>#<AlarmName>"。同一個頻繁切換的告警會分散到多個分區，不會形成 hot partition；
+#     「某段時間內的所有狀態變化」只需 Query 涵蓋的小時 × shard，不用 Scan。
+#   - GSI ByState：StateDay = "<狀態>#<YYYYMMDD>" + Timestamp → 「最近一小時所有 ALARM」。
+#   - GSI ByAlarm：AlarmName + Timestamp → 單一告警的歷史（flap 次數、MTTR）。
+#   - ExpiresAt（epoch 秒）為 TTL 欄位，保留 RETENTION_DAYS 天後由 DynamoDB 自動刪除。
+#   - 完整的告警 JSON（Trigger、Dimensions、StateChangeTime、AlarmArn…）原樣壓縮後放在二進位欄位 Payload；
+#     其他欄位只是查詢用的投影（Reason 只留前 REASON_LIMIT 字）。事後分析用 restore_message(record) 還原原始訊息。
+#     壓縮用 raw deflate + 預設字典（PAYLOAD_DICTIONARY，CloudWatch 告警 JSON 的固定欄位），
+#     一般告警約 1.2 KB → 300 bytes，整筆項目遠低於 1 KB（一個 write unit）。
+#     Payload 第一個 byte 是格式版本；之後若要換字典，新增版本即可，舊資料仍能解碼。
+#   - GSI 只投影 INDEX_ATTRIBUTES（不含 Payload），索引寫入與查詢都不用搬整份訊息。
+#   - 使用 low-level client（{"S": ...} 型別格式），可以直接接 DynamoDB Local 或測試用的替身。
+#   - 也可以從命令列執行：
+#       python lambda/alarm_history.py --table WebHealth_AlarmHistory recent --hours 1
+#       python lambda/alarm_history.py --table WebHealth_AlarmHistory --endpoint-url http://localhost:8000 mttr --hours 24
+
+import os
+import time
+import zlib
+from datetime import datetime, timezone
+
+WRITE_SHARDS = 4                 # 每小時分桶的 shard 數
+RETENTION_DAYS = 90              # TTL 保留天數（可用 ALARM_RETENTION_DAYS 覆寫）
+REASON_LIMIT = 200               # 投影欄位 Reason 的長度（完整內容在 Payload）
+STATE_INDEX = "ByState"
+ALARM_INDEX = "ByAlarm"
+INDEX_ATTRIBUTES = ("AlarmName", "Site", "Epoch", "NewStateValue", "OldStateValue", "Reason")
+
+_NUMBER_FIELDS = ("Epoch", "ExpiresAt")
+_BINARY_FIELDS = ("Payload",)
+
+# CloudWatch 告警通知（SNS Message）裡每次都一樣的片段；deflate 從字典尾端取的 match 最短，常見的放後面
+PAYLOAD_DICTIONARY = (
+    b'"EvaluateLowSampleCountPercentile":"","Metrics":[{"Id":"m1","ReturnData":true,"MetricStat":{"Metric":'
+    b'{"Dimensions":[{"value":"https://","name":"Site"}],"MetricName":"Latency","Namespace":"WebHealth"},'
+    b'"Period":300,"Stat":"Average"},"Label":"Expression":"Unit":null,"Statistic":"MAXIMUM","Percent",'
+    b'"GreaterThanOrEqualToThreshold","GreaterThanUpperThreshold","LessThanLowerOrGreaterThanUpperThreshold",'
+    b'"INSUFFICIENT_DATA","Insufficient Data: 1 datapoint was unknown.","breaching","ignore","missing",'
+    b'{"AlarmName":"canary-","AlarmDescription":"AWSAccountId":"","AlarmConfigurationUpdatedTimestamp":"'
+    b'","NewStateValue":"ALARM","NewStateReason":"Threshold Crossed: 1 out of the last 1 datapoints ['
+    b' was less than the threshold (minimum 1 datapoint for OK -> ALARM transition).","StateChangeTime":"'
+    b'","Region":"US East (N. Virginia)","Asia Pacific (Sydney)","AlarmArn":"arn:aws:cloudwatch:'
+    b':alarm:canary-","OldStateValue":"OK","OKActions":[],"AlarmActions":["arn:aws:sns:'
+    b'"],"InsufficientDataActions":[],"Trigger":{"MetricName":"Availability","Namespace":"WebHealth",'
+    b'"StatisticType":"Statistic","Statistic":"AVERAGE","Unit":null,"Dimensions":[{"value":"https://'
+    b'","name":"Site"}],"Period":300,"EvaluationPeriods":1,"DatapointsToAlarm":1,'
+    b'"ComparisonOperator":"GreaterThanThreshold","LessThanThreshold","Threshold":1.0,'
+    b'"TreatMissingData":"notBreaching","EvaluateLowSampleCountPercentile":""}}'
+)
+PAYLOAD_VERSION = 1
+_DICTIONARIES = {1: PAYLOAD_DICTIONARY}
+
+
+def retention_days():
+    try:
+        return max(1, int(os.environ.get("ALARM_RETENTION_DAYS", RETENTION_DAYS)))
+    except ValueError:
+        return RETENTION_DAYS
+
+
+def parse_time(value):
+    # CloudWatch StateChangeTime，例如 "2024-05-01T13:00:00.000+0000" → epoch 秒
+    if not value:
+        return None
+    try:
+        dt = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def iso(ts):
+    # 固定長度的 UTC ISO 字串（毫秒），可直接做字串排序 / 範圍查詢
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{int(ts * 1000) % 1000:03d}Z"
+
+
+def hour_bucket(ts):
+    return time.strftime("%Y%m%d%H", time.gmtime(ts))
+
+
+def day_bucket(ts):
+    return time.strftime("%Y%m%d", time.gmtime(ts))
+
+
+def shard_for(alarm_name, timestamp):
+    return zlib.crc32(f"{alarm_name}#{timestamp}".encode("utf-8")) % WRITE_SHARDS
+
+
+def site_of(msg):
+    # 單站告警從 Trigger.Dimensions 取 Site；分組（metric math）告警沒有單一網站，以告警名稱代表
+    for dim in (msg.get("Trigger") or {}).get("Dimensions") or []:
+        if dim.get("name") == "Site":
+            return dim.get("value")
+    return msg.get("AlarmName", "Unknown")
+
+
+def compress_payload(text):
+    # 原始訊息字串 → 版本 byte + raw deflate（預設字典）
+    packer = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, _DICTIONARIES[PAYLOAD_VERSION])
+    return bytes([PAYLOAD_VERSION]) + packer.compress(text.encode("utf-8")) + packer.flush()
+
+
+def decode_payload(blob):
+    # Payload → 原始訊息字串（與寫入時逐字相同）
+    blob = bytes(blob)
+    if not blob or blob[0] not in _DICTIONARIES:
+        raise ValueError(f"unknown payload format {blob[:1]!r}")
+    unpacker = zlib.decompressobj(-15, _DICTIONARIES[blob[0]])
+    return (unpacker.decompress(blob[1:]) + unpacker.flush()).decode("utf-8")
+
+
+def restore_message(record):
+    # 資料表項目（from_item 之後或 low-level 格式）→ 原始告警訊息（dict；非 JSON 訊息為 {"RawMessage": ...}）
+    import json   # 只有事後分析需要；寫入路徑不 import
+    payload = record["Payload"]
+    text = decode_payload(payload["B"] if isinstance(payload, dict) else payload)
+    return json.loads(text) if text.startswith("{") else {"RawMessage": text}
+
+
+def build_record(msg, now=None, raw=None):
+    # 告警訊息 → 資料表項目（Python 型別）
+    # raw：SNS 收到的原始訊息字串（逐字保存）；沒有時以精簡 JSON 重新序列化 msg
+    now = time.time() if now is None else now
+    ts = parse_time(msg.get("StateChangeTime")) or now
+    name = msg.get("AlarmName", "Unknown")
+    state = msg.get("NewStateValue", "UNKNOWN")
+    stamp = iso(ts)
+    return {
+        "Bucket": f"{hour_bucket(ts)}#{shard_for(name, stamp)}",
+        "SortKey": f"{stamp}#{name}",
+        "AlarmName": name,
+        "Site": site_of(msg),
+        "Timestamp": stamp,
+        "Epoch": int(ts),
+        "NewStateValue": state,
+        "OldStateValue": msg.get("OldStateValue", "UNKNOWN"),
+        "StateDay": f"{state}#{day_bucket(ts)}",
+        "Reason": msg.get("NewStateReason", msg.get("RawMessage", ""))[:REASON_LIMIT],
+        "ExpiresAt": int(ts) + retention_days() * 86400,
+        "Payload": compress_payload(raw if raw is not None else _serialize(msg)),
+    }
+
+
+def _serialize(msg):
+    if set(msg) == {"RawMessage"}:
+        return msg["RawMessage"]
+    import json
+    return json.dumps(msg, separators=(",", ":"), ensure_ascii=False)
+
+
+def to_item(record):
+    # Python dict → low-level DynamoDB 格式
+    def typed(k, v):
+        if k in _NUMBER_FIELDS:
+            return {"N": str(v)}
+        if k in _BINARY_FIELDS:
+            return {"B": bytes(v)}
+        return {"S": str(v)}
+
+    return {k: typed(k, v) for k, v in record.items()}
+
+
+def from_item(item):
+    def plain(v):
+        if "N" in v:
+            return int(v["N"])
+        if "B" in v:
+            return bytes(v["B"])
+        return v["S"]
+
+    return {k: plain(v) for k, v in item.items()}
+
+
+def item_size(item):
+    # 項目大小（bytes，依 DynamoDB 計算方式：屬性名稱 + 值；數字以字串長度近似）
+    total = 0
+    for name, value in item.items():
+        (kind, v), = value.items()
+        total += len(name.encode("utf-8")) + (len(v) if kind == "B" else len(str(v).encode("utf-8")))
+    return total
+
+
+def item_key(item):
+    # 主鍵（low-level 格式的項目）
+    return (item["Bucket"]["S"], item["SortKey"]["S"])
+
+
+def index_attributes(*keys):
+    # GSI 投影的非 key 欄位（key 欄位一定會投影，不能重複列出）
+    return [a for a in INDEX_ATTRIBUTES if a not in keys]
+
+
+def table_definition(table_name):
+    # create_table 參數（DynamoDB Local / 測試用；正式環境由 CDK 建立同樣的結構）
+    def string(name):
+        return {"AttributeName": name, "AttributeType": "S"}
+
+    def index(name, pk, sk):
+        return {
+            "IndexName": name,
+            "KeySchema": [{"AttributeName": pk, "KeyType": "HASH"}, {"AttributeName": sk, "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "INCLUDE", "NonKeyAttributes": index_attributes(pk, sk)},
+        }
+
+    return {
+        "TableName": table_name,
+        "BillingMode": "PAY_PER_REQUEST",
+        "AttributeDefinitions": [string(n) for n in ("Bucket", "SortKey", "StateDay", "AlarmName", "Timestamp")],
+        "KeySchema": [{"AttributeName": "Bucket", "KeyType": "HASH"}, {"AttributeName": "SortKey", "KeyType": "RANGE"}],
+        "GlobalSecondaryIndexes": [
+            index(STATE_INDEX, "StateDay", "Timestamp"),
+            index(ALARM_INDEX, "AlarmName", "Timestamp"),
+        ],
+    }
+
+
+class AlarmHistory:
+    # 查詢 API：client 為 boto3 low-level DynamoDB client（或同介面的替身）
+
+    def __init__(self, table_name, client):
+        self.table_name = table_name
+        self.client = client
+
+    def _query(self, pk_name, pk_value, sk_name, lo, hi, index=None):
+        params = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "#pk = :pk AND #sk BETWEEN :lo AND :hi",
+            "ExpressionAttributeNames": {"#pk": pk_name, "#sk": sk_name},
+            "ExpressionAttributeValues": {":pk": {"S": pk_value}, ":lo": {"S": lo}, ":hi": {"S": hi}},
+        }
+        if index:
+            params["IndexName"] = index
+        while True:
+            resp = self.client.query(**params)
+            for item in resp.get("Items", []):
+                yield from_item(item)
+            if not resp.get("LastEvaluatedKey"):
+                return
+            params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    def transitions(self, start, end):
+        # [start, end) 內所有告警狀態變化（依時間排序）：逐小時 × shard Query 主表
+        lo, hi = iso(start), iso(end)
+        out = []
+        ts = int(start // 3600 * 3600)
+        while ts < end:
+            for shard in range(WRITE_SHARDS):
+                out.extend(r for r in self._query("Bucket", f"{hour_bucket(ts)}#{shard}", "SortKey", lo, hi)
+                           if r["Timestamp"] < hi)
+            ts += 3600
+        return sorted(out, key=lambda r: r["SortKey"])
+
+    def recent(self, start, end=None, state="ALARM"):
+        # [start, end) 內進入某狀態的告警（預設 ALARM）：逐日 Query ByState
+        end = time.time() if end is None else end
+        lo, hi = iso(start), iso(end)
+        out = []
+        ts = int(start // 86400 * 86400)
+        while ts < end:
+            out.extend(r for r in self._query("StateDay", f"{state}#{day_bucket(ts)}", "Timestamp", lo, hi,
+                                              STATE_INDEX)
+                       if r["Timestamp"] < hi)
+            ts += 86400
+        return sorted(out, key=lambda r: r["SortKey"])
+
+    def alarm_history(self, alarm_name, start, end):
+        # 單一告警在 [start, end) 的歷史：Query ByAlarm
+        hi = iso(end)
+        return [r for r in self._query("AlarmName", alarm_name, "Timestamp", iso(start), hi, ALARM_INDEX)
+                if r["Timestamp"] < hi]
+
+    def flap_counts(self, start, end):
+        # 每站在時間窗內進入 ALARM 的次數
+        counts = {}
+        for r in self.transitions(start, end):
+            if r["NewStateValue"] == "ALARM":
+                counts[r["Site"]] = counts.get(r["Site"], 0) + 1
+        return dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])))
+
+    def mttr(self, start, end):
+        # 每站平均恢復時間：同一告警 ALARM → 下一次 OK 的秒數；窗內尚未恢復的不計入
+        opened = {}     # AlarmName → ALARM 開始時間
+        repairs = {}    # Site → [秒數, ...]
+        for r in self.transitions(start, end):
+            name, state = r["AlarmName"], r["NewStateValue"]
+            if state == "ALARM":
+                opened.setdefault(name, r["Epoch"])
+            elif state == "OK" and name in opened:
+                repairs.setdefault(r["Site"], []).append(r["Epoch"] - opened.pop(name))
+        return {
+            site: {"incidents": len(v), "mttr_s": round(sum(v) / len(v), 1)}
+            for site, v in sorted(repairs.items())
+        }
+
+
+def main(argv=None):
+    import argparse   # 只有命令列需要；Lambda 載入此模組時不 import
+    import json
+
+    parser = argparse.ArgumentParser(description="Query the alarm history table")
+    parser.add_argument("--table", default=os.environ.get("TABLE_NAME", "WebHealth_AlarmHistory"))
+    parser.add_argument("--endpoint-url", help="e.g. http://localhost:8000 for DynamoDB Local")
+    parser.add_argument("--create", action="store_true", help="create the table first (DynamoDB Local)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("recent", "flaps", "mttr"):
+        p = sub.add_parser(name)
+        p.add_argument("--hours", type=float, default=1.0, help="window size ending now")
+    args = parser.parse_args(argv)
+
+    import boto3
+    client = boto3.client("dynamodb", endpoint_url=args.endpoint_url)
+    if args.create:
+        client.create_table(**table_definition(args.table))
+    history = AlarmHistory(args.table, client)
+
+    end = time.time()
+    start = end - args.hours * 3600
+    if args.command == "recent":
+        result = history.recent(start, end)
+    elif args.command == "flaps":
+        result = history.flap_counts(start, end)
+    else:
+        result = history.mttr(start, end)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
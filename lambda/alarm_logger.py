@@ -1,40 +1,224 @@
 # lambda/alarm_logger.py
-# 功能：接收 SNS 告警訊息，解析後寫入 DynamoDB。
+# 功能：接收告警訊息（SQS 批次或 SNS），解析、去重後寫入 DynamoDB。
 # 說明：
-#   - SNS 事件結構：event["Records"][0]["Sns"]["Message"]
+#   - SQS 事件結構：event["Records"][i]["body"] 為 SNS 通知 JSON，其中 "Message" 才是告警內容。
+#   - SNS 事件結構：event["Records"][i]["Sns"]["Message"]（保留相容）。
 #   - Message 為 JSON 字串，內含 AlarmName、NewStateValue、NewStateReason 等。
-#   - 本 Lambda 解析後將資料記錄到 DynamoDB。
+#   - 項目格式與查詢 API 見 alarm_history.py（時間分桶的 partition key、GSI、TTL）。
+#     原始訊息字串逐字壓縮存進 Payload，alarm_history.restore_message() 可還原。
+#   - 去重（idempotent）：項目主鍵由告警自己的 StateChangeTime + AlarmName 決定，
+#     同一次狀態變化不論重送幾次、從哪個 Topic 來，都對應到同一筆。
+#       1) container 內的 LRU（RECENT）記住最近處理過的 SNS MessageId 與項目主鍵，
+#          SNS at-least-once 重送或兩個 Topic 扇出的重複訊息直接略過，不呼叫 DynamoDB；
+#       2) LRU 沒擋到的（例如另一個 container 處理過）先以 BatchGetItem（每次最多 100 個主鍵）查出已存在的項目，
+#          只把新的項目以 BatchWriteItem（每批最多 25 筆）寫入：整批 SQS 訊息只需要幾次往返，
+#          重複的狀態變化只花讀取容量，不會像失敗的條件式寫入一樣消耗 WCU，也不會覆寫既有項目。
+#          （兩個 container 剛好同時寫同一筆時會寫兩次，但主鍵相同、內容是同一次狀態變化，資料表仍只有一筆）
+#   - UnprocessedKeys / UnprocessedItems 以指數退避重試；重試後仍失敗的訊息回報為 batchItemFailures，
+#     只有那幾則會被 SQS 重新投遞。
+#   - cold start：boto3 與 DynamoDB low-level client 在第一次寫入時才建立，
+#     TABLE_NAME 也在呼叫時才讀取（模組可以在沒有 AWS 設定的環境下 import）。
 
 import os
 import json
-import boto3
-from datetime import datetime
+import time
+from collections import OrderedDict
 
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(os.environ["TABLE_NAME"])
+import alarm_history
 
-def handler(event, context):
-    # SNS 事件可能包含多筆記錄
-    for record in event.get("Records", []):
+dynamodb = None   # 第一次寫入時建立，warm container 沿用
+
+DEDUP_CACHE_SIZE = 4096   # LRU 記住的 key 數（MessageId + 項目主鍵）
+BATCH_GET_LIMIT = 100     # BatchGetItem 單次最多 100 個主鍵
+BATCH_WRITE_LIMIT = 25    # BatchWriteItem 單次最多 25 筆
+MAX_ATTEMPTS = 5          # Unprocessed 最多重試次數（含第一次）
+BACKOFF_BASE_SECONDS = 0.05
+
+
+class RecentKeys:
+    # 固定大小的 LRU：超過容量時丟掉最久沒用到的 key
+
+    def __init__(self, size=DEDUP_CACHE_SIZE):
+        self.size = size
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key):
+        self._keys[key] = True
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.size:
+            self._keys.popitem(last=False)
+
+    def clear(self):
+        self._keys.clear()
+
+
+RECENT = RecentKeys()
+
+
+def parse_envelope(record):
+    # 從 SQS / SNS record 取出 (SNS MessageId, 告警訊息字串)
+    if "Sns" in record:
+        return record["Sns"].get("MessageId"), record["Sns"]["Message"]
+    body = record["body"]
+    envelope = json.loads(body) if body.startswith("{") else {}
+    # SNS → SQS（非 raw delivery）時，告警內容包在 envelope 的 Message 欄位
+    if envelope.get("Type") == "Notification":
+        return envelope.get("MessageId"), envelope.get("Message", body)
+    return None, body
+
+
+def decode_message(sns_message):
+    # 告警 JSON；非 JSON 訊息包成 RawMessage
+    return json.loads(sns_message) if sns_message.startswith("{") else {"RawMessage": sns_message}
+
+
+def parse_message(record):
+    # 從 SQS / SNS record 取出告警 JSON
+    return decode_message(parse_envelope(record)[1])
+
+
+def build_item(msg, raw=None):
+    # 準備寫入 DynamoDB 的項目（low-level 格式）；raw 為原始訊息字串
+    return alarm_history.to_item(alarm_history.build_record(msg, raw=raw))
+
+
+def dynamodb_client():
+    global dynamodb
+    if dynamodb is None:
+        import boto3
+        dynamodb = boto3.client("dynamodb")
+    return dynamodb
+
+
+def table_name():
+    return os.environ["TABLE_NAME"]
+
+
+def _key_attrs(key):
+    return {"Bucket": {"S": key[0]}, "SortKey": {"S": key[1]}}
+
+
+def _with_retries(call, request, unprocessed):
+    # 呼叫 batch API，把 unprocessed(resp) 回傳的部分以指數退避重試；回傳最後仍未處理的 request（空 = 全部完成）
+    responses = []
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(BACKOFF_BASE_SECONDS * (2 ** attempt))   # 指數退避
+        resp = call(request)
+        responses.append(resp)
+        request = unprocessed(resp)
+        if not request:
+            break
+    return request, responses
+
+
+def existing_keys(keys):
+    # 已經在資料表裡的主鍵（最多 BATCH_GET_LIMIT 個）；重試後仍查不到結果時丟出錯誤（交給 SQS 重送）
+    name = table_name()
+    request = {name: {
+        "Keys": [_key_attrs(k) for k in keys],
+        "ProjectionExpression": "#pk, #sk",
+        "ExpressionAttributeNames": {"#pk": "Bucket", "#sk": "SortKey"},
+    }}
+    remaining, responses = _with_retries(
+        lambda req: dynamodb_client().batch_get_item(RequestItems=req),
+        request,
+        lambda resp: resp.get("UnprocessedKeys") or {},
+    )
+    if remaining:
+        raise RuntimeError(f"{len(remaining[name]['Keys'])} key(s) still unprocessed after {MAX_ATTEMPTS} attempts")
+    return {item_key(item) for resp in responses for item in resp.get("Responses", {}).get(name, [])}
+
+
+def write_new(items):
+    # BatchWriteItem（最多 BATCH_WRITE_LIMIT 筆）；回傳重試後仍未寫入的主鍵
+    name = table_name()
+    remaining, _ = _with_retries(
+        lambda req: dynamodb_client().batch_write_item(RequestItems=req),
+        {name: [{"PutRequest": {"Item": item}} for item in items]},
+        lambda resp: resp.get("UnprocessedItems") or {},
+    )
+    if remaining:
+        print(f"❌ {len(remaining[name])} item(s) still unprocessed after {MAX_ATTEMPTS} attempts")
+    return {item_key(req["PutRequest"]["Item"]) for req in remaining.get(name, [])}
+
+
+def store_items(items):
+    # items：{主鍵: 項目}；回傳 (寫入的主鍵, 已存在的主鍵, 失敗的主鍵)
+    written, duplicate, failed = set(), set(), set()
+    keys = list(items)
+    for i in range(0, len(keys), BATCH_GET_LIMIT):
+        chunk = keys[i:i + BATCH_GET_LIMIT]
         try:
-            sns_message = record["Sns"]["Message"]
-            msg = json.loads(sns_message) if sns_message.startswith("{") else {"RawMessage": sns_message}
+            found = existing_keys(chunk)
         except Exception as e:
-            print(f"Failed to parse SNS message: {e}")
+            print(f"❌ Failed to read from DynamoDB: {e}")
+            failed.update(chunk)
             continue
+        duplicate.update(k for k in chunk if k in found)
+        new = [k for k in chunk if k not in found]
+        for j in range(0, len(new), BATCH_WRITE_LIMIT):
+            batch = new[j:j + BATCH_WRITE_LIMIT]
+            try:
+                lost = write_new([items[k] for k in batch])
+            except Exception as e:
+                print(f"❌ Failed to write to DynamoDB: {e}")
+                lost = set(batch)
+            failed.update(lost)
+            written.update(k for k in batch if k not in lost)
+    return written, duplicate, failed
+
 
-        # 準備寫入 DynamoDB 的項目
-        item = {
-            "AlarmName": msg.get("AlarmName", "Unknown"),
-            "Timestamp": datetime.utcnow().isoformat(),
-            "NewStateValue": msg.get("NewStateValue", "UNKNOWN"),
-            "Reason": msg.get("NewStateReason", msg.get("RawMessage", ""))[:500]
-        }
+def item_key(item):
+    # DynamoDB 主鍵（partition + sort key）
+    return alarm_history.item_key(item)
 
+
+def handler(event, context):
+    # 一次處理整批 records；寫入失敗的 SQS 訊息以 batchItemFailures 回報
+    counts = {"written": 0, "duplicate": 0, "failed": 0}
+    pending = {}    # 主鍵 → {"item", "msg_ids", "keys"}；同一批裡的重複訊息合併成一筆
+    for record in event.get("Records", []):
+        msg_id = record.get("messageId") or record.get("Sns", {}).get("MessageId")
         try:
-            table.put_item(Item=item)
-            print(f"✅ Logged alarm: {item}")
+            sns_id, sns_message = parse_envelope(record)
+            msg = decode_message(sns_message)
+            item = build_item(msg, raw=sns_message)
+            key = item_key(item)
         except Exception as e:
-            print(f"❌ Failed to write to DynamoDB: {e}")
+            # 格式錯誤的訊息（例如 Message 是 JSON 陣列、欄位型別不對）重試也不會成功：
+            # 記錄後略過，不影響同一批的其他訊息
+            print(f"Failed to parse alarm message {msg_id}: {e}")
+            continue
+        keys = [("item", key)] + ([("sns", sns_id)] if sns_id else [])
+        if key in pending or any(k in RECENT for k in keys):
+            counts["duplicate"] += 1   # 重送 / 另一個 Topic 的同一次狀態變化：不另外寫入
+            if key in pending:
+                pending[key]["msg_ids"].append(msg_id)
+                pending[key]["keys"].extend(keys)
+            continue
+        pending[key] = {"item": item, "msg_ids": [msg_id], "keys": keys}
+
+    written, duplicate, failed = store_items({k: p["item"] for k, p in pending.items()})
+    counts["written"] += len(written)
+    counts["duplicate"] += len(duplicate)
+    counts["failed"] += len(failed)
+    failed_ids = []
+    for key, p in pending.items():
+        if key in failed:
+            failed_ids.extend(p["msg_ids"])
+            continue
+        for k in p["keys"]:
+            RECENT.add(k)
 
-    return {"ok": True}
+    print(f"✅ Logged {counts['written']} alarm(s), {counts['duplicate']} duplicate(s), {counts['failed']} failed")
+    return {
+        "ok": not failed_ids,
+        "batchItemFailures": [{"itemIdentifier": msg_id} for msg_id in failed_ids if msg_id],
+    }
@@ -0,0 +1,193 @@
+# lambda/archive.py
+# 功能：把每次量測的原始結果寫成精簡、壓縮的二進位檔（raw probe archive）。
+# 說明：
+#   - 檔案格式：gzip 壓縮的 length-prefixed records。
+#       檔頭：MAGIC（4 bytes）+ 版本（1 byte）
+#       每筆：<I 長度> + payload
+#       payload：<d 時間(epoch 秒)> <f latency_ms（NaN=無）> <B availability> <H status（0=無）>
+#                <H url 長度> url(UTF-8) <H error 長度> error(UTF-8，最多 ERROR_MAX_BYTES)
+#   - 多次取樣的結果（含 samples）會逐一寫出每個樣本，archive 永遠保存原始樣本。
+#   - 依時間分區：probes/YYYY/MM/DD/HH/<epoch>-<隨機>.whp.gz，每次 invocation 一個檔案。
+#   - 寫入目的地（sink）可替換：本機資料夾（測試 / 本機工具）或 S3 bucket（正式環境）。
+#     ARCHIVE_BUCKET → S3，ARCHIVE_DIR → 本機資料夾，兩者都沒設就不寫 archive。
+#   - 讀取為串流方式（逐筆 yield），不需要把整個檔案載入記憶體。
+#   - S3 client 在第一次需要時才建立，warm container 沿用（建立 boto3 client 每次要十幾毫秒）。
+
+import gzip
+import io
+import math
+import os
+import struct
+import time
+import uuid
+
+MAGIC = b"WHPA"
+VERSION = 1
+PREFIX = "probes"
+SUFFIX = ".whp.gz"
+ERROR_MAX_BYTES = 256
+
+_LEN = struct.Struct("<I")
+_FIXED = struct.Struct("<dfBH")
+_STR_LEN = struct.Struct("<H")
+
+S3 = None   # 第一次寫入 S3 時建立，warm container 沿用
+
+
+def _encode_str(value, limit=None):
+    raw = (value or "").encode("utf-8")
+    if limit is not None:
+        raw = raw[:limit]
+    return _STR_LEN.pack(len(raw)) + raw
+
+
+def encode_record(ts, result):
+    # result：canary_handler.check_one 的回傳值
+    latency = result.get("latency_ms")
+    payload = (
+        _FIXED.pack(
+            float(ts),
+            float("nan") if latency is None else float(latency),
+            1 if result.get("availability") else 0,
+            result.get("status_code") or 0,
+        )
+        + _encode_str(result["target_url"])
+        + _encode_str(result.get("error"), ERROR_MAX_BYTES)
+    )
+    return _LEN.pack(len(payload)) + payload
+
+
+def decode_record(payload):
+    ts, latency, availability, status = _FIXED.unpack_from(payload, 0)
+    offset = _FIXED.size
+    (url_len,) = _STR_LEN.unpack_from(payload, offset)
+    offset += _STR_LEN.size
+    url = payload[offset:offset + url_len].decode("utf-8")
+    offset += url_len
+    (err_len,) = _STR_LEN.unpack_from(payload, offset)
+    offset += _STR_LEN.size
+    error = payload[offset:offset + err_len].decode("utf-8", errors="replace") or None
+    return {
+        "ts": ts,
+        "target_url": url,
+        "availability": availability,
+        "latency_ms": None if math.isnan(latency) else round(latency, 2),
+        "status_code": status or None,
+        "error": error,
+    }
+
+
+def encode_run(ts, results):
+    # 一次 invocation 的所有結果 → 壓縮後的 bytes
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as gz:
+        gz.write(MAGIC + bytes([VERSION]))
+        for result in results:
+            for sample in result.get("samples") or [result]:
+                gz.write(encode_record(ts, sample))
+    return buf.getvalue()
+
+
+def iter_records(fileobj):
+    # 串流讀取一個 archive 檔（已開啟的二進位檔案物件）
+    with gzip.GzipFile(fileobj=fileobj, mode="rb") as gz:
+        header = gz.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a probe archive file")
+        if header[len(MAGIC)] != VERSION:
+            raise ValueError(f"unsupported archive version: {header[len(MAGIC)]}")
+        while True:
+            head = gz.read(_LEN.size)
+            if not head:
+                return
+            (length,) = _LEN.unpack(head)
+            yield decode_record(gz.read(length))
+
+
+def partition_prefix(ts):
+    # 該時間所屬的小時分區，例如 probes/2024/05/01/13/
+    return time.strftime(f"{PREFIX}/%Y/%m/%d/%H/", time.gmtime(ts))
+
+
+def object_key(ts):
+    return f"{partition_prefix(ts)}{int(ts)}-{uuid.uuid4().hex[:8]}{SUFFIX}"
+
+
+class LocalDirSink:
+    # 寫到本機資料夾（測試 / 本機工具）
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, data):
+        path = os.path.join(self.root, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def list(self, prefix):
+        base = os.path.join(self.root, *prefix.rstrip("/").split("/"))
+        if not os.path.isdir(base):
+            return []
+        keys = []
+        for dirpath, _, files in os.walk(base):
+            for name in files:
+                if name.endswith(SUFFIX):
+                    rel = os.path.relpath(os.path.join(dirpath, name), self.root)
+                    keys.append(rel.replace(os.sep, "/"))
+        return sorted(keys)
+
+    def open(self, key):
+        return open(os.path.join(self.root, *key.split("/")), "rb")
+
+
+class S3Sink:
+    # 寫到 S3 bucket（正式環境）
+
+    def __init__(self, bucket, client):
+        self.bucket = bucket
+        self.client = client
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data,
+                               ContentType="application/octet-stream")
+
+    def list(self, prefix):
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(o["Key"] for o in page.get("Contents", []) if o["Key"].endswith(SUFFIX))
+        return sorted(keys)
+
+    def open(self, key):
+        # StreamingBody 支援 read()，gzip 可直接串流解壓
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+
+def s3_client():
+    global S3
+    if S3 is None:
+        import boto3
+        S3 = boto3.client("s3")
+    return S3
+
+
+def default_sink():
+    # ARCHIVE_BUCKET → S3Sink；ARCHIVE_DIR → LocalDirSink；都沒設回傳 None
+    bucket = os.environ.get("ARCHIVE_BUCKET")
+    if bucket:
+        return S3Sink(bucket, s3_client())
+    directory = os.environ.get("ARCHIVE_DIR")
+    if directory:
+        return LocalDirSink(directory)
+    return None
+
+
+def write_run(sink, results, ts=None):
+    # 把一次 invocation 的結果寫成一個 archive 檔，回傳 key（沒有結果時不寫）
+    if not results:
+        return None
+    ts = time.time() if ts is None else ts
+    key = object_key(ts)
+    sink.put(key, encode_run(ts, results))
+    return key
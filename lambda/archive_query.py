@@ -0,0 +1,136 @@
+# lambda/archive_query.py
+# 功能：串流讀取 raw probe archive，計算任意時間窗內每站的可用率與延遲百分位數。
+# 說明：
+#   - 只讀取時間窗涵蓋的小時分區，逐筆處理，不把全部資料載入記憶體。
+#   - 百分位數使用對數分桶的直方圖（相對誤差約 1%），每站記憶體用量固定，
+#     與資料筆數無關。
+#   - 可當成模組使用，也可以從命令列執行：
+#       python lambda/archive_query.py --dir ./archive --start 2024-05-01T00:00 --end 2024-05-02T00:00
+#       python lambda/archive_query.py --bucket my-archive-bucket --site https://www.bbc.com/
+
+import argparse
+import json
+import math
+from datetime import datetime, timezone
+
+import archive
+
+BUCKET_GROWTH = 1.02          # 相鄰分桶的比例（≈ 1% 相對誤差）
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+
+
+class LatencyHistogram:
+    # 對數分桶直方圖：bucket i 涵蓋 [growth^i, growth^(i+1)) 毫秒
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.zero = 0          # < 1ms 的樣本
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.max = max(self.max, value)
+        if value < 1.0:
+            self.zero += 1
+            return
+        i = int(math.log(value) / _LOG_GROWTH)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = self.zero
+        if seen >= rank:
+            return 0.0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank:
+                # 回傳分桶中點，並以最大值為上限
+                return round(min(self.max, BUCKET_GROWTH ** (i + 0.5)), 2)
+        return round(self.max, 2)
+
+
+class SiteStats:
+    def __init__(self):
+        self.probes = 0
+        self.available = 0
+        self.latency = LatencyHistogram()
+
+    def add(self, record):
+        self.probes += 1
+        self.available += record["availability"]
+        if record["latency_ms"] is not None:
+            self.latency.add(record["latency_ms"])
+
+    def summary(self, quantiles=(0.5, 0.95, 0.99)):
+        out = {
+            "probes": self.probes,
+            "availability": round(self.available / self.probes, 6) if self.probes else None,
+        }
+        for q in quantiles:
+            out[f"p{round(q * 100, 1):g}"] = self.latency.percentile(q)
+        return out
+
+
+def hour_prefixes(start, end):
+    # 時間窗 [start, end) 涵蓋的所有小時分區
+    ts = int(start // 3600 * 3600)
+    while ts < end:
+        yield archive.partition_prefix(ts)
+        ts += 3600
+
+
+def iter_window(sink, start, end, sites=None):
+    # 逐筆回傳時間窗內（可選：指定網站）的紀錄
+    wanted = set(sites) if sites else None
+    for prefix in hour_prefixes(start, end):
+        for key in sink.list(prefix):
+            with sink.open(key) as f:
+                for record in archive.iter_records(f):
+                    if not (start <= record["ts"] < end):
+                        continue
+                    if wanted is not None and record["target_url"] not in wanted:
+                        continue
+                    yield record
+
+
+def query(sink, start, end, sites=None, quantiles=(0.5, 0.95, 0.99)):
+    # 回傳 {site: {"probes", "availability", "p50", "p95", "p99"}}
+    stats = {}
+    for record in iter_window(sink, start, end, sites):
+        stats.setdefault(record["target_url"], SiteStats()).add(record)
+    return {site: s.summary(quantiles) for site, s in sorted(stats.items())}
+
+
+def _parse_time(value):
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the raw probe archive")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="local archive directory")
+    source.add_argument("--bucket", help="S3 archive bucket")
+    parser.add_argument("--start", help="ISO time (UTC if no offset); default: 24h before --end")
+    parser.add_argument("--end", help="ISO time (UTC if no offset); default: now")
+    parser.add_argument("--site", action="append", help="limit to this site (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.bucket:
+        import boto3
+        sink = archive.S3Sink(args.bucket, boto3.client("s3"))
+    else:
+        sink = archive.LocalDirSink(args.dir)
+
+    end = _parse_time(args.end) if args.end else datetime.now(timezone.utc).timestamp()
+    start = _parse_time(args.start) if args.start else end - 86400
+    print(json.dumps(query(sink, start, end, args.site), indent=2))
+
+
+if __name__ == "__main__":
+    main()
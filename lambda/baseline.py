@@ -0,0 +1,79 @@
+# lambda/baseline.py
+# 功能：每站的延遲基準線（rolling baseline）與異常分數（anomaly score）。
+# 說明：
+#   - 每站只保存三個數字：樣本數 n、log(1 + latency_ms) 的 EWMA 平均與 EWMA 變異數。
+#     用 log 尺度是因為延遲分布偏右，同樣「慢 30%」在快網站和遠端網站的分數相近。
+#   - 異常分數 = (log(1 + latency) - 平均) / 標準差，也就是「偏離自己平常多少個標準差」；
+#     標準差至少 MIN_STD，避免非常穩定的網站因為幾 ms 的抖動就得到很高的分數。
+#   - 前 WARMUP_SAMPLES 次只累積基準線，分數為 0；之後更新時把樣本截在 ±CLAMP_SIGMA 標準差內，
+#     單次異常不會把基準線拉走，持續變慢則會在約 1/ALPHA 次量測後成為新的「平常」。
+#   - 狀態放在 container 內（BASELINES），有 STATE_TABLE 時透過 state_store 保存（kind = "baseline"），
+#     每次 invocation 開始時重新讀取（別的 container 可能更新過）。
+
+import math
+import threading
+
+ALPHA = 0.05              # EWMA 權重（約 20 次量測的記憶）
+WARMUP_SAMPLES = 20       # 累積幾次後才開始給分數
+MIN_STD = 0.1             # log 尺度的最小標準差（約 ±10%）
+CLAMP_SIGMA = 3.0         # 更新基準線時樣本最多偏離幾個標準差
+MAX_SCORE = 10.0          # 分數上下限
+ALARM_SCORE = 3.0         # 延遲告警的門檻（CDK 的 LatencyAnomaly 告警與排程器共用）
+
+STATE_KIND = "baseline"
+
+
+def observe(state, latency_ms):
+    # 回傳 (異常分數, 新狀態)；state 為 {"n", "mean", "var"} 或空 dict
+    x = math.log1p(max(0.0, latency_ms))
+    n = state.get("n", 0)
+    if n == 0:
+        return 0.0, {"n": 1, "mean": round(x, 6), "var": 0.0}
+
+    mean, var = state["mean"], state["var"]
+    std = max(math.sqrt(var), MIN_STD)
+    warm = n >= WARMUP_SAMPLES
+    score = max(-MAX_SCORE, min(MAX_SCORE, (x - mean) / std)) if warm else 0.0
+
+    if warm:
+        x = max(mean - CLAMP_SIGMA * std, min(mean + CLAMP_SIGMA * std, x))
+    alpha = max(ALPHA, 1.0 / (n + 1))     # 前幾次用一般平均，收斂較快
+    diff = x - mean
+    mean += alpha * diff
+    var = (1 - alpha) * (var + alpha * diff * diff)
+    return round(score, 3), {"n": n + 1, "mean": round(mean, 6), "var": round(var, 8)}
+
+
+class Baselines:
+    # dict[網址] = {"n", "mean", "var"}
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, urls, store):
+        import state_store   # CDK 也會載入這個模組（ALARM_SCORE），不在模組層級依賴 lambda/ 的其他檔案
+        state_store.load_states(self._states, self._lock, store, STATE_KIND, urls, dict)
+
+    def observe(self, url, latency_ms):
+        with self._lock:
+            score, self._states[url] = observe(self._states.get(url, {}), latency_ms)
+            return score
+
+    def get(self, url):
+        with self._lock:
+            return dict(self._states.get(url, {}))
+
+    def save(self, urls, store):
+        if store is None or not urls:
+            return
+        with self._lock:
+            states = {u: dict(self._states[u]) for u in urls if u in self._states}
+        store.put_many(STATE_KIND, states)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+
+BASELINES = Baselines()
@@ -1,119 +1,574 @@
 # lambda/canary_handler.py
-# 功能：讀取同資料夾的 sites.json，逐一量測每個網站的可用性與延遲，
+# 功能：讀取同資料夾的 sites.json（經 site_registry 驗證），併發量測每個網站的可用性與延遲，
 #      並將結果輸出到 CloudWatch Logs，同時寫入 CloudWatch Metrics。
 # 說明：
 #   - 只使用 Python 內建模組與 boto3（Lambda 內建提供）。
 #   - 若 sites.json 不存在或格式錯誤，會在日誌中顯示錯誤並結束。
+#   - 每個網站可設定 method / expected_status / timeout / headers（見 site_registry.py）；
+#     解析結果快取在模組層級，檔案沒變就不重新解析。
+#   - 以 ThreadPool 併發量測，最大併發數由環境變數 MAX_CONCURRENCY 控制，
+#     整體執行時間約等於「最慢的那個網站」，而不是所有網站延遲的總和。
+#   - 指標先收集到 metric sink，最後一次批次送出（METRIC_MODE=api）
+#     或以 EMF 格式寫到 stdout（METRIC_MODE=emf，不呼叫 Metrics API）。
+#   - HTTP 請求透過 http_pool：warm container 會沿用 DNS 快取、keep-alive 連線與
+#     TLS session；每筆結果的 connection 欄位標示 "cold" 或 "reused"。
+#   - phases_ms 記錄 DNS / TCP connect / TLS / TTFB / body 各階段耗時，
+#     並以 Latency<Phase> 指標（同樣帶 Site 維度）寫入 CloudWatch。
+#   - Latency 量到收到（最終）回應標頭為止，與改用連線池之前 urlopen 的量法相同：
+#     為了重用連線（或做內容檢查）仍會讀取 body，但下載 body 的時間只記在 LatencyBody，不算進 Latency。
+#   - 分片（sharding）：設定 SHARD_QUEUE_URL 時，排程觸發的這支 Lambda 只當 dispatcher，
+#     把網站清單切成每片 SHARD_SIZE 個網址送進 SQS；由 worker Lambda 從 SQS 取出後量測。
+#     總容量隨 worker 數量成長，不受單次 invocation 的時間上限限制。
+#   - 排程：SCHEDULE_MODE=adaptive 時，每次觸發只是一個 tick，只量測到期的網站
+#     （見 scheduler.py）；預設 all 則每次都量測全部網站。
+#   - 原始結果另外寫入壓縮的 probe archive（ARCHIVE_BUCKET / ARCHIVE_DIR，見 archive.py），
+#     之後可用 archive_query.py 計算任意時間窗的百分位數與可用率。
+#   - 內容檢查：網站設定 content（關鍵字 / regex / 大小 / SHA-256）時，一邊串流讀取 body
+#     一邊檢查（content_check.py），最多讀 max_read_bytes；不符合時 availability = 0。
+#     每筆結果都附上 body_ms（下載 body 的時間）與 body_bytes（讀取的 bytes 數）。
+#   - 時間預算：每次執行依 context.get_remaining_time_in_millis() 扣掉 BUDGET_RESERVE_MS
+#     （寫指標 / archive / 狀態的時間）得到量測預算，平均分給每一輪併發量測作為逾時上限；
+#     預算用完時不再等待，確保在 Lambda 逾時前寫出指標。
+#   - circuit breaker（circuit_breaker.py）：連續失敗的網站只給短逾時、排在最後量測，
+#     預算不足時直接回報為不可用。
+#   - 延遲基準線（baseline.py）：每站保存 log 延遲的 EWMA 平均 / 變異數，
+#     每次量測上報 LatencyAnomaly（偏離平常幾個標準差），告警依各站自己的「平常」判斷，
+#     不再用同一個固定毫秒門檻。
+#   - 多次取樣：SAMPLES_PER_RUN=K（>1）時，每個網站在一次執行中量測 K 次，
+#     平均分散在 SAMPLE_SPREAD_SECONDS 秒內；在 Lambda 內彙總後以 Values/Counts
+#     直方圖寫入 CloudWatch（每站的 datum 數量不變），可用於百分位數告警。
+#   - 多區域：同一份 sites.json 部署在多個區域，各區域的 tick 各自並行量測。
+#     設定 PROBE_REGION 時 Availability / Latency 另外帶 Region 維度（metric_sink.RegionalSink），
+#     METRIC_REGION 指定指標寫到哪個區域（主區域），quorum 告警與總覽 Dashboard 都在那裡。
 
 import os          # 讀取檔案路徑用
 import time        # 計時用
 import json        # 解析 JSON 用
-import urllib.request   # 發送 HTTP 請求
-import urllib.error     # 捕捉網路錯誤
-import boto3       # AWS SDK（Lambda 內建提供）
+import math        # 時間預算的分配
+from concurrent.futures import ThreadPoolExecutor, wait  # 併發量測
 
-# 在全域初始化 CloudWatch client（效能較好）
-CW = boto3.client("cloudwatch")
+import http_pool   # 跨 invocation 重用的連線池 / DNS 快取
+import site_registry  # sites.json 的解析 / 驗證 / 快取（與 CDK 共用）
+import scheduler      # 自適應排程（每站 next_due）
+import state_store    # 跨 invocation 的每站狀態
+import archive        # 原始結果的壓縮 archive
+import content_check  # 串流的 body 內容檢查
+import circuit_breaker  # 每站的 circuit breaker
+import baseline       # 每站的延遲基準線 / 異常分數
+from metric_sink import make_sink  # 批次 / EMF 指標輸出
 
+# boto3 client 延後到第一次用到時才建立（boto3 本身也是）：
+# cold start 只付這次 invocation 真正用到的 client，例如 dispatcher 不需要 CloudWatch、EMF 模式不需要任何 client。
+# 建立後放在模組層級，warm container 會沿用（boto3 client 可跨執行緒共用）
+CW = None
 
-def check_one(url):
-    # 量測單一網址：回傳 availability / latency_ms / status_code / error
+DEFAULT_MAX_CONCURRENCY = 16  # 未設定 MAX_CONCURRENCY 時的預設併發數
+DEFAULT_SHARD_SIZE = 50       # 未設定 SHARD_SIZE 時，每個分片的網址數
+SQS_BATCH_LIMIT = 10          # SendMessageBatch 單次最多 10 則訊息
+
+MAX_SAMPLES = 100             # 每站每次執行最多取樣數（EMF 單一 metric 最多 100 個值）
+DEFAULT_SAMPLE_SPREAD = 6.0   # 未設定 SAMPLE_SPREAD_SECONDS 時，K 次取樣分散的秒數
+
+SQS = None                    # 只有 dispatcher 需要
+
+BUDGET_RESERVE_MS = 3000      # 量測之外（flush / archive / 狀態）保留的時間
+MIN_PROBE_TIMEOUT = 0.5       # 預算再緊也至少給每個量測的逾時（秒）
+
+# 各階段耗時對應的 CloudWatch 指標名稱
+PHASE_METRICS = {
+    "dns": "LatencyDns",
+    "connect": "LatencyConnect",
+    "tls": "LatencyTls",
+    "ttfb": "LatencyTtfb",
+    "body": "LatencyBody",
+}
+
+
+def positive_int_env(name, default):
+    # 讀取正整數環境變數，非法值（非數字 / <1）時退回預設值
+    try:
+        value = int(os.environ.get(name, default))
+    except ValueError:
+        return default
+    return value if value >= 1 else default
+
+
+def max_concurrency():
+    return positive_int_env("MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+
+
+def shard_size():
+    return positive_int_env("SHARD_SIZE", DEFAULT_SHARD_SIZE)
+
+
+def samples_per_run():
+    return min(positive_int_env("SAMPLES_PER_RUN", 1), MAX_SAMPLES)
+
+
+def sample_spread():
+    try:
+        return max(0.0, float(os.environ.get("SAMPLE_SPREAD_SECONDS", DEFAULT_SAMPLE_SPREAD)))
+    except ValueError:
+        return DEFAULT_SAMPLE_SPREAD
+
+
+def adaptive_schedule():
+    # SCHEDULE_MODE=adaptive：只量測到期的網站
+    return os.environ.get("SCHEDULE_MODE", "all").lower() == "adaptive"
+
+
+def cloudwatch_client():
+    global CW
+    if CW is None:
+        import boto3
+        # 多區域部署時把指標寫到主區域（METRIC_REGION）；未設定時使用 Lambda 所在區域
+        CW = boto3.client("cloudwatch", region_name=os.environ.get("METRIC_REGION") or None)
+    return CW
+
+
+def sqs_client():
+    global SQS
+    if SQS is None:
+        import boto3
+        SQS = boto3.client("sqs")
+    return SQS
+
+
+def check_one(site, timeout=None):
+    # 量測單一網站：回傳 availability / latency_ms / status_code / error / connection / phases_ms
+    #             / body_ms / body_bytes（有內容檢查時另附 content_hash）
+    # site 可以是 site_registry.Site，或單純的網址字串（使用預設設定）
+    # timeout：覆寫網站設定的逾時（時間預算 / circuit breaker 分配的值）
+    if isinstance(site, str):
+        site = site_registry.Site(url=site)
+    url = site.url
     start = time.perf_counter()  # 開始計時
     availability = 0
     latency_ms = None
     status_code = None
     error_msg = None
+    connection = "cold"
+    phases = {}  # 由 http_pool 填入；失敗時保留已完成階段的耗時
+    body_bytes = None
+    matcher = content_check.ContentMatcher(site.content) if site.content else None
 
     try:
-        # 建立一個 HTTP 請求物件
-        req = urllib.request.Request(url)
-        # 發送請求（設定逾時 10 秒）
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            status_code = resp.getcode()
-            if status_code and status_code < 400:
-                availability = 1  # 網站可用
+        # 依網站設定發送請求（預設 GET、逾時 10 秒），會自動跟隨轉址
+        resp = http_pool.request(url, timeout=timeout or site.timeout, method=site.method,
+                                 headers=site.headers, phases=phases, body_consumer=matcher)
+        status_code = resp["status"]
+        body_bytes = resp["body_bytes"]
+        connection = "reused" if resp["reused"] else "cold"
+        if site.status_ok(status_code):
+            # 狀態碼正確還要通過內容檢查（例如回 200 的錯誤頁面、被截斷的內容）
+            error_msg = matcher.error() if matcher else None
+            availability = 0 if error_msg else 1
+        else:
+            error_msg = f"HTTP Error {status_code}: {resp['reason']}"
     except Exception as e:
         error_msg = str(e)
     finally:
-        # 無論成功與否都計算延遲時間
+        # 無論成功與否都計算延遲時間（扣掉下載 body 的時間，見檔頭說明）
         end = time.perf_counter()
-        latency_ms = round((end - start) * 1000, 2)
+        latency_ms = round(max(0.0, (end - start) * 1000 - phases.get("body", 0.0)), 2)
 
-    return {
+    result = {
         "target_url": url,
         "availability": availability,
         "latency_ms": latency_ms,
+        "body_ms": phases.get("body"),
+        "body_bytes": body_bytes,
         "status_code": status_code,
-        "error": error_msg
+        "error": error_msg,
+        "connection": connection,
+        "phases_ms": phases
     }
+    if matcher is not None:
+        result["content_hash"] = matcher.digest if status_code is not None else None
+    return result
 
 
-def put_metrics(namespace, url, availability, latency_ms):
-    # 將兩個指標寫入 CloudWatch：
+def metric_datums(url, availability, latency_ms, phases_ms=None):
+    # 產生指標的 datapoints（PutMetricData 的 MetricData 格式）：
     #   - Availability：0/1（Count）
     #   - Latency：毫秒（Milliseconds）
-    CW.put_metric_data(
-        Namespace=namespace,
-        MetricData=[
-            {
-                "MetricName": "Availability",
+    #   - Latency<Phase>：各階段耗時（毫秒），只在有量到時才輸出
+    datums = [
+        {
+            "MetricName": "Availability",
+            "Dimensions": [{"Name": "Site", "Value": url}],
+            "Value": float(availability),
+            "Unit": "Count"
+        },
+        {
+            "MetricName": "Latency",
+            "Dimensions": [{"Name": "Site", "Value": url}],
+            "Value": float(latency_ms) if latency_ms is not None else 0.0,
+            "Unit": "Milliseconds"
+        }
+    ]
+    for phase, value in (phases_ms or {}).items():
+        if phase in PHASE_METRICS and value is not None:
+            datums.append({
+                "MetricName": PHASE_METRICS[phase],
                 "Dimensions": [{"Name": "Site", "Value": url}],
-                "Value": float(availability),
-                "Unit": "Count"
-            },
-            {
-                "MetricName": "Latency",
-                "Dimensions": [{"Name": "Site", "Value": url}],
-                "Value": float(latency_ms) if latency_ms is not None else 0.0,
+                "Value": float(value),
                 "Unit": "Milliseconds"
-            }
-        ]
-    )
+            })
+    return datums
 
 
-def handler(event, context):
-    # Lambda 主要進入點：讀 sites.json，逐一檢查每個網址
-    here = os.path.dirname(__file__)                 # 取得目前檔案所在資料夾
-    sites_path = os.path.join(here, "sites.json")    # 組出 sites.json 路徑
+def anomaly_datum(url, score):
+    # LatencyAnomaly：延遲偏離該站基準線幾個標準差（見 baseline.py）
+    return {
+        "MetricName": "LatencyAnomaly",
+        "Dimensions": [{"Name": "Site", "Value": url}],
+        "Value": float(score),
+        "Unit": "None"
+    }
+
+
+def result_datums(result):
+    # 單次量測結果 → 指標；沒收到回應時階段耗時不完整，只寫 Availability / Latency
+    phases = result["phases_ms"] if result["status_code"] is not None else None
+    return metric_datums(result["target_url"], result["availability"], result["latency_ms"], phases)
+
+
+def probe_all(sites, sink, concurrency, timeouts=None, deadline=None):
+    # 以有上限的 ThreadPool 併發量測所有網站，結果順序與 sites 一致
+    # deadline（time.monotonic()）：到時還沒完成的量測不再等待，該位置回傳 None
+    # worker thread 只負責量測（check_one）並回傳結果；印 log 與寫指標都在這裡（主執行緒）做，
+    # 超過 deadline 仍在跑的量測之後才完成時，結果直接丟棄，不會再寫進 sink（也不會在 flush 之後才寫）
+    if not sites:
+        return []
+    timeouts = timeouts or [None] * len(sites)
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(sites)))
+    futures = [executor.submit(check_one, s, t) for s, t in zip(sites, timeouts)]
+    done, _ = wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+    # 不等待還在跑的量測；尚未開始的直接取消
+    executor.shutdown(wait=False, cancel_futures=True)
+    results = []
+    for site, f in zip(sites, futures):
+        if f in done:
+            result = f.result()
+            print(result)  # 每個結果都印到 CloudWatch Logs
+            for datum in result_datums(result):
+                sink.add(datum)
+            results.append(result)
+        elif f.cancel():
+            results.append(None)    # 還沒開始：由呼叫端決定是否回報
+        else:
+            # 已開始但超過預算（例如伺服器很慢地一點一點回傳）：視為逾時
+            result = down_result(site, "probe did not finish within the invocation budget")
+            print(result)
+            sink.add(metric_datums(site.url, 0, None)[0])   # 只寫 Availability
+            results.append(result)
+    return results
+
+
+def down_result(site, error):
+    # 沒有完成量測、直接判定為不可用的結果（與 check_one 相同欄位）
+    return {
+        "target_url": site.url,
+        "availability": 0,
+        "latency_ms": None,
+        "body_ms": None,
+        "body_bytes": None,
+        "status_code": None,
+        "error": error,
+        "connection": "cold",
+        "phases_ms": {},
+    }
+
+
+def probe_budget(context):
+    # 量測可用的秒數；沒有 context（本機 / 測試）時為 None（不限制）
+    remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if remaining is None:
+        return None
+    return max(0.0, (remaining() - BUDGET_RESERVE_MS) / 1000)
+
+
+def plan_timeouts(sites, breakers, budget, concurrency, rounds=1, spread=0.0):
+    # 每站的逾時（秒）：
+    #   - breaker open 的網站：不超過 circuit_breaker.OPEN_TIMEOUT
+    #   - 有預算時：不超過「預算平均分給每一輪併發量測」的值（至少 MIN_PROBE_TIMEOUT）
+    fair = None
+    if budget is not None and sites:
+        waves = math.ceil(len(sites) / concurrency) * rounds
+        fair = max(MIN_PROBE_TIMEOUT, (budget - spread) / waves)
+    timeouts = []
+    for site in sites:
+        timeout = site.timeout
+        if breakers.is_open(site.url):
+            timeout = min(timeout, circuit_breaker.OPEN_TIMEOUT)
+        if fair is not None:
+            timeout = min(timeout, fair)
+        timeouts.append(round(timeout, 3))
+    return timeouts
+
+
+def histogram_datum(name, url, values, unit):
+    # 多個樣本 → Values / Counts（相同數值合併計數）
+    counts = {}
+    for v in values:
+        counts[float(v)] = counts.get(float(v), 0) + 1
+    return {
+        "MetricName": name,
+        "Dimensions": [{"Name": "Site", "Value": url}],
+        "Values": list(counts),
+        "Counts": [float(c) for c in counts.values()],
+        "Unit": unit
+    }
+
+
+def sample_datums(url, samples):
+    # 多次取樣的指標：每個指標一個 datum，樣本以直方圖表示
+    datums = [
+        histogram_datum("Availability", url, [s["availability"] for s in samples], "Count"),
+        histogram_datum("Latency", url, [s["latency_ms"] or 0.0 for s in samples], "Milliseconds"),
+    ]
+    answered = [s for s in samples if s["status_code"] is not None]
+    for phase, name in PHASE_METRICS.items():
+        values = [s["phases_ms"][phase] for s in answered if s["phases_ms"].get(phase) is not None]
+        if values:
+            datums.append(histogram_datum(name, url, values, "Milliseconds"))
+    return datums
+
+
+def aggregate_samples(site, samples):
+    # 把 K 次取樣彙總成一筆結果（與 check_one 相同欄位，另附 samples）
+    #   - availability：至少一半的樣本可用才算可用（單一慢 / 失敗樣本不會誤報）
+    #   - latency_ms / phases_ms：中位數（逾時的樣本沒有延遲，不列入）
+    from statistics import median   # 只有多次取樣才需要，不放在 cold start 的 import 路徑上
+    ups = sum(s["availability"] for s in samples)
+    last = samples[-1]
+    errors = [s["error"] for s in samples if s["error"]]
+    answered = [s for s in samples if s["status_code"] is not None]
+    latencies = [s["latency_ms"] for s in samples if s["latency_ms"] is not None]
+    phases = {}
+    for phase in PHASE_METRICS:
+        values = [s["phases_ms"][phase] for s in answered if phase in s["phases_ms"]]
+        if values:
+            phases[phase] = round(median(values), 2)
+    return {
+        "target_url": site.url,
+        "availability": 1 if ups * 2 >= len(samples) else 0,
+        "latency_ms": round(median(latencies), 2) if latencies else None,
+        "body_ms": phases.get("body"),
+        "body_bytes": last.get("body_bytes"),
+        "status_code": last["status_code"],
+        "error": errors[-1] if errors else None,
+        "connection": last["connection"],
+        "phases_ms": phases,
+        "samples": samples,
+    }
+
+
+def probe_sampled(sites, sink, concurrency, k, spread, timeouts=None, deadline=None):
+    # 每站量測 k 次：第 r 輪在 spread * r / k 秒時開始，每輪併發量測所有網站
+    # deadline 之前來不及完成的後續輪次不再量測（樣本數少於 k）
+    # 每一輪的 deadline 處理與 probe_all 相同：到時還在跑的樣本視為逾時（down_result），
+    # 還沒開始的取消，不等待任何一個量測；一個樣本都沒有的網站回傳 None（由呼叫端決定是否回報）
+    if not sites:
+        return []
+    timeouts = timeouts or [None] * len(sites)
+    longest = max(t or s.timeout for s, t in zip(sites, timeouts))
+    samples = [[] for _ in sites]
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(sites)))
+    try:
+        for r in range(k):
+            delay = start + spread * r / k - time.monotonic()
+            if r and deadline is not None and time.monotonic() + max(delay, 0) + longest > deadline:
+                break
+            if delay > 0:
+                time.sleep(delay)
+            futures = [executor.submit(check_one, s, t) for s, t in zip(sites, timeouts)]
+            done, pending = wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            for site, f, site_samples in zip(sites, futures, samples):
+                if f in done:
+                    site_samples.append(f.result())
+                elif not f.cancel():
+                    site_samples.append(down_result(site, "probe did not finish within the invocation budget"))
+            if pending:
+                break   # 預算用完：不再開始下一輪
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for site, site_samples in zip(sites, samples):
+        if not site_samples:
+            results.append(None)
+            continue
+        result = aggregate_samples(site, site_samples)
+        print({key: v for key, v in result.items() if key != "samples"})
+        for datum in sample_datums(site.url, result["samples"]):
+            sink.add(datum)
+        results.append(result)
+    return results
+
+
+def make_shards(urls, size):
+    # 依序切成每片最多 size 個網址
+    return [urls[i:i + size] for i in range(0, len(urls), size)]
+
+
+def dispatch_shards(urls, queue_url, size):
+    # Dispatcher：把分片送進 SQS，每則訊息一個分片
+    shards = make_shards(urls, size)
+    entries = [
+        {
+            "Id": str(i),
+            "MessageBody": json.dumps({"shard": i, "shards": len(shards), "sites": shard}),
+        }
+        for i, shard in enumerate(shards)
+    ]
+
+    failed = 0
+    for i in range(0, len(entries), SQS_BATCH_LIMIT):
+        resp = sqs_client().send_message_batch(QueueUrl=queue_url, Entries=entries[i:i + SQS_BATCH_LIMIT])
+        for f in resp.get("Failed", []):
+            failed += 1
+            print({"dispatch_error": f.get("Message"), "shard": f.get("Id")})
+
+    summary = {"ok": failed == 0, "mode": "dispatch", "sites": len(urls),
+               "shards": len(shards), "failed_shards": failed}
+    print(summary)
+    return summary
+
+
+def is_shard_event(event):
+    # SQS 觸發的事件：每筆 record 都來自 aws:sqs
+    records = event.get("Records") if isinstance(event, dict) else None
+    return bool(records) and all(r.get("eventSource") == "aws:sqs" for r in records)
 
-    if not os.path.exists(sites_path):
+
+def shard_urls(event):
+    # 從 SQS 訊息取出分片中的網址（多則訊息時依序合併）
+    urls = []
+    for record in event["Records"]:
+        body = json.loads(record["body"])
+        urls.extend(u.strip() for u in body.get("sites", []) if isinstance(u, str) and u.strip())
+    return urls
+
+
+def load_sites():
+    # 回傳 (Registry, None) 或 (None, 錯誤訊息)
+    try:
+        # SITES_FILE 可指定其他設定檔（本機測試 / benchmark 用），預設為同資料夾的 sites.json
+        return site_registry.load_registry(os.environ.get("SITES_FILE", site_registry.SITES_PATH)), None
+    except FileNotFoundError:
         # 沒有網站清單檔案，直接回報錯誤
-        msg = "sites.json not found under /lambda"
-        print({"ok": False, "error": msg})
-        return {"ok": False, "error": msg}
+        return None, "sites.json not found under /lambda"
+    except Exception as e:
+        return None, f"failed to load sites.json: {e}"
+
 
+def run_probes(sites, context=None):
+    # 併發量測 sites，並把指標一次寫入 CloudWatch
+    # context：Lambda context，用來計算這次執行的時間預算
+    namespace = os.environ.get("METRIC_NAMESPACE", "WebHealth")
+    sink = make_sink(namespace, cloudwatch_client, os.environ.get("METRIC_MODE"), os.environ.get("PROBE_REGION"))
+
+    budget = probe_budget(context)
+    deadline = None if budget is None else time.monotonic() + budget
+    breakers = circuit_breaker.BREAKERS
+    baselines = baseline.BASELINES
+    # 有 STATE_TABLE 才另外保存 breaker / 基準線狀態；否則只留在 container 內
+    persist_store = state_store.default_store() if os.environ.get("STATE_TABLE") else None
     try:
-        # 讀取並解析 JSON
-        with open(sites_path, "r", encoding="utf-8") as f:
-            sites = json.load(f)
-        # 確認資料型態是陣列
-        if not isinstance(sites, list):
-            raise ValueError("sites.json must be a JSON array of URLs")
+        breakers.load([s.url for s in sites], persist_store)
+        baselines.load([s.url for s in sites], persist_store)
     except Exception as e:
-        print({"ok": False, "error": f"failed to load sites.json: {e}"})
-        return {"ok": False, "error": f"failed to load sites.json: {e}"}
+        print({"state_error": str(e)})
+    # 健康的網站先量測，breaker open 的排在最後（預算不夠時被略過的是已知掛掉的網站）
+    sites = sorted(sites, key=lambda s: breakers.is_open(s.url))
+
+    k = samples_per_run()
+    spread = sample_spread() if k > 1 else 0.0
+    timeouts = plan_timeouts(sites, breakers, budget, max_concurrency(), k, spread)
+    if k > 1:
+        results = probe_sampled(sites, sink, max_concurrency(), k, spread, timeouts, deadline)
+    else:
+        results = probe_all(sites, sink, max_concurrency(), timeouts, deadline)
 
-    results = []  # 收集所有網站的量測結果
+    probed, final, skipped = [], [], 0
+    for site, result in zip(sites, results):
+        if result is None:
+            if not breakers.is_open(site.url):
+                skipped += 1    # 預算用完、沒量到的健康網站：不寫指標，仍保持到期，下一個 tick 再量
+                continue
+            result = down_result(site, "circuit open: skipped, invocation budget exhausted")
+            print(result)
+            sink.add(metric_datums(site.url, 0, None)[0])   # 只寫 Availability
+        probed.append(site)
+        final.append(result)
+    results = final
+    if skipped:
+        print({"budget_exhausted": True, "skipped": skipped})
 
-    #--------------------執行 寫入 CloudWatch------------------------------------------------
-    for url in sites:  # 逐一讀取 JSON 裡的網址
-        # 略過不是字串的項目，避免壞資料造成錯誤
-        if not isinstance(url, str) or not url.strip():
+    # 延遲基準線：有收到回應的量測更新基準線，並上報偏離自己平常的程度（LatencyAnomaly）
+    observed = []
+    for result in results:
+        if result["status_code"] is None or result["latency_ms"] is None:
             continue
-        url = url.strip()  # 去除空白
-        result = check_one(url)  # 測試網站
-        print(result)  # 每個結果都印到 CloudWatch Logs
+        result["anomaly_score"] = baselines.observe(result["target_url"], result["latency_ms"])
+        sink.add(anomaly_datum(result["target_url"], result["anomaly_score"]))
+        observed.append(result["target_url"])
+
+    # 🟢 所有網站量測完後，一次把指標寫入 CloudWatch
+    sink.flush()
+
+    # 原始結果寫入 archive（沒設定 sink 就略過）；失敗不影響量測結果
+    try:
+        sink_archive = archive.default_sink()
+        if sink_archive is not None:
+            archive.write_run(sink_archive, results)
+    except Exception as e:
+        print({"archive_error": str(e)})
 
-        # 🟢 把量測結果寫入 CloudWatch Metrics
+    if adaptive_schedule():
+        # 依結果更新每站的 next_due；失敗只記錄，下一個 tick 仍會量測這些網站
         try:
-            namespace = os.environ.get("METRIC_NAMESPACE", "WebHealth")
-            put_metrics(namespace, url, result["availability"], result["latency_ms"])
+            scheduler.record_results(probed, results, state_store.default_store(), time.time())
         except Exception as e:
-            # 若發送 Metrics 失敗，記錄錯誤但不中斷
-            print({"metric_error": str(e), "site": url})
+            print({"schedule_error": str(e)})
 
-        # 將結果加入總表
-        results.append(result)
+    try:
+        breakers.record_many(results, persist_store, time.time())
+        baselines.save(observed, persist_store)
+    except Exception as e:
+        print({"state_error": str(e)})
 
     # 回傳彙總結果（方便測試/除錯）
-    return {"ok": True, "count": len(results), "results": results}
+    return {"ok": True, "count": len(results), "skipped": skipped, "results": results}
+
+
+def handler(event, context):
+    # Lambda 主要進入點：
+    #   - SQS 事件（worker）：只量測訊息中的分片
+    #   - 其他（排程）：讀 sites.json；有 SHARD_QUEUE_URL 就分片派送，否則直接併發量測
+    registry, error = load_sites()
+
+    if is_shard_event(event):
+        # worker：分片中的網址依 registry 取得設定；registry 讀不到時使用預設設定
+        urls = shard_urls(event)
+        return run_probes([registry.get(u) if registry else site_registry.Site(url=u) for u in urls], context)
+
+    if error:
+        print({"ok": False, "error": error})
+        return {"ok": False, "error": error}
+
+    sites = list(registry)
+    if adaptive_schedule():
+        # tick：只挑出到期的網站
+        sites = scheduler.select_due(registry, state_store.default_store(), time.time())
+
+    queue_url = os.environ.get("SHARD_QUEUE_URL")
+    if queue_url:
+        if adaptive_schedule():
+            # 先取得租約再派送：worker 回報結果前，之後的 tick 不會重送同一批網站
+            scheduler.lease(sites, state_store.default_store(), time.time())
+        return dispatch_shards([s.url for s in sites], queue_url, shard_size())
+    return run_probes(sites, context)
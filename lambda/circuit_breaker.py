@@ -0,0 +1,66 @@
+# lambda/circuit_breaker.py
+# 功能：每站的 circuit breaker，讓已知掛掉的網站不會吃掉整個 invocation 的時間預算。
+# 說明：
+#   - 連續 FAILURE_THRESHOLD 次不可用 → breaker 打開（open）。
+#   - open 的網站仍會量測（確認是否恢復），但只給 OPEN_TIMEOUT 的短逾時，並排在最後；
+#     時間預算用完時直接回報為不可用，不再量測。量測成功一次就關閉（closed）。
+#   - 狀態放在 container 內（BREAKERS），warm invocation 直接沿用；
+#     有 STATE_TABLE 時另外透過 state_store 保存（kind = "breaker"），
+#     每次 invocation 開始時重新讀取（別的 container 可能更新過），之後只寫回有變化的網站。
+
+import threading
+
+import state_store
+
+FAILURE_THRESHOLD = 3     # 連續幾次不可用就打開 breaker
+OPEN_TIMEOUT = 2.0        # open 的網站的量測逾時（秒）
+
+STATE_KIND = "breaker"
+
+
+class CircuitBreakers:
+    # dict[網址] = {"failures": 連續失敗次數, "opened": 打開的時間（epoch 秒）}
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, urls, store):
+        state_store.load_states(self._states, self._lock, store, STATE_KIND, urls, lambda: {"failures": 0})
+
+    def is_open(self, url):
+        with self._lock:
+            return self._states.get(url, {}).get("failures", 0) >= FAILURE_THRESHOLD
+
+    def record(self, url, available, now):
+        # 記錄一次量測結果；回傳新狀態（沒有變化時回傳 None）
+        with self._lock:
+            state = self._states.get(url, {"failures": 0})
+            if available:
+                new = {"failures": 0}
+            else:
+                new = {"failures": state.get("failures", 0) + 1, "opened": state.get("opened")}
+                if new["failures"] >= FAILURE_THRESHOLD and not new["opened"]:
+                    new["opened"] = now
+            if new.get("opened") is None:
+                new.pop("opened", None)
+            self._states[url] = new
+            return None if new == state else new
+
+    def record_many(self, results, store, now):
+        # results：check_one 格式的結果；有 store 時保存有變化的網站
+        changed = {}
+        for result in results:
+            new = self.record(result["target_url"], result["availability"], now)
+            if new is not None:
+                changed[result["target_url"]] = new
+        if changed and store is not None:
+            store.put_many(STATE_KIND, changed)
+        return changed
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+
+BREAKERS = CircuitBreakers()
@@ -0,0 +1,103 @@
+# lambda/content_check.py
+# 功能：一邊讀取回應 body 一邊做內容檢查（關鍵字 / regex / 大小 / SHA-256），不把整個 body 放進記憶體。
+# 說明：
+#   - http_pool.request(..., body_consumer=ContentMatcher(check)) 會把 body 分塊交給 feed()，
+#     最多讀 limit bytes（硬上限）；feed() 回傳 False 表示已經不需要再讀，連線會直接關閉。
+#     limit 比上限多 1 byte：讀到第 max_read_bytes + 1 個 byte 才算超過上限，剛好等於上限的 body 不算。
+#     真正讀到結尾（EOF）時 http_pool 會呼叫 finish()；提早停止（檢查都通過、或碰到上限）不算讀完。
+#   - 關鍵字跨 chunk 邊界也找得到：保留上一塊結尾（最長關鍵字長度 - 1）的 bytes 一起比對。
+#   - regex 在一個滑動視窗（REGEX_WINDOW）上比對，能找到長度不超過視窗的符合字串。
+#   - SHA-256 以 hashlib 增量計算；只有讀到 EOF 時 digest 才是完整 body 的雜湊，否則為 None。
+#     body 超過上限時無法驗證，視為失敗。
+#   - 讀完後以 error() 取得第一個不符合的檢查（全部符合時為 None）。
+#   - reset() 回到尚未讀取的狀態：重用的連線失效、http_pool 換新連線重送時，前一次讀到的部分不能算進去。
+
+import hashlib
+
+REGEX_WINDOW = 64 * 1024     # regex 比對的滑動視窗大小
+
+
+class ContentMatcher:
+    # 單次請求的內容檢查狀態（check：site_registry.ContentCheck）
+
+    def __init__(self, check):
+        self.check = check
+        self.limit = check.max_read_bytes + 1                  # 多讀 1 byte 就知道超過上限
+        if check.max_bytes is not None:
+            self.limit = min(self.limit, check.max_bytes + 1)
+        self._keep = max((len(k) for k in check.contains), default=1) - 1
+        self.reset()
+
+    def reset(self):
+        check = self.check
+        self.bytes_read = 0
+        self.eof = False
+        self.missing = list(check.contains)
+        self.regex_found = check.regex is None
+        self._hasher = hashlib.sha256()
+        self._tail = b""
+        self._window = b""
+
+    def feed(self, chunk):
+        # 回傳 True 表示還需要更多資料
+        # 超過 max_read_bytes 的部分（偵測用的那 1 byte）只計數，不參與比對
+        room = self.check.max_read_bytes - self.bytes_read
+        self.bytes_read += len(chunk)
+        chunk = chunk[:max(0, room)]
+        self._hasher.update(chunk)
+        if self.missing:
+            data = self._tail + chunk
+            self.missing = [k for k in self.missing if k not in data]
+            self._tail = data[-self._keep:] if self._keep else b""
+        if not self.regex_found:
+            window = self._window + chunk
+            if self.check.regex.search(window):
+                self.regex_found = True
+                self._window = b""
+            else:
+                self._window = window[-REGEX_WINDOW:]
+        return self.needs_more()
+
+    def needs_more(self):
+        check = self.check
+        return bool(
+            self.missing
+            or not self.regex_found
+            or check.sha256
+            or check.max_bytes is not None
+            or (check.min_bytes is not None and self.bytes_read < check.min_bytes)
+        )
+
+    def finish(self):
+        # 讀到 body 結尾（http_pool 在 read() 回傳空字串時呼叫）
+        self.eof = True
+
+    @property
+    def capped(self):
+        # body 超過 max_read_bytes：之後的內容沒有看到
+        return self.bytes_read > self.check.max_read_bytes
+
+    @property
+    def digest(self):
+        # 完整 body 的 SHA-256；沒有讀到 EOF（提早停止、超過上限）時為 None
+        return self._hasher.hexdigest() if self.eof else None
+
+    def error(self):
+        check = self.check
+        within = f" in first {check.max_read_bytes} bytes" if self.capped else ""
+        if check.max_bytes is not None and self.bytes_read > check.max_bytes:
+            return f"Content Error: body larger than {check.max_bytes} bytes"
+        if check.min_bytes is not None and self.bytes_read < check.min_bytes:
+            return f"Content Error: body is {self.bytes_read} bytes, expected at least {check.min_bytes}"
+        if self.missing:
+            return f"Content Error: {self.missing[0].decode('utf-8', errors='replace')!r} not found{within}"
+        if not self.regex_found:
+            return f"Content Error: regex {check.regex.pattern.decode('utf-8', errors='replace')!r} not matched{within}"
+        if check.sha256:
+            if self.capped:
+                return f"Content Error: body exceeds {check.max_read_bytes} bytes, cannot verify sha256"
+            if self.digest is None:
+                return "Content Error: body not fully read, cannot verify sha256"
+            if self.digest != check.sha256:
+                return f"Content Error: sha256 changed ({self.digest[:12]}...)"
+        return None
@@ -0,0 +1,294 @@
+# lambda/http_pool.py
+# 功能：在 Lambda container 的生命週期內重複使用 HTTP 連線。
+# 說明：
+#   - 模組層級的物件（DNS 快取、連線池、TLS session）在 warm invocation 間會保留，
+#     同一個 host 第二次之後的量測可省掉 DNS 查詢、TCP 連線與 TLS 交握。
+#   - 每次請求都會回報這次是 "cold"（新建連線）還是 "reused"（沿用 keep-alive 連線），
+#     讓延遲數字保持誠實、可分開比較。
+#   - 每次請求回報各階段耗時（毫秒）：dns / connect / tls / ttfb / body；
+#     沿用既有連線時 dns / connect / tls 為 0。
+#   - 沒有 body_consumer 時仍會讀完 body（最多 MAX_DRAIN_BYTES），連線才能重用；讀取時間記在 phases["body"]，
+#     呼叫端（canary_handler）不把它算進 Latency。
+#   - 可傳入 body_consumer（例如 content_check.ContentMatcher）：最終回應的 body 會分塊
+#     交給 consumer.feed()，最多讀 consumer.limit bytes，不把整個 body 放進記憶體。
+#   - 重用的連線已被伺服器關閉時換新連線重試一次；重試前把 phases 還原成這個 hop 開始前的值、
+#     並呼叫 consumer.reset()，失敗那次的耗時與讀到的部分 body 不會混進結果。
+#   - 只使用 Python 內建模組（http.client / socket / ssl）。
+
+import os
+import socket
+import ssl
+import threading
+import time
+import http.client
+import urllib.parse
+
+DNS_TTL_SECONDS = float(os.environ.get("DNS_TTL_SECONDS", "60"))  # DNS 快取有效時間
+MAX_IDLE_PER_HOST = 4         # 每個 host 最多保留幾條閒置連線
+MAX_REDIRECTS = 5             # 與 urllib 類似，跟隨轉址的上限
+MAX_DRAIN_BYTES = 1024 * 1024 # 讀完 body 才能重用連線；超過此大小就直接關閉連線
+READ_CHUNK = 16 * 1024        # 串流讀取 body 時每次讀取的大小
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PHASES = ("dns", "connect", "tls", "ttfb", "body")  # 量測的階段（依發生順序）
+
+# 連線中斷類錯誤：若發生在「重用」的連線上，多半是伺服器已關閉閒置連線，可重試一次
+STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError,
+                BrokenPipeError, http.client.BadStatusLine)
+
+
+class DnsCache:
+    # 以 (host, port) 為 key 的 DNS 快取，過期後才重新查詢
+    # 快取整個位址清單（例如 IPv6 + IPv4、多個 A record），連線時依序嘗試，與 socket.create_connection 相同
+
+    def __init__(self, ttl=DNS_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        # 回傳 [(family, sockaddr), ...]，以及這次是否命中快取
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry and entry[1] > now:
+                return entry[0], True
+
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addrs = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+        with self._lock:
+            self._entries[(host, port)] = (addrs, now + self.ttl)
+        return addrs, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+DNS = DnsCache()
+TLS_CONTEXT = ssl.create_default_context()
+TLS_SESSIONS = {}              # (host, port) -> ssl.SSLSession，讓新連線也能做 session resumption
+TLS_SESSIONS_LOCK = threading.Lock()
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def _open_socket(host, port, timeout, phases):
+    # 透過 DNS 快取取得位址後建立 TCP 連線；dns / connect 耗時寫入 phases
+    # 依序嘗試每個位址，第一個連得上的就用；connect 耗時包含前面失敗的嘗試
+    t0 = time.perf_counter()
+    addrs, _ = DNS.resolve(host, port)
+    t1 = time.perf_counter()
+    phases["dns"] = _ms(t1 - t0)
+    error = None
+    for family, sockaddr in addrs:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(sockaddr)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        phases["connect"] = _ms(time.perf_counter() - t1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    phases["connect"] = _ms(time.perf_counter() - t1)
+    raise error or OSError(f"getaddrinfo returned no addresses for {host}")
+
+
+class PooledHTTPConnection(http.client.HTTPConnection):
+    # HTTP 連線：改用 DNS 快取建立 socket
+    # phases：最近一次 connect() 的 dns / connect / tls 耗時
+
+    def connect(self):
+        self.phases = {"dns": 0.0, "connect": 0.0, "tls": 0.0}
+        self.sock = _open_socket(self.host, self.port, self.timeout, self.phases)
+
+
+class PooledHTTPSConnection(http.client.HTTPSConnection):
+    # HTTPS 連線：DNS 快取 + 沿用同 host 上一次的 TLS session
+
+    def connect(self):
+        self.phases = {"dns": 0.0, "connect": 0.0, "tls": 0.0}
+        sock = _open_socket(self.host, self.port, self.timeout, self.phases)
+        with TLS_SESSIONS_LOCK:
+            session = TLS_SESSIONS.get((self.host, self.port))
+        t0 = time.perf_counter()
+        try:
+            self.sock = TLS_CONTEXT.wrap_socket(sock, server_hostname=self.host, session=session)
+        except Exception:
+            sock.close()
+            raise
+        self.phases["tls"] = _ms(time.perf_counter() - t0)
+
+    def remember_session(self):
+        # TLS 1.3 的 session ticket 在交握後才送達，因此在讀完回應後再記錄
+        if self.sock is not None and getattr(self.sock, "session", None) is not None:
+            with TLS_SESSIONS_LOCK:
+                TLS_SESSIONS[(self.host, self.port)] = self.sock.session
+
+
+class ConnectionPool:
+    # 依 (scheme, host, port) 保留閒置的 keep-alive 連線
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, host, port, timeout):
+        # 回傳 (連線, 是否為重用的連線)
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        return self.new_connection(scheme, host, port, timeout), False
+
+    def new_connection(self, scheme, host, port, timeout):
+        if scheme == "https":
+            # 傳入共用的 TLS_CONTEXT：否則 HTTPSConnection 每次都建立新的 context、重新載入 CA bundle
+            # （每條連線數十毫秒的 CPU，且持有 GIL，會拖慢其他量測）
+            return PooledHTTPSConnection(host, port, timeout=timeout, context=TLS_CONTEXT)
+        return PooledHTTPConnection(host, port, timeout=timeout)
+
+    def release(self, scheme, host, port, conn):
+        # 放回連線池；超過上限就直接關閉
+        if isinstance(conn, PooledHTTPSConnection):
+            conn.remember_session()
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+POOL = ConnectionPool()
+
+
+def _split(url):
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+        raise ValueError(f"unsupported URL scheme: {parts.scheme!r}")
+    host = parts.hostname
+    if not host:
+        raise ValueError(f"URL has no host: {url}")
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return scheme, host, port, path
+
+
+def _read_body(resp, consumer):
+    # 回傳讀取的 bytes 數
+    # 沒有 consumer：讀完（最多 MAX_DRAIN_BYTES）後丟棄；有 consumer：分塊交給 consumer
+    if consumer is None:
+        return len(resp.read(MAX_DRAIN_BYTES + 1))
+    nbytes = 0
+    while nbytes < consumer.limit:
+        chunk = resp.read(min(READ_CHUNK, consumer.limit - nbytes))
+        if not chunk:
+            consumer.finish()     # 真的讀到結尾；碰到 limit 或 consumer 不需要再讀時不算
+            break
+        nbytes += len(chunk)
+        if not consumer.feed(chunk):
+            break
+    return nbytes
+
+
+def _send_once(conn, method, path, headers, phases, consumer=None):
+    # 送出一次請求並讀完（或放棄）body；回傳 (response, 連線是否可重用, body bytes)
+    # 各階段耗時累加到 phases（轉址時每個 hop 都會加總）
+    # consumer 只處理最終回應的 body，轉址回應照常丟棄
+    if conn.sock is None:
+        # 先明確建立連線，才能把 connect 與 TTFB 分開計時
+        try:
+            conn.connect()
+        finally:
+            for name, value in getattr(conn, "phases", {}).items():
+                phases[name] += value
+
+    t0 = time.perf_counter()
+    conn.request(method, path, headers=headers)
+    resp = conn.getresponse()
+    t1 = time.perf_counter()
+    phases["ttfb"] += _ms(t1 - t0)
+    redirect = resp.status in REDIRECT_CODES and resp.getheader("Location")
+    nbytes = _read_body(resp, None if redirect else consumer)
+    phases["body"] += _ms(time.perf_counter() - t1)
+    # body 讀到結尾時 http.client 會把 response 標記為 closed；沒讀完就不能重用
+    reusable = resp.isclosed() and not resp.will_close
+    return resp, reusable, nbytes
+
+
+def request(url, timeout=10, method="GET", headers=None, phases=None, body_consumer=None):
+    # 送出 HTTP(S) 請求並跟隨轉址
+    # 回傳 {"status": int, "reason": str, "url": 最終網址, "reused": bool, "phases": {...},
+    #       "body_bytes": 最終回應讀取的 bytes 數}
+    # reused 只有在所有 hop 都沿用既有連線時才為 True
+    # 可傳入 phases dict 由呼叫端持有，請求失敗時仍能看到已完成階段的耗時
+    if phases is None:
+        phases = {}
+    for name in PHASES:
+        phases.setdefault(name, 0.0)
+    headers = dict(headers or {})
+    headers.setdefault("User-Agent", "WebHealth-Canary/1.0")
+    headers.setdefault("Connection", "keep-alive")
+    reused_all = True
+
+    for _ in range(MAX_REDIRECTS + 1):
+        scheme, host, port, path = _split(url)
+        conn, reused = POOL.acquire(scheme, host, port, timeout)
+        before = dict(phases)   # 這個 hop 開始前的耗時（重試時還原）
+        try:
+            try:
+                resp, reusable, nbytes = _send_once(conn, method, path, headers, phases, body_consumer)
+            except STALE_ERRORS:
+                if not reused:
+                    raise
+                # 重用的連線已被伺服器關閉：改用新連線重試一次
+                conn.close()
+                conn, reused = POOL.new_connection(scheme, host, port, timeout), False
+                phases.update(before)
+                if body_consumer is not None:
+                    body_consumer.reset()
+                resp, reusable, nbytes = _send_once(conn, method, path, headers, phases, body_consumer)
+        except Exception:
+            conn.close()
+            raise
+
+        reused_all = reused_all and reused
+        if reusable:
+            POOL.release(scheme, host, port, conn)
+        else:
+            conn.close()
+
+        location = resp.getheader("Location")
+        if resp.status in REDIRECT_CODES and location:
+            url = urllib.parse.urljoin(url, location)
+            if resp.status == 303:
+                method = "GET"
+            continue
+
+        return {"status": resp.status, "reason": resp.reason, "url": url, "reused": reused_all,
+                "phases": phases, "body_bytes": nbytes}
+
+    raise http.client.HTTPException(f"too many redirects (>{MAX_REDIRECTS})")
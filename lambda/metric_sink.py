@@ -0,0 +1,184 @@
+# lambda/metric_sink.py
+# 功能：收集一次執行中的所有 CloudWatch 指標，最後一次性輸出。
+# 說明：
+#   - CloudWatchSink：把 datapoints 累積起來，以 API 允許的最大批次呼叫 PutMetricData。
+#     每批同時受 datum 數（MAX_BATCH_SIZE）與請求大小（1 MB）限制：多次取樣的 Values/Counts 直方圖
+#     一個 datum 就可能有幾 KB，1000 個一批會超過上限、整批被拒絕，所以另外依估計的編碼大小切批。
+#   - EmfSink：輸出 CloudWatch Embedded Metric Format (EMF) 到 stdout，
+#     由 CloudWatch Logs 轉成指標，handler 完全不需呼叫 Metrics API。
+#   - 以環境變數 METRIC_MODE 選擇：api（預設）/ emf。
+#   - RegionalSink：多區域部署時包在外層，REGIONAL_METRICS 另外多寫一份帶 Region 維度的 datum。
+#     只帶 Site 的那份在主區域由各區域共同寫入，CloudWatch 直接彙總成「所有區域」的數值；
+#     帶 Region 的那份供 quorum 告警與分區域圖表使用。
+#     （EMF 由 Logs 轉成指標，只會落在 Lambda 所在的區域；跨區域寫入主區域需使用 api 模式）
+
+import json
+import sys
+from urllib.parse import quote
+import threading
+import time
+
+MAX_BATCH_SIZE = 1000        # PutMetricData 單次最多 1000 個 datum
+MAX_REQUEST_BYTES = 900_000  # PutMetricData 請求上限 1 MB，保留約 10% 給 Action / Namespace 與估計誤差
+EMF_MAX_METRICS = 100        # EMF 單一 directive 最多 100 個 metric
+EMF_MAX_VALUES = 100         # EMF 單一 metric 的數值陣列最多 100 個
+REGIONAL_METRICS = ("Availability", "Latency")   # 多區域部署時另外帶 Region 維度的指標
+
+
+class CloudWatchSink:
+    # 累積 datapoints，flush 時以最大批次寫入 PutMetricData
+
+    def __init__(self, namespace, client, batch_size=MAX_BATCH_SIZE, max_bytes=MAX_REQUEST_BYTES):
+        self.namespace = namespace
+        self.client = client
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self._data = []
+        self._lock = threading.Lock()   # add() 會在多個 worker thread 中被呼叫
+
+    def add(self, datum):
+        with self._lock:
+            self._data.append(datum)
+
+    def flush(self):
+        # 回傳實際呼叫 API 的次數；單一批次失敗只記錄錯誤，不影響其他批次
+        with self._lock:
+            data, self._data = self._data, []
+
+        calls = 0
+        for batch in self.batches(data):
+            try:
+                self.client.put_metric_data(Namespace=self.namespace, MetricData=batch)
+                calls += 1
+            except Exception as e:
+                print({"metric_error": str(e), "datapoints": len(batch)})
+        return calls
+
+    def batches(self, data):
+        # 依序切批：每批最多 batch_size 個 datum，估計大小不超過 max_bytes
+        batch, size = [], 0
+        for datum in data:
+            n = encoded_size(datum)
+            if batch and (len(batch) >= self.batch_size or size + n > self.max_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append(datum)
+            size += n
+        if batch:
+            yield batch
+
+
+def encoded_size(datum):
+    # 估計 datum 在 PutMetricData 請求（query 編碼）中的 bytes 數：
+    # 每個欄位都是 "MetricData.member.<n>.<欄位>[.member.<i>[.<子欄位>]]=<值>&"
+    prefix = len("MetricData.member.1000.") + 1
+    size = 0
+    for key, value in datum.items():
+        if not isinstance(value, list):
+            size += prefix + len(key) + 1 + len(quote(str(value), safe=""))
+            continue
+        for i, item in enumerate(value, 1):
+            fields = item.items() if isinstance(item, dict) else [("", item)]
+            for sub, v in fields:
+                size += prefix + len(f"{key}.member.{i}.{sub}=") + len(quote(str(v), safe=""))
+    return size
+
+
+class EmfSink:
+    # 以 EMF 格式輸出：相同維度的 datapoints 合併成一行 JSON log
+
+    def __init__(self, namespace, stream=None):
+        self.namespace = namespace
+        self.stream = stream or sys.stdout
+        self._data = []
+        self._lock = threading.Lock()
+
+    def add(self, datum):
+        with self._lock:
+            self._data.append(datum)
+
+    def flush(self):
+        # 回傳輸出的行數（EMF 不呼叫 API）
+        with self._lock:
+            data, self._data = self._data, []
+
+        # 依維度分組：{(("Site", url),): [datum, ...]}
+        groups = {}
+        for datum in data:
+            key = tuple((d["Name"], d["Value"]) for d in datum.get("Dimensions", []))
+            groups.setdefault(key, []).append(datum)
+
+        lines = 0
+        timestamp = int(time.time() * 1000)
+        for dims, datums in groups.items():
+            for i in range(0, len(datums), EMF_MAX_METRICS):
+                chunk = datums[i:i + EMF_MAX_METRICS]
+                self.stream.write(json.dumps(emf_record(self.namespace, dims, chunk, timestamp)) + "\n")
+                lines += 1
+        self.stream.flush()
+        return lines
+
+
+class RegionalSink:
+    # 包住另一個 sink：REGIONAL_METRICS 的 datum 另外複製一份，多加 Region 維度
+
+    def __init__(self, sink, region, metric_names=REGIONAL_METRICS):
+        self.sink = sink
+        self.region = region
+        self.metric_names = set(metric_names)
+
+    def add(self, datum):
+        self.sink.add(datum)
+        if datum["MetricName"] in self.metric_names:
+            regional = dict(datum)
+            regional["Dimensions"] = list(datum.get("Dimensions", [])) + [{"Name": "Region", "Value": self.region}]
+            self.sink.add(regional)
+
+    def flush(self):
+        return self.sink.flush()
+
+
+def datum_values(datum):
+    # 單一值（Value）或直方圖（Values / Counts）→ 數值清單
+    if "Values" in datum:
+        counts = datum.get("Counts") or [1] * len(datum["Values"])
+        return [v for v, c in zip(datum["Values"], counts) for _ in range(int(c))]
+    return [datum["Value"]]
+
+
+def emf_record(namespace, dims, datums, timestamp):
+    # 組出單行 EMF 物件：維度與數值都是最上層欄位，_aws 只描述 metadata
+    # 同名的 metric 合併成數值陣列（EMF 以陣列表示多個樣本）
+    values, units = {}, {}
+    for d in datums:
+        values.setdefault(d["MetricName"], []).extend(datum_values(d))
+        units.setdefault(d["MetricName"], d.get("Unit", "None"))
+    record = {
+        "_aws": {
+            "Timestamp": timestamp,
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [[name for name, _ in dims]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit in units.items()],
+            }],
+        }
+    }
+    for name, value in dims:
+        record[name] = value
+    for name, vals in values.items():
+        vals = vals[:EMF_MAX_VALUES]
+        record[name] = vals[0] if len(vals) == 1 else vals
+    return record
+
+
+def make_sink(namespace, client_factory, mode=None, region=None):
+    # 依 METRIC_MODE 建立 sink；client_factory 只有在 api 模式才會被呼叫
+    # region：多區域部署時這個量測區域的名稱（PROBE_REGION），指定時包一層 RegionalSink
+    mode = (mode or "api").lower()
+    if mode == "emf":
+        sink = EmfSink(namespace)
+    elif mode == "api":
+        sink = CloudWatchSink(namespace, client_factory())
+    else:
+        raise ValueError(f"unknown METRIC_MODE: {mode}")
+    return RegionalSink(sink, region) if region else sink
@@ -0,0 +1,110 @@
+# lambda/scheduler.py
+# 功能：依每個網站的設定與近期狀態，決定「這一輪 tick 要量測哪些網站」。
+# 說明：
+#   - EventBridge 只負責定期 tick（例如每分鐘一次）；每個網站有自己的 next_due。
+#   - 以 heapq 做 priority queue，依 next_due 取出到期的網站。
+#   - 量測間隔以 sites.json 的 interval 為基準，再依狀態調整：
+#       * 目前不可用（in alarm）          → FAST_INTERVAL（最快）
+#       * 延遲偏離基準線（LatencyAnomaly > baseline.ALARM_SCORE）→ FAST_INTERVAL
+#         延遲告警要連續 LATENCY_EVALUATION_PERIODS 個 5 分鐘 period 都有超標的資料點才會觸發，
+#         放慢到 600 / 1200 秒量測一次的穩定網站不會有連續兩個 period 的資料；
+#         分數一超標就改成每分鐘量測，告警才觸發得了，恢復正常後再回到原本的間隔。
+#       * 最近幾次內狀態有變化（flapping）→ interval 的一半
+#       * 長時間穩定可用                  → interval 的 2 倍 / 4 倍（上限 MAX_INTERVAL）
+#   - 狀態透過 state_store 保存，kind = "schedule"，每站一筆。
+#   - 分片派送時 worker 要等一陣子才會量測、寫回 next_due；dispatcher 送出前先以 lease()
+#     把 next_due 推後 DISPATCH_LEASE_SECONDS（租約），排隊中 / 量測中的網站不會每個 tick 重送。
+#     worker 寫回結果時以正常間隔覆寫；分片遺失（送出失敗、worker 當掉）時租約到期後自動重派。
+
+import heapq
+
+import baseline
+
+FAST_INTERVAL = 60          # 不可用的網站：每分鐘量測
+MIN_INTERVAL = 60           # 任何網站的最短間隔（等於 tick 週期）
+MAX_INTERVAL = 3600         # 穩定網站的最長間隔
+FLAP_WINDOW = 3             # 最近幾次量測內有狀態變化就視為 flapping
+STABLE_STREAK = 12          # 連續可用幾次後放慢
+VERY_STABLE_STREAK = 48     # 連續可用幾次後再放慢一倍
+DUE_SLACK_SECONDS = 5       # tick 時間些微提早也算到期，避免被延到下一個 tick
+DISPATCH_LEASE_SECONDS = 300  # 已派送、尚未回報結果的網站多久後可以再派送
+
+STATE_KIND = "schedule"
+
+
+def next_interval(site, state):
+    # 依網站設定與狀態計算下一次量測的間隔（秒）
+    base = site.interval
+    if not state.get("up", True) or state.get("elevated"):
+        interval = min(base, FAST_INTERVAL)
+    elif state.get("since_change", 0) < FLAP_WINDOW:
+        interval = base // 2
+    elif state.get("streak", 0) >= VERY_STABLE_STREAK:
+        interval = base * 4
+    elif state.get("streak", 0) >= STABLE_STREAK:
+        interval = base * 2
+    else:
+        interval = base
+    return max(MIN_INTERVAL, min(interval, max(MAX_INTERVAL, base)))
+
+
+def update_state(site, state, available, now, anomaly_score=None):
+    # 記錄一次量測結果，回傳新的狀態（含 next_due）
+    up = bool(available)
+    state = dict(state or {})
+    state.pop("elevated", None)
+    if anomaly_score is not None and anomaly_score > baseline.ALARM_SCORE:
+        state["elevated"] = True
+    first = "up" not in state
+    if first or state["up"] != up:
+        # 第一次量測不算 flapping：直接從「已經穩定一陣子」開始
+        state["since_change"] = FLAP_WINDOW if first else 0
+        state["streak"] = 0
+    else:
+        state["since_change"] = state.get("since_change", 0) + 1
+    state["up"] = up
+    state["streak"] = state.get("streak", 0) + 1 if up else 0
+    state["last"] = now
+    state["next_due"] = now + next_interval(site, state)
+    return state
+
+
+def due_sites(registry, states, now, limit=None):
+    # 回傳到期的網站（依 next_due 由早到晚）；沒有狀態的新網站立即到期
+    heap = [(states.get(site.url, {}).get("next_due", 0), i, site) for i, site in enumerate(registry)]
+    heapq.heapify(heap)
+    due = []
+    while heap and heap[0][0] <= now + DUE_SLACK_SECONDS:
+        if limit is not None and len(due) >= limit:
+            break
+        due.append(heapq.heappop(heap)[2])
+    return due
+
+
+def select_due(registry, store, now, limit=None):
+    # 從 store 讀取排程狀態並挑出到期的網站
+    states = store.get_many(STATE_KIND, registry.urls())
+    return due_sites(registry, states, now, limit)
+
+
+def lease(sites, store, now, seconds=DISPATCH_LEASE_SECONDS):
+    # 把即將派送的網站 next_due 推後 seconds 秒；其他狀態保持不變
+    states = store.get_many(STATE_KIND, [s.url for s in sites])
+    leased = {}
+    for site in sites:
+        state = dict(states.get(site.url) or {})
+        state["next_due"] = now + seconds
+        leased[site.url] = state
+    store.put_many(STATE_KIND, leased)
+    return leased
+
+
+def record_results(sites, results, store, now):
+    # 依量測結果更新並保存每站的排程狀態
+    states = store.get_many(STATE_KIND, [s.url for s in sites])
+    updated = {}
+    for site, result in zip(sites, results):
+        updated[site.url] = update_state(site, states.get(site.url), result["availability"], now,
+                                         result.get("anomaly_score"))
+    store.put_many(STATE_KIND, updated)
+    return updated
@@ -0,0 +1,267 @@
+# lambda/site_registry.py
+# 功能：讀取並驗證 sites.json，產生預先編譯好的網站設定（registry）。
+# 說明：
+#   - Lambda（canary_handler）與 CDK（project1/canary_stack.py）共用這個模組，
+#     確保兩邊用同一套規則解析設定檔。
+#   - 只使用 Python 內建模組，CDK synth 時也能直接載入。
+#   - 結果快取在模組層級：只有檔案的 mtime/大小改變且內容 hash 也不同時才重新解析，
+#     warm invocation 不用每次重讀、重驗證。
+#
+# sites.json 格式：JSON 陣列，每個元素可以是
+#   - 字串：網址（其餘欄位用預設值），或
+#   - 物件：
+#       {
+#         "url": "https://example.com/",      # 必填，http / https
+#         "method": "GET",                    # GET / HEAD，預設 GET
+#         "expected_status": [200, 399],      # 單一數字或 [最小, 最大]，預設 200~399
+#         "timeout": 10,                      # 秒，預設 10
+#         "headers": {"Accept": "text/html"}, # 額外的請求標頭
+#         "tags": {"group": "news"},          # 任意標籤（字串 → 字串）
+#         "interval": 300,                    # 希望的量測間隔（秒），預設 300
+#         "content": {                        # 選填：內容檢查（只限 GET，見 content_check.py）
+#           "contains": ["Welcome"],          #   必須出現的字串（單一字串或陣列）
+#           "regex": "<title>[^<]+</title>",  #   必須符合的正規表示式（UTF-8 bytes 比對）
+#           "min_bytes": 1000,                #   body 最小 / 最大大小
+#           "max_bytes": 500000,
+#           "sha256": "<hex>",                #   body 的 SHA-256；內容一變就視為失敗
+#           "max_read_bytes": 1048576         #   最多讀取的 bytes（硬上限），預設 1 MiB
+#         }
+#       }
+
+import hashlib
+import json
+import os
+import re
+import threading
+import urllib.parse
+from dataclasses import dataclass, field
+
+DEFAULT_METHOD = "GET"
+DEFAULT_EXPECTED_STATUS = (200, 399)
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_INTERVAL = 300
+ALLOWED_METHODS = ("GET", "HEAD")
+DEFAULT_MAX_READ_BYTES = 1024 * 1024      # 內容檢查預設最多讀取 1 MiB
+MAX_READ_BYTES_LIMIT = 8 * 1024 * 1024    # max_read_bytes 的上限（函式記憶體只有 256 MB）
+
+SITES_PATH = os.path.join(os.path.dirname(__file__), "sites.json")
+
+
+@dataclass(frozen=True)
+class ContentCheck:
+    # 單一網站的內容檢查（已驗證；字串與 regex 都已轉成 bytes）
+    contains: tuple = ()
+    regex: re.Pattern = None
+    min_bytes: int = None
+    max_bytes: int = None
+    sha256: str = None
+    max_read_bytes: int = DEFAULT_MAX_READ_BYTES
+
+
+@dataclass(frozen=True)
+class Site:
+    # 單一網站的設定（已驗證、不可變）
+    url: str
+    method: str = DEFAULT_METHOD
+    expected_status: tuple = DEFAULT_EXPECTED_STATUS
+    timeout: float = DEFAULT_TIMEOUT
+    headers: dict = field(default_factory=dict, hash=False, compare=False)
+    tags: dict = field(default_factory=dict, hash=False, compare=False)
+    interval: int = DEFAULT_INTERVAL
+    content: ContentCheck = None
+
+    def status_ok(self, status):
+        lo, hi = self.expected_status
+        return status is not None and lo <= status <= hi
+
+
+class Registry:
+    # 依 sites.json 順序保存所有 Site，並提供以網址查詢
+
+    def __init__(self, sites, digest=""):
+        self.sites = tuple(sites)
+        self.digest = digest
+        self._by_url = {s.url: s for s in self.sites}
+
+    def __len__(self):
+        return len(self.sites)
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def urls(self):
+        return [s.url for s in self.sites]
+
+    def get(self, url):
+        # 找不到時（例如分片訊息中的網址已從設定移除）回傳預設設定
+        return self._by_url.get(url) or Site(url=url)
+
+
+def _parse_status(value, where):
+    if isinstance(value, int) and not isinstance(value, bool):
+        lo = hi = value
+    elif isinstance(value, (list, tuple)) and len(value) == 2 and all(
+            isinstance(v, int) and not isinstance(v, bool) for v in value):
+        lo, hi = value
+    else:
+        raise ValueError(f"{where}: expected_status must be an integer or [min, max]")
+    if not (100 <= lo <= hi <= 599):
+        raise ValueError(f"{where}: expected_status out of range: {value}")
+    return (lo, hi)
+
+
+def _parse_str_map(value, where, name):
+    if not isinstance(value, dict) or not all(
+            isinstance(k, str) and isinstance(v, str) for k, v in value.items()):
+        raise ValueError(f"{where}: {name} must be an object of string values")
+    return dict(value)
+
+
+def _parse_size(value, where, name, minimum=0):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"{where}: content.{name} must be an integer >= {minimum}")
+    return value
+
+
+def _parse_content(value, where, method):
+    if not isinstance(value, dict):
+        raise ValueError(f"{where}: content must be an object")
+    unknown = set(value) - {"contains", "regex", "min_bytes", "max_bytes", "sha256", "max_read_bytes"}
+    if unknown:
+        raise ValueError(f"{where}: unknown content field(s): {', '.join(sorted(unknown))}")
+    if method != "GET":
+        raise ValueError(f"{where}: content checks need method GET")
+
+    contains = value.get("contains", [])
+    if isinstance(contains, str):
+        contains = [contains]
+    if not isinstance(contains, list) or not all(isinstance(c, str) and c for c in contains):
+        raise ValueError(f"{where}: content.contains must be a non-empty string or a list of them")
+
+    regex = value.get("regex")
+    if regex is not None:
+        if not isinstance(regex, str) or not regex:
+            raise ValueError(f"{where}: content.regex must be a non-empty string")
+        try:
+            regex = re.compile(regex.encode("utf-8"))
+        except re.error as e:
+            raise ValueError(f"{where}: content.regex is invalid: {e}") from None
+
+    sha256 = value.get("sha256")
+    if sha256 is not None and not (isinstance(sha256, str) and re.fullmatch(r"[0-9a-fA-F]{64}", sha256)):
+        raise ValueError(f"{where}: content.sha256 must be 64 hex characters")
+
+    cap = _parse_size(value.get("max_read_bytes", DEFAULT_MAX_READ_BYTES), where, "max_read_bytes", 1)
+    if cap > MAX_READ_BYTES_LIMIT:
+        raise ValueError(f"{where}: content.max_read_bytes must be <= {MAX_READ_BYTES_LIMIT}")
+    min_bytes = _parse_size(value.get("min_bytes"), where, "min_bytes")
+    max_bytes = _parse_size(value.get("max_bytes"), where, "max_bytes")
+    if max_bytes is not None and max_bytes >= cap:
+        raise ValueError(f"{where}: content.max_bytes must be smaller than max_read_bytes")
+    if min_bytes is not None and (min_bytes > cap or (max_bytes is not None and min_bytes > max_bytes)):
+        raise ValueError(f"{where}: content.min_bytes must be <= max_bytes and max_read_bytes")
+
+    if not (contains or regex or sha256 or min_bytes is not None or max_bytes is not None):
+        raise ValueError(f"{where}: content needs at least one check")
+    return ContentCheck(
+        contains=tuple(c.encode("utf-8") for c in contains),
+        regex=regex,
+        min_bytes=min_bytes,
+        max_bytes=max_bytes,
+        sha256=sha256.lower() if sha256 else None,
+        max_read_bytes=cap,
+    )
+
+
+def parse_site(entry, index):
+    # 驗證單一元素並轉成 Site；錯誤訊息帶上索引方便修正設定檔
+    where = f"sites.json[{index}]"
+    if isinstance(entry, str):
+        entry = {"url": entry}
+    if not isinstance(entry, dict):
+        raise ValueError(f"{where}: must be a URL string or an object")
+
+    unknown = set(entry) - {"url", "method", "expected_status", "timeout", "headers", "tags", "interval",
+                            "content"}
+    if unknown:
+        raise ValueError(f"{where}: unknown field(s): {', '.join(sorted(unknown))}")
+
+    url = entry.get("url")
+    if not isinstance(url, str) or not url.strip():
+        raise ValueError(f"{where}: url is required")
+    url = url.strip()
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"{where}: url must be an absolute http(s) URL: {url}")
+
+    method = str(entry.get("method", DEFAULT_METHOD)).upper()
+    if method not in ALLOWED_METHODS:
+        raise ValueError(f"{where}: method must be one of {', '.join(ALLOWED_METHODS)}")
+
+    timeout = entry.get("timeout", DEFAULT_TIMEOUT)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise ValueError(f"{where}: timeout must be a positive number of seconds")
+
+    interval = entry.get("interval", DEFAULT_INTERVAL)
+    if isinstance(interval, bool) or not isinstance(interval, int) or interval < 60:
+        raise ValueError(f"{where}: interval must be an integer >= 60 seconds")
+
+    return Site(
+        url=url,
+        method=method,
+        expected_status=_parse_status(entry.get("expected_status", list(DEFAULT_EXPECTED_STATUS)), where),
+        timeout=float(timeout),
+        headers=_parse_str_map(entry.get("headers", {}), where, "headers"),
+        tags=_parse_str_map(entry.get("tags", {}), where, "tags"),
+        interval=interval,
+        content=_parse_content(entry["content"], where, method) if "content" in entry else None,
+    )
+
+
+def parse_registry(data, digest=""):
+    # data：已 json.load 的內容；重複的網址只保留第一個
+    if not isinstance(data, list):
+        raise ValueError("sites.json must be a JSON array of URLs or site objects")
+    sites, seen = [], set()
+    for i, entry in enumerate(data):
+        site = parse_site(entry, i)
+        if site.url in seen:
+            continue
+        seen.add(site.url)
+        sites.append(site)
+    return Registry(sites, digest)
+
+
+_CACHE = {}          # path -> (stat_key, digest, registry)
+_CACHE_LOCK = threading.Lock()
+
+
+def load_registry(path=SITES_PATH):
+    # 讀取 sites.json；檔案沒變時直接回傳快取的 Registry
+    # 檔案不存在時丟出 FileNotFoundError，格式錯誤時丟出 ValueError
+    st = os.stat(path)
+    stat_key = (st.st_mtime_ns, st.st_size)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+    if cached and cached[0] == stat_key:
+        return cached[2]
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if cached and cached[1] == digest:
+        # 只有 mtime 變了（例如重新部署相同內容）：沿用已解析的結果
+        registry = cached[2]
+    else:
+        registry = parse_registry(json.loads(raw.decode("utf-8")), digest)
+
+    with _CACHE_LOCK:
+        _CACHE[path] = (stat_key, digest, registry)
+    return registry
+
+
+def clear_cache():
+    with _CACHE_LOCK:
+        _CACHE.clear()
@@ -0,0 +1,121 @@
+# lambda/state_store.py
+# 功能：跨 invocation 保存 canary 的每站狀態（排程、統計等）。
+# 說明：
+#   - 以 (kind, key) 存放小型 JSON 物件，例如 ("schedule", 網址)。
+#   - 設定環境變數 STATE_TABLE 時使用 DynamoDB（BatchGetItem / BatchWriteItem），
+#     否則使用模組層級的記憶體 store（只在同一個 warm container 內有效，適合測試與本機）。
+#   - 分片時每個網址只會出現在一個 worker，因此以「每站一筆」儲存不會互相覆蓋。
+#   - UnprocessedKeys / UnprocessedItems 以指數退避重試 MAX_ATTEMPTS 次。重試後仍讀不到的 key
+#     丟出 StateReadError：回傳缺了幾站的結果，呼叫端會把那幾站當成沒有狀態（例如租約中的網站被重新派送），
+#     不如讓這次讀取失敗，由呼叫端照讀取失敗處理。寫入失敗只記錄，下次 invocation 會再寫。
+
+import json
+import os
+import threading
+import time
+
+BATCH_GET_LIMIT = 100     # BatchGetItem 單次最多 100 個 key
+BATCH_WRITE_LIMIT = 25    # BatchWriteItem 單次最多 25 筆
+MAX_ATTEMPTS = 5          # Unprocessed 重試次數（含第一次）
+BACKOFF_BASE_SECONDS = 0.05
+
+
+class StateReadError(RuntimeError):
+    # 重試後仍有 key 讀不到
+    pass
+
+
+class MemoryStateStore:
+    # 記憶體版本：dict[(kind, key)] = dict
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, kind, keys):
+        with self._lock:
+            return {k: dict(self._data[(kind, k)]) for k in keys if (kind, k) in self._data}
+
+    def put_many(self, kind, values):
+        with self._lock:
+            for k, v in values.items():
+                self._data[(kind, k)] = dict(v)
+
+
+class DynamoStateStore:
+    # DynamoDB 版本：partition key "Key" = "<kind>#<key>"，內容以 JSON 字串存在 "Data"
+
+    def __init__(self, table_name, client):
+        self.table_name = table_name
+        self.client = client
+
+    def get_many(self, kind, keys):
+        keys = list(dict.fromkeys(keys))
+        out = {}
+        for i in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {self.table_name: {"Keys": [{"Key": {"S": f"{kind}#{k}"}} for k in keys[i:i + BATCH_GET_LIMIT]]}}
+            for attempt in range(MAX_ATTEMPTS):
+                if attempt:
+                    time.sleep(BACKOFF_BASE_SECONDS * (2 ** attempt))
+                resp = self.client.batch_get_item(RequestItems=request)
+                for item in resp.get("Responses", {}).get(self.table_name, []):
+                    out[item["Key"]["S"].split("#", 1)[1]] = json.loads(item["Data"]["S"])
+                request = resp.get("UnprocessedKeys") or {}
+                if not request:
+                    break
+            else:
+                missing = len(request[self.table_name]["Keys"])
+                print({"state_error": "unprocessed state reads", "kind": kind, "keys": missing})
+                raise StateReadError(f"{missing} {kind} key(s) still unprocessed after {MAX_ATTEMPTS} attempts")
+        return out
+
+    def put_many(self, kind, values):
+        requests = [
+            {"PutRequest": {"Item": {"Key": {"S": f"{kind}#{k}"},
+                                     "Data": {"S": json.dumps(v, separators=(",", ":"))}}}}
+            for k, v in values.items()
+        ]
+        for i in range(0, len(requests), BATCH_WRITE_LIMIT):
+            pending = {self.table_name: requests[i:i + BATCH_WRITE_LIMIT]}
+            for attempt in range(MAX_ATTEMPTS):
+                if attempt:
+                    time.sleep(BACKOFF_BASE_SECONDS * (2 ** attempt))
+                resp = self.client.batch_write_item(RequestItems=pending)
+                pending = resp.get("UnprocessedItems") or {}
+                if not pending:
+                    break
+            else:
+                print({"state_error": "unprocessed state writes", "kind": kind,
+                       "items": len(pending[self.table_name])})
+
+
+def load_states(states, lock, store, kind, keys, default):
+    # 從 store 重新讀取 keys 的狀態，覆寫進 container 內的 states（在 lock 內更新）
+    # 每次 invocation 都要重新讀取：分片 worker 分散在多個 container，
+    # 同一站上次可能是別的 container 量測並寫回的，container 內的狀態可能已經過期
+    # store 裡沒有的 key（從未保存過）才沿用 container 內的狀態，都沒有時為 default()
+    if not keys or store is None:
+        return
+    loaded = store.get_many(kind, list(keys))
+    with lock:
+        for key in keys:
+            if key in loaded:
+                states[key] = loaded[key]
+            else:
+                states.setdefault(key, default())
+
+
+MEMORY_STORE = MemoryStateStore()
+_DYNAMO_STORE = None
+
+
+def default_store():
+    # 有 STATE_TABLE 就用 DynamoDB（client 第一次用到才建立），否則用記憶體 store
+    global _DYNAMO_STORE
+    table_name = os.environ.get("STATE_TABLE")
+    if not table_name:
+        return MEMORY_STORE
+    if _DYNAMO_STORE is None or _DYNAMO_STORE.table_name != table_name:
+        import boto3
+        _DYNAMO_STORE = DynamoStateStore(table_name, boto3.client("dynamodb"))
+    return _DYNAMO_STORE
@@ -2,7 +2,7 @@
 # 功能：建立一個基本的 Lambda 函數，用於測試網站可用性與延遲。
 
 import os   # ← 讀本機 sites.json 用
-import json
+import importlib.util
 
 from aws_cdk import (
     Stack,
@@ -18,16 +18,71 @@ from aws_cdk import (
     aws_sns_subscriptions as subs,            # ← 新增：SNS 訂閱（SQS/E-mail 等）
     aws_cloudwatch_actions as cw_actions,     # ← 新增：把 Alarm 連到 SNS
     aws_dynamodb as dynamodb,          # ← 新增：NoSQL 資料表
+    aws_lambda_event_sources as lambda_events,  # ← 新增：SQS → Lambda（分片 worker）
+    aws_s3 as s3,                      # ← 新增：原始量測結果 archive
     RemovalPolicy,
+    Token,
 )
 
 from constructs import Construct
 
+from project1.site_alarms import (
+    LATENCY_EVALUATION_PERIODS, MAX_REGIONS, build_alarm_shards, regions_down, site_metric,
+)
+from project1.dashboards import build_overview, build_detail_pages
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "lambda")
+SITES_FILE = os.path.join(LAMBDA_DIR, "sites.json")
+
+
+def _load_lambda_module(name):
+    # lambda/ 不是 Python 套件：依檔案路徑載入與 Lambda 共用的模組
+    spec = importlib.util.spec_from_file_location(name, os.path.join(LAMBDA_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# sites.json 載入
+site_registry = _load_lambda_module("site_registry")
+# 告警歷史表的項目格式（GSI 投影欄位與 Lambda 寫入的格式一致）
+alarm_history = _load_lambda_module("alarm_history")
+# 延遲基準線（告警門檻與 Lambda 排程器「分數超標就加快量測」使用同一個值）
+baseline = _load_lambda_module("baseline")
+
+PER_SITE_ALARM_LIMIT = 50   # alarm_mode="auto"：超過這個網站數就改用 grouped 告警
+
 
 class CanaryStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, *, target_url: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, *, target_url: str,
+                 shard_size: int = 50, max_workers: int = 20, samples_per_run: int = 1,
+                 sites_file: str = SITES_FILE, alarm_mode: str = "auto",
+                 dashboard_page_size: int = 50, alarm_retention_days: int = 90,
+                 regions=(), home_region: str = None, quorum: int = None, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # ---------------- 多區域部署 ----------------
+        # 說明：
+        # - regions 為所有量測區域（每個區域各部署一個 CanaryStack，參數相同、共用同一份 sites.json）
+        # - 各區域的 Lambda 各自由自己的 tick 觸發、並行量測，偵測時間不會隨區域數增加
+        # - 指標一律寫到主區域（home_region，預設 regions[0]），Availability / Latency 另外帶 Region 維度
+        # - 主區域的 stack 才建立告警、Dashboard、告警歷史；其他區域只有量測相關資源
+        # - Availability 告警需要 quorum 個區域（預設過半）同時看到不可用才觸發
+        regions = list(regions)
+        multi_region = bool(regions)
+        if multi_region:
+            home_region = home_region or regions[0]
+            quorum = quorum or len(regions) // 2 + 1
+            if Token.is_unresolved(self.region):
+                raise ValueError("multi-region CanaryStack needs an explicit env region")
+            if self.region not in regions or home_region not in regions:
+                raise ValueError(f"stack region {self.region} and home region {home_region} must be in {regions}")
+            if len(regions) > MAX_REGIONS:
+                raise ValueError(f"at most {MAX_REGIONS} probe regions are supported")
+            if not 1 <= quorum <= len(regions):
+                raise ValueError(f"quorum must be between 1 and {len(regions)}")
+        probe_only = multi_region and self.region != home_region
+
         self.canary_fn = _lambda.Function(
             self,
             "CanaryLambda",
@@ -38,7 +93,11 @@ class CanaryStack(Stack):
             memory_size=256,
             environment={
                 "TARGET_URL": target_url,          # 仍保留（雖然第二階段用不到）
-                "METRIC_NAMESPACE": "WebHealth"    # ← 新增：自訂 CloudWatch Namespace
+                "METRIC_NAMESPACE": "WebHealth",   # ← 新增：自訂 CloudWatch Namespace
+                "MAX_CONCURRENCY": "16",           # ← 新增：同時量測的網站數上限
+                "METRIC_MODE": "api",              # ← 新增：api（批次 PutMetricData）/ emf（寫 Log）
+                "SCHEDULE_MODE": "adaptive",       # ← 新增：每次 tick 只量測到期的網站
+                "SAMPLES_PER_RUN": str(samples_per_run),  # ← 新增：每站每次執行的取樣數
             }
         )
 
@@ -50,167 +109,246 @@ class CanaryStack(Stack):
             )
         )
 
-        # 每 5 分鐘觸發一次這支 Lambda
+        # 每 1 分鐘觸發一次這支 Lambda（tick）
         # 說明：使用 EventBridge Rule 以固定頻率觸發；不用另外給權限。
+        #       每個網站實際的量測頻率由 Lambda 內的排程器決定（見 lambda/scheduler.py），
+        #       不可用的網站每分鐘量測，長期穩定的網站逐步放慢。
         events.Rule(
             self,
-            "CanaryEvery5Min",
-            schedule=events.Schedule.rate(Duration.minutes(5)),   # ← 每 5 分鐘
+            "CanaryTick",
+            schedule=events.Schedule.rate(Duration.minutes(1)),   # ← 每 1 分鐘 tick
             targets=[targets.LambdaFunction(self.canary_fn)]      # ← 目標是上面的 Lambda
         )
 
+        # 每站狀態（排程 next_due 等），dispatcher / worker 共用
+        state_table = dynamodb.Table(
+            self,
+            "CanaryStateTable",
+            partition_key=dynamodb.Attribute(name="Key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,   # 狀態可重建
+        )
+        state_table.grant_read_write_data(self.canary_fn)
+        self.canary_fn.add_environment("STATE_TABLE", state_table.table_name)
 
-
- # ---------------- CloudWatch Dashboard（最小可用版）----------------
+        # ---------------- 分片 fan-out（Dispatcher → SQS → Worker）----------------
         # 說明：
-        # 1) 讀取 lambda/sites.json（與 Lambda 同目錄的網站清單）
-        # 2) 為每個 Site 建立兩個 Metric：Availability（Count）、Latency（Milliseconds）
-        # 3) 建一個 Dashboard，含兩個圖表：Availability 折線圖、Latency 折線圖
-
-        # 讀取網站清單（在 cdk synth/deploy 時於本機讀檔）
-        sites: list[str] = []
-        sites_file = os.path.join(os.path.dirname(__file__), "..", "lambda", "sites.json")
-        try:
-            with open(sites_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    # 僅保留非空白字串
-                    sites = [s.strip() for s in data if isinstance(s, str) and s.strip()]
-        except Exception:
-            # 若讀不到檔案也不阻擋部署，只是 Dashboard 會沒資料線
-            sites = []
-
-        # 建立 Dashboard
-        dashboard = cloudwatch.Dashboard(
+        # - 上面的 CanaryLambda 設定 SHARD_QUEUE_URL 後只負責切分片並送進 SQS
+        # - Worker Lambda 由 SQS 觸發，每次只量測一個分片（batch_size=1）
+        # - max_workers 限制同時執行的 worker 數量，避免一次把帳號併發額度用完
+        shard_queue = sqs.Queue(
             self,
-            "WebHealthDashboard",
-            dashboard_name="WebHealth-Dashboard"  # 你在 Console 會看到的名稱
+            "CanaryShardQueue",
+            visibility_timeout=Duration.seconds(90),       # ≥ worker timeout，避免重複處理
+            retention_period=Duration.minutes(10),         # 過期的分片沒有意義，下一輪會重新派送
         )
 
-        # 準備兩組 metric 清單：左圖 Availability、右圖 Latency
-        availability_metrics: list[cloudwatch.IMetric] = []
-        latency_metrics: list[cloudwatch.IMetric] = []
-
-        # 將每個網站加到圖表系列
-        for site in sites:
-            # Availability（0/1），以 5 分鐘為區間做平均
-            availability_metrics.append(
-                cloudwatch.Metric(
-                    namespace="WebHealth",                # 與 Lambda 上報的 METRIC_NAMESPACE 一致
-                    metric_name="Availability",
-                    dimensions_map={"Site": site},        # 維度：Site=網址
-                    statistic="Average",
-                    period=Duration.minutes(5),
-                    unit=cloudwatch.Unit.COUNT
-                )
-            )
-            # Latency（毫秒），以 5 分鐘為區間做平均
-            latency_metrics.append(
-                cloudwatch.Metric(
-                    namespace="WebHealth",
-                    metric_name="Latency",
-                    dimensions_map={"Site": site},
-                    statistic="Average",
-                    period=Duration.minutes(5),
-                    unit=cloudwatch.Unit.MILLISECONDS
-                )
+        self.worker_fn = _lambda.Function(
+            self,
+            "CanaryWorkerLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="canary_handler.handler",
+            code=_lambda.Code.from_asset("lambda"),
+            timeout=Duration.seconds(15),
+            memory_size=256,
+            environment={
+                "METRIC_NAMESPACE": "WebHealth",
+                "MAX_CONCURRENCY": "16",
+                "METRIC_MODE": "api",
+                "SCHEDULE_MODE": "adaptive",
+                "SAMPLES_PER_RUN": str(samples_per_run),
+                "STATE_TABLE": state_table.table_name,
+            }
+        )
+        state_table.grant_read_write_data(self.worker_fn)
+        self.worker_fn.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["cloudwatch:PutMetricData"],
+                resources=["*"]
             )
-
-        # 圖表 1：Availability 折線圖（0~1）
-        dashboard.add_widgets(
-            cloudwatch.GraphWidget(
-                title="Availability (0 or 1) by Site",  # 圖表標題
-                left=availability_metrics,               # 多條線：每個 Site 一條
-                left_y_axis=cloudwatch.YAxisProps(min=0, max=1),  # 固定 0~1
-                width=24
+        )
+        self.worker_fn.add_event_source(
+            lambda_events.SqsEventSource(
+                shard_queue,
+                batch_size=1,
+                max_concurrency=max(2, max_workers),   # SQS event source 的最小值為 2
             )
         )
 
-        # 圖表 2：Latency 折線圖（毫秒）
-        dashboard.add_widgets(
-            cloudwatch.GraphWidget(
-                title="Latency (ms) by Site",
-                left=latency_metrics,        # 多條線：每個 Site 一條
-                width=24
-            )
+        if multi_region:
+            for fn in (self.canary_fn, self.worker_fn):
+                fn.add_environment("PROBE_REGION", self.region)     # ← Region 維度的值
+                fn.add_environment("METRIC_REGION", home_region)    # ← 指標寫到主區域
+
+        self.canary_fn.add_environment("SHARD_QUEUE_URL", shard_queue.queue_url)
+        self.canary_fn.add_environment("SHARD_SIZE", str(shard_size))
+        shard_queue.grant_send_messages(self.canary_fn)
+
+        # ---------------- Raw probe archive（S3）----------------
+        # 說明：每次 invocation 把原始結果寫成一個壓縮檔（依小時分區），
+        #       可用 lambda/archive_query.py 計算真正的 p95/p99 與任意時間窗的可用率
+        archive_bucket = s3.Bucket(
+            self,
+            "ProbeArchiveBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            lifecycle_rules=[s3.LifecycleRule(expiration=Duration.days(90))],  # 保留 90 天
+            removal_policy=RemovalPolicy.RETAIN,
         )
+        for fn in (self.canary_fn, self.worker_fn):
+            archive_bucket.grant_put(fn)
+            fn.add_environment("ARCHIVE_BUCKET", archive_bucket.bucket_name)
+        CfnOutput(self, "ProbeArchiveBucketName", value=archive_bucket.bucket_name)
+        CfnOutput(self, "CanaryFunctionName", value=self.canary_fn.function_name)
+        CfnOutput(self, "CanaryWorkerFunctionName", value=self.worker_fn.function_name)
+
+        if probe_only:
+            # 其他區域只負責量測；告警 / Dashboard / 告警歷史都在主區域
+            return
+
+
 
+ # ---------------- 網站清單 ----------------
+        # 說明：讀取 lambda/sites.json（與 Lambda 同目錄的網站清單），供告警與 Dashboard 使用
 
+        # 讀取網站清單（在 cdk synth/deploy 時於本機讀檔；與 Lambda 共用 site_registry 解析規則）
+        site_configs = []
+        try:
+            site_configs = list(site_registry.load_registry(sites_file))
+        except FileNotFoundError:
+            # 若讀不到檔案也不阻擋部署，只是 Dashboard 會沒資料線
+            site_configs = []
+        sites: list[str] = [s.url for s in site_configs]
 
- # ---------------- CloudWatch Alarms（最小可用版）----------------
+        # 告警模式：per_site（每站兩個告警，適合少量網站）/ grouped（見 project1/site_alarms.py）
+        if alarm_mode == "auto":
+            alarm_mode = "per_site" if len(sites) <= PER_SITE_ALARM_LIMIT else "grouped"
+        if alarm_mode not in ("per_site", "grouped"):
+            raise ValueError(f"unknown alarm_mode: {alarm_mode}")
+        grouped = alarm_mode == "grouped"
+
+        # ---------------- CloudWatch Alarms（最小可用版）----------------
         # 說明：
         # - 每個 Site 建立兩個告警：
         #   1) Availability < 1  → 視為站點不可用（當期 5 分鐘平均）
-        #   2) Latency > 1000ms → 視為延遲過高
-        # - 先不串 SNS / SQS（之後階段再加），這裡只做最小告警並放到 Dashboard。
-
-        LATENCY_THRESHOLD_MS = 1000  # ← 之後可改：延遲門檻（毫秒）
+        #   2) LatencyAnomaly > 3 → 延遲連續 10 分鐘偏離該站自己的基準線 3 個標準差以上
+        #      （基準線由 Lambda 維護，見 lambda/baseline.py；快網站、遠端網站各自有自己的「平常」，
+        #       不需要每站付費的 CloudWatch anomaly detection band）
+        # - 告警動作在下方串到 SNS / SQS；per_site 模式的告警狀態另外放到總覽 Dashboard。
+        # - 多次取樣（samples_per_run > 1）時，Lambda 以直方圖上報每站的 K 個樣本：
+        #   Availability 改為「一半以上樣本失敗」才告警（基準線使用每次執行的中位數延遲），
+        #   另外加一個 Latency p90 > LATENCY_THRESHOLD_MS 的告警：基準線只看中位數，
+        #   「中位數正常、但一成以上的請求很慢」的情況由 p90 告警負責。
+        # - 網站數超過 PER_SITE_ALARM_LIMIT（或 alarm_mode="grouped"）時改為分組告警，
+        #   避免單一 stack 超過 500 個資源（見 project1/site_alarms.py）。
+        # - 多區域部署時，per_site 的 Availability 告警改為「至少 quorum 個區域不可用」（regions_down）；
+        #   grouped 模式每個運算式已用滿 10 個 metric，改用只帶 Site 的彙總值（各區域樣本的平均），
+        #   門檻換算成「可用的區域少於 N - quorum + 1 個」，是依樣本數加權的近似。
+        #   LatencyAnomaly 也是各區域（各自的基準線）的平均，只有多數區域同時變慢才會明顯升高。
+
+        ANOMALY_THRESHOLD = baseline.ALARM_SCORE  # ← 偏離基準線幾個標準差才告警（改 lambda/baseline.py）
+        LATENCY_THRESHOLD_MS = 1000  # ← 之後可改：多次取樣時 p90 延遲門檻（毫秒）
+        multi_sample = samples_per_run > 1
+        availability_threshold = 0.5 if multi_sample else 1.0
 
         availability_alarms: list[cloudwatch.Alarm] = []
         latency_alarms: list[cloudwatch.Alarm] = []
 
-        for site in sites:
-            # 重新建立對應 Site 的 metric（和上面的圖表一致）
-            m_avail = cloudwatch.Metric(
-                namespace="WebHealth",
-                metric_name="Availability",
-                dimensions_map={"Site": site},
-                statistic="Average",
-                period=Duration.minutes(5),
-                unit=cloudwatch.Unit.COUNT,
-            )
-            m_latency = cloudwatch.Metric(
-                namespace="WebHealth",
-                metric_name="Latency",
-                dimensions_map={"Site": site},
-                statistic="Average",
-                period=Duration.minutes(5),
-                unit=cloudwatch.Unit.MILLISECONDS,
-            )
+        group_availability_threshold = availability_threshold
+        if multi_region:
+            group_availability_threshold = availability_threshold * (len(regions) - quorum + 1) / len(regions)
 
-            # 告警 1：Availability < 1（當期 5 分鐘平均）
-            a1 = cloudwatch.Alarm(
+        if grouped:
+            # 大量網站：每組最多 10 站的 metric-math 告警 + composite 告警，分散到多個 nested stack
+            alarm_shards = build_alarm_shards(
                 self,
-                f"AvailAlarm-{site}",
-                metric=m_avail,
-                threshold=1.0,
-                evaluation_periods=1,  # 只看最近一個 period（5 分鐘）
-                comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
-                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,  # 沒資料不當作告警
-                alarm_description=f"Availability below 1 for {site}",
+                site_configs,
+                latency_threshold=ANOMALY_THRESHOLD,
+                availability_threshold=group_availability_threshold,
+                percentile_threshold=LATENCY_THRESHOLD_MS if multi_sample else None,
             )
+            for shard in alarm_shards:
+                availability_alarms.extend(shard.availability_alarms)
+                latency_alarms.extend(shard.latency_alarms)
+
+        for site in ([] if grouped else sites):
+            # 與上面的圖表使用相同定義的 metric
+            m_avail = site_metric(site, "Availability", "Average", cloudwatch.Unit.COUNT)
+            m_anomaly = site_metric(site, "LatencyAnomaly", "Average", cloudwatch.Unit.NONE)
+
+            # 告警 1：Availability < 門檻（當期 5 分鐘平均）；多區域時為 quorum 個區域不可用
+            if multi_region:
+                a1 = cloudwatch.Alarm(
+                    self,
+                    f"AvailAlarm-{site}",
+                    metric=regions_down(site, regions, availability_threshold),
+                    threshold=quorum,
+                    evaluation_periods=1,
+                    comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                    treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                    alarm_description=f"{site} unavailable from at least {quorum} of {len(regions)} regions",
+                )
+            else:
+                a1 = cloudwatch.Alarm(
+                    self,
+                    f"AvailAlarm-{site}",
+                    metric=m_avail,
+                    threshold=availability_threshold,
+                    evaluation_periods=1,  # 只看最近一個 period（5 分鐘）
+                    comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+                    treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,  # 沒資料不當作告警
+                    alarm_description=f"Availability below {availability_threshold:g} for {site}",
+                )
             availability_alarms.append(a1)
 
-            # 告警 2：Latency > 門檻
+            # 告警 2：延遲偏離基準線（LatencyAnomaly > 門檻，連續 LATENCY_EVALUATION_PERIODS 個 period）
             a2 = cloudwatch.Alarm(
                 self,
                 f"LatencyAlarm-{site}",
-                metric=m_latency,
-                threshold=LATENCY_THRESHOLD_MS,
-                evaluation_periods=1,
+                metric=m_anomaly,
+                threshold=ANOMALY_THRESHOLD,
+                evaluation_periods=LATENCY_EVALUATION_PERIODS,
                 comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
                 treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
-                alarm_description=f"Latency above {LATENCY_THRESHOLD_MS} ms for {site}",
+                alarm_description=f"Latency more than {ANOMALY_THRESHOLD:g} std devs above its baseline for {site}",
             )
             latency_alarms.append(a2)
 
-        # 把告警小工具放到 Dashboard（每個告警一個卡片）
-        for alarm in availability_alarms:
-            dashboard.add_widgets(
-                cloudwatch.AlarmWidget(
-                    title=f"DOWN: {alarm.alarm_name}",  # 告警卡片標題
-                    alarm=alarm,
-                    width=12
-                )
-            )
-        for alarm in latency_alarms:
-            dashboard.add_widgets(
-                cloudwatch.AlarmWidget(
-                    title=f"SLOW: {alarm.alarm_name}",
-                    alarm=alarm,
-                    width=12
+            # 告警 3（多次取樣）：Latency p90 > 門檻（當期 5 分鐘）
+            if multi_sample:
+                a3 = cloudwatch.Alarm(
+                    self,
+                    f"LatencyP90Alarm-{site}",
+                    metric=site_metric(site, "Latency", "p90", cloudwatch.Unit.MILLISECONDS),
+                    threshold=LATENCY_THRESHOLD_MS,
+                    evaluation_periods=1,
+                    comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                    treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                    alarm_description=f"Latency (p90) above {LATENCY_THRESHOLD_MS} ms for {site}",
                 )
-            )
+                latency_alarms.append(a3)
+
+        # ---------------- Dashboards ----------------
+        # 說明（見 project1/dashboards.py）：
+        # - 總覽 WebHealth-Dashboard 只用 Metrics Insights / SEARCH 查詢，大小與網站數無關
+        #   （最慢 / 最不穩定的 TOP 10、整體延遲分段、全部網站的折線）
+        # - 網站明細依 tags["group"] 分頁：WebHealth-<group>-<n>，每頁最多 dashboard_page_size 站
+        #   （grouped 模式時放在各告警 nested stack 裡）
+        # - per_site 模式（網站數有上限）時，總覽另外放一張告警狀態表
+        build_overview(
+            self,
+            "WebHealthDashboard",
+            dashboard_name="WebHealth-Dashboard",  # 你在 Console 會看到的名稱
+            alarms=None if grouped else availability_alarms + latency_alarms,
+            multi_region=multi_region,
+        )
+        # grouped 模式：明細頁建立在負責該頁網站的告警 nested stack 中，主 stack 只有固定數量的資源
+        page_scopes = {}
+        if grouped:
+            page_scopes = {url: shard for shard in alarm_shards for url in shard.urls}
+        build_detail_pages(self, site_configs, page_size=dashboard_page_size,
+                           scope_for=lambda url: page_scopes.get(url, self))
 
 
         # ---------------- SNS + SQS wiring for Alarms（最小可用）----------------
@@ -271,23 +409,39 @@ class CanaryStack(Stack):
 
         # ---------------- DynamoDB (NoSQL) + Logger Lambda ----------------
         # 說明：
-        # - DynamoDB 用來記錄告警事件（Alarm name、Metric、Timestamp、Message）
-        # - Lambda 由 SNS 觸發，解析告警訊息後寫入資料表
-        # - 這是最小可用版本（不考慮批次、重試、格式化）
+        # - DynamoDB 用來記錄告警狀態變化（Alarm name、Site、State、Timestamp、Reason）
+        # - 主表依小時分桶（Bucket = 小時#shard），避免單一告警形成 hot partition；
+        #   GSI ByState（狀態#日期 + 時間）、ByAlarm（告警名稱 + 時間）支援常用查詢，不需 Scan
+        # - ExpiresAt 為 TTL 欄位，保留 ALARM_RETENTION_DAYS 天
+        # - Lambda 由兩個告警 SQS 佇列批次觸發，解析告警訊息後去重（LRU + BatchGetItem 查出已存在的項目）後以 BatchWriteItem 寫入資料表，
+        #   每次狀態變化只留一筆（主鍵 = StateChangeTime + AlarmName）
+        # - 告警風暴時多則訊息合併成一次 invocation；寫入失敗的訊息以 partial batch failure 回報
+        # - 資料格式與查詢 API：lambda/alarm_history.py
 
         # 1️⃣ 建立 DynamoDB 資料表
         alarm_table = dynamodb.Table(
             self,
-            "AlarmLogTable",
+            "AlarmHistoryTable",
             partition_key=dynamodb.Attribute(
-                name="AlarmName", type=dynamodb.AttributeType.STRING
+                name="Bucket", type=dynamodb.AttributeType.STRING
             ),
             sort_key=dynamodb.Attribute(
-                name="Timestamp", type=dynamodb.AttributeType.STRING
+                name="SortKey", type=dynamodb.AttributeType.STRING
             ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt",
             removal_policy=RemovalPolicy.DESTROY,   # 方便開發重建（正式環境應改成 RETAIN）
-            table_name="WebHealth_AlarmLogs"
+            table_name="WebHealth_AlarmHistory"
         )
+        # GSI 只投影查詢用的欄位；壓縮的完整訊息（Payload）只在主表
+        for index_name, pk in ((alarm_history.STATE_INDEX, "StateDay"), (alarm_history.ALARM_INDEX, "AlarmName")):
+            alarm_table.add_global_secondary_index(
+                index_name=index_name,
+                partition_key=dynamodb.Attribute(name=pk, type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name="Timestamp", type=dynamodb.AttributeType.STRING),
+                projection_type=dynamodb.ProjectionType.INCLUDE,
+                non_key_attributes=alarm_history.index_attributes(pk, "Timestamp"),
+            )
 
         # 2️⃣ 建立 Lambda：從 SNS 取得訊息，寫入 DynamoDB
         alarm_logger_fn = _lambda.Function(
@@ -299,21 +453,24 @@ class CanaryStack(Stack):
             timeout=Duration.seconds(10),
             memory_size=128,
             environment={
-                "TABLE_NAME": alarm_table.table_name
+                "TABLE_NAME": alarm_table.table_name,
+                "ALARM_RETENTION_DAYS": str(alarm_retention_days),
             }
         )
 
-        # 3️⃣ 給 Lambda 權限寫入 DynamoDB
-        alarm_table.grant_write_data(alarm_logger_fn)
-
-        # 4️⃣ 讓 SNS 觸發這支 Lambda（兩個 Topic 都連進來）
-        availability_topic.add_subscription(subs.LambdaSubscription(alarm_logger_fn))
-        latency_topic.add_subscription(subs.LambdaSubscription(alarm_logger_fn))
+        # 3️⃣ 給 Lambda 權限讀寫 DynamoDB（寫入前以 BatchGetItem 檢查重複）
+        alarm_table.grant_read_write_data(alarm_logger_fn)
+
+        # 4️⃣ 讓兩個告警 SQS 佇列（已訂閱對應 Topic）批次觸發這支 Lambda
+        for queue in (availability_queue, latency_queue):
+            alarm_logger_fn.add_event_source(
+                lambda_events.SqsEventSource(
+                    queue,
+                    batch_size=25,                                   # 一次最多 25 則
+                    max_batching_window=Duration.seconds(5),         # 等待最多 5 秒湊成一批
+                    report_batch_item_failures=True,                 # 只重送寫入失敗的訊息
+                )
+            )
 
         # 5️⃣ 輸出 DynamoDB Table 名稱
-        CfnOutput(self, "AlarmLogTableName", value=alarm_table.table_name)
-
-
-
-
-        CfnOutput(self, "CanaryFunctionName", value=self.canary_fn.function_name)
\ No newline at end of file
+        CfnOutput(self, "AlarmHistoryTableName", value=alarm_table.table_name)
\ No newline at end of file
@@ -0,0 +1,183 @@
+# project1/dashboards.py
+# 功能：建立固定大小的總覽 Dashboard，以及依 tag 分頁的網站明細 Dashboard。
+# 說明：
+#   - 總覽（WebHealth-Dashboard）只用 Metrics Insights / SEARCH 查詢，不逐站列出 metric，
+#     定義大小與 sites.json 的長度無關：
+#       * 最慢的 TOP_N 個網站（Latency）
+#       * 可用率最低的 TOP_N 個網站（Availability）
+#       * 延遲最偏離自己基準線的 TOP_N 個網站（LatencyAnomaly）
+#       * 全部網站的延遲分段平均（DNS / Connect / TLS / TTFB / Body）
+#       * 所有網站的 Availability / Latency（SEARCH）
+#       * 多區域部署時：各區域的整體可用率 / 延遲，以及每站 × 區域的 Availability（Region 維度）
+#   - 明細頁依 tags["group"] 分開，每頁最多 page_size 個網站（WebHealth-<group>-<n>），
+#     每頁大小有上限；網站變多時是頁數增加，而不是單一 Dashboard 變大。
+
+import re
+
+from aws_cdk import (
+    Duration,
+    aws_cloudwatch as cloudwatch,
+)
+from constructs import Construct
+
+from project1.site_alarms import site_metric
+
+TOP_N = 10                  # 總覽中「最慢 / 最不穩定」列出的網站數
+DEFAULT_PAGE_SIZE = 50      # 每個明細頁的網站數
+PHASE_METRICS = ["LatencyDns", "LatencyConnect", "LatencyTls", "LatencyTtfb", "LatencyBody"]
+
+
+def insights(query, label=""):
+    # Metrics Insights 查詢（以 MathExpression 的 expression 表示）
+    return cloudwatch.MathExpression(expression=query, label=label, period=Duration.minutes(5))
+
+
+def search(namespace, metric_name, statistic, dimensions="Site"):
+    return cloudwatch.MathExpression(
+        expression=f"SEARCH('{{{namespace},{dimensions}}} MetricName=\"{metric_name}\"', '{statistic}', 300)",
+        label="",
+        period=Duration.minutes(5),
+    )
+
+
+def build_overview(scope: Construct, construct_id: str, *, namespace: str = "WebHealth",
+                   dashboard_name: str = "WebHealth-Dashboard", alarms=None,
+                   multi_region: bool = False) -> cloudwatch.Dashboard:
+    # 總覽 Dashboard：所有圖表都是查詢式，大小固定
+    # alarms：選填，少量網站時可放一個告警狀態表（數量由呼叫端控制上限）
+    # multi_region：多區域部署時多一列分區域的圖表（只帶 Site 的指標已是所有區域的彙總）
+    schema = f'SCHEMA("{namespace}", Site)'
+    dashboard = cloudwatch.Dashboard(scope, construct_id, dashboard_name=dashboard_name)
+
+    dashboard.add_widgets(
+        cloudwatch.GraphWidget(
+            title=f"Top {TOP_N} slowest sites (avg latency, ms)",
+            left=[insights(f"SELECT AVG(Latency) FROM {schema} GROUP BY Site ORDER BY AVG() DESC LIMIT {TOP_N}")],
+            width=8
+        ),
+        cloudwatch.GraphWidget(
+            title=f"Top {TOP_N} latency anomalies (std devs above baseline)",
+            left=[insights(f"SELECT MAX(LatencyAnomaly) FROM {schema} GROUP BY Site ORDER BY MAX() DESC LIMIT {TOP_N}")],
+            width=8
+        ),
+        cloudwatch.GraphWidget(
+            title=f"Bottom {TOP_N} sites by availability",
+            left=[insights(f"SELECT AVG(Availability) FROM {schema} GROUP BY Site ORDER BY AVG() ASC LIMIT {TOP_N}")],
+            left_y_axis=cloudwatch.YAxisProps(min=0, max=1),
+            width=8
+        ),
+    )
+    dashboard.add_widgets(
+        cloudwatch.GraphWidget(
+            title="Latency breakdown across all sites (avg ms)",
+            left=[insights(f"SELECT AVG({name}) FROM {schema}", name.replace("Latency", ""))
+                  for name in PHASE_METRICS],
+            stacked=True,
+            width=12
+        ),
+        cloudwatch.SingleValueWidget(
+            title="Sites reporting / overall availability",
+            metrics=[
+                insights(f"SELECT COUNT(Availability) FROM {schema}", "Probes (5 min)"),
+                insights(f"SELECT AVG(Availability) FROM {schema}", "Availability"),
+            ],
+            width=12
+        ),
+    )
+    dashboard.add_widgets(
+        cloudwatch.GraphWidget(
+            title="Availability (0 or 1) by Site",
+            left=[search(namespace, "Availability", "Average")],
+            left_y_axis=cloudwatch.YAxisProps(min=0, max=1),
+            width=24
+        ),
+        cloudwatch.GraphWidget(
+            title="Latency (ms) by Site",
+            left=[search(namespace, "Latency", "Average")],
+            width=24
+        ),
+    )
+    if multi_region:
+        regional = f'SCHEMA("{namespace}", Region, Site)'
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title="Availability by probe region (all sites)",
+                left=[insights(f"SELECT AVG(Availability) FROM {regional} GROUP BY Region")],
+                left_y_axis=cloudwatch.YAxisProps(min=0, max=1),
+                width=8
+            ),
+            cloudwatch.GraphWidget(
+                title="Latency by probe region (avg ms, all sites)",
+                left=[insights(f"SELECT AVG(Latency) FROM {regional} GROUP BY Region")],
+                width=8
+            ),
+            cloudwatch.GraphWidget(
+                title="Availability by Site and Region",
+                left=[search(namespace, "Availability", "Average", "Region,Site")],
+                left_y_axis=cloudwatch.YAxisProps(min=0, max=1),
+                width=8
+            ),
+        )
+    if alarms:
+        dashboard.add_widgets(
+            cloudwatch.AlarmStatusWidget(title="Alarms", alarms=alarms, width=24)
+        )
+    return dashboard
+
+
+def paginate(sites, page_size=DEFAULT_PAGE_SIZE):
+    # sites：site_registry.Site 清單 → [(頁名, [網址, ...]), ...]，依 tags["group"] 分開
+    by_tag = {}
+    for site in sites:
+        by_tag.setdefault(site.tags.get("group", "default"), []).append(site.url)
+    pages = []
+    for tag in sorted(by_tag):
+        urls = sorted(by_tag[tag])
+        safe = re.sub(r"[^A-Za-z0-9_-]", "-", tag)
+        for i in range(0, len(urls), page_size):
+            pages.append((f"{safe}-{i // page_size + 1}", urls[i:i + page_size]))
+    return pages
+
+
+def build_detail_pages(scope: Construct, sites, *, page_size: int = DEFAULT_PAGE_SIZE,
+                       name_prefix: str = "WebHealth", scope_for=None) -> list[cloudwatch.Dashboard]:
+    # 每頁：該頁網站的 Availability / Latency 各一張圖，加上每站一張延遲分段堆疊圖
+    # scope_for：選填，網址 → 建立該頁的 scope（依該頁第一個網站決定）；
+    #            grouped 模式把每頁放進負責那些網站的 nested stack，主 stack 的資源數不隨網站數成長
+    dashboards = []
+    for page, urls in paginate(sites, page_size):
+        dashboard = cloudwatch.Dashboard(
+            scope_for(urls[0]) if scope_for else scope,
+            f"SiteDetail-{page}",
+            dashboard_name=f"{name_prefix}-{page}"
+        )
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title=f"Availability: {page}",
+                left=[site_metric(u, "Availability", "Average", cloudwatch.Unit.COUNT) for u in urls],
+                left_y_axis=cloudwatch.YAxisProps(min=0, max=1),
+                width=12
+            ),
+            cloudwatch.GraphWidget(
+                title=f"Latency (ms): {page}",
+                left=[site_metric(u, "Latency", "Average", cloudwatch.Unit.MILLISECONDS) for u in urls],
+                width=12
+            ),
+        )
+        for url in urls:
+            # 每站一條 SEARCH 取出 5 個分段指標（單一運算式，synth 成本不隨分段數增加）
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(
+                    title=f"Latency breakdown (ms): {url}",
+                    left=[cloudwatch.MathExpression(
+                        expression=(f"SEARCH('{{WebHealth,Site}} Site=\"{url}\" "
+                                    f"MetricName=({' OR '.join(PHASE_METRICS)})', 'Average', 300)"),
+                        label="",
+                        period=Duration.minutes(5),
+                    )],
+                    stacked=True,
+                    width=8
+                )
+            )
+        dashboards.append(dashboard)
+    return dashboards
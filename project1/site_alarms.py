@@ -0,0 +1,192 @@
+# project1/site_alarms.py
+# 功能：大量網站時的告警產生方式（grouped 模式），避免超過 CloudFormation 的 500 資源上限。
+# 說明：
+#   - 網站依 tags["group"] 分組後，每 GROUP_SIZE 個網站一組（metric math 一個運算式最多 10 個 metric）。
+#   - 每組建立：
+#       1) Availability metric-math 告警：MIN(該組每站 Availability) < 門檻 → 有任一站不可用
+#       2) Latency metric-math 告警：MAX(該組每站 LatencyAnomaly) > 門檻 → 有任一站延遲明顯偏離自己的基準線
+#       3) 多次取樣時另加 Latency 百分位數告警：MAX(該組每站 p90 Latency) > 門檻（毫秒）
+#       4) Composite 告警：上面任一進入 ALARM → 這組網站不健康
+#   - 每 GROUPS_PER_SHARD 組放進一個 NestedStack（每組 3～4 個告警，最多約 400 個資源），
+#     這些網站的明細 Dashboard 頁也建立在同一個 NestedStack（每 50 站一頁，約 20 個資源），
+#     主 stack 只多出少數 AWS::CloudFormation::Stack 資源，synth / deploy 時間隨網站數平緩成長。
+#   - 多區域部署時（per_site 模式）Availability 告警改用 regions_down()：
+#     計算幾個區域在這個 period 看到網站不可用，達到 quorum 才告警，單一區域的網路問題不會被當成網站掛掉。
+
+import re
+
+from aws_cdk import (
+    Duration,
+    NestedStack,
+    aws_cloudwatch as cloudwatch,
+)
+from constructs import Construct
+
+GROUP_SIZE = 10            # metric math 單一運算式最多 10 個 metric
+GROUPS_PER_SHARD = 100     # 每個 nested stack 的組數（每組 3～4 個告警 → 最多約 400 個資源）
+DESCRIPTION_LIMIT = 1024   # AlarmDescription 長度上限
+LATENCY_EVALUATION_PERIODS = 2   # 延遲告警：連續 2 個 period（10 分鐘）偏離才告警，避免單次抖動
+                                 # （分數超標的網站由 Lambda 排程器改為每分鐘量測，見 lambda/scheduler.py）
+MAX_REGIONS = 10           # quorum 運算式每個區域一個 metric，同樣受 10 個 metric 的限制
+
+
+def site_metric(site, metric_name, statistic, unit, namespace="WebHealth", region=None):
+    # 單一網站的 metric（與 Lambda 上報的維度一致）；region：只看某個量測區域（Region 維度）
+    dimensions = {"Site": site}
+    if region:
+        dimensions["Region"] = region
+    return cloudwatch.Metric(
+        namespace=namespace,
+        metric_name=metric_name,
+        dimensions_map=dimensions,
+        statistic=statistic,
+        period=Duration.minutes(5),
+        unit=unit,
+    )
+
+
+def latency_unit(metric_name):
+    # LatencyAnomaly 是標準差倍數（沒有單位），其餘延遲指標為毫秒
+    return cloudwatch.Unit.NONE if metric_name == "LatencyAnomaly" else cloudwatch.Unit.MILLISECONDS
+
+
+def regions_down(site, regions, availability_threshold):
+    # 這個 period 有幾個區域看到網站不可用（Availability 平均 < 門檻）
+    # 區域沒有資料（自適應排程這期沒量到）時視為可用，不會被算進 quorum
+    return cloudwatch.MathExpression(
+        expression=" + ".join(f"IF(FILL(r{i}, 1) < {availability_threshold:g}, 1, 0)" for i in range(len(regions))),
+        using_metrics={f"r{i}": site_metric(site, "Availability", "Average", cloudwatch.Unit.COUNT, region=region)
+                       for i, region in enumerate(regions)},
+        label=f"Regions reporting down ({site})",
+        period=Duration.minutes(5),
+    )
+
+
+def group_sites(sites, size=GROUP_SIZE):
+    # sites：site_registry.Site 清單 → [(組名, [網址, ...]), ...]
+    # 先依 tags["group"] 分開，組內依網址排序後切塊（每組最多 size 個，metric math 的上限）
+    # 新增 / 移除網站只影響同一個 tag 的組：排序位置之後的網站會往後 / 往前移一格，
+    # 那幾組的告警會被更新（組名不變，CloudFormation 原地更新、不會重建），其他 tag 的組不受影響
+    by_tag = {}
+    for site in sites:
+        by_tag.setdefault(site.tags.get("group", "default"), []).append(site.url)
+    groups = []
+    for tag in sorted(by_tag):
+        urls = sorted(by_tag[tag])
+        safe = re.sub(r"[^A-Za-z0-9-]", "-", tag)
+        for i in range(0, len(urls), size):
+            groups.append((f"{safe}-{i // size}", urls[i:i + size]))
+    return groups
+
+
+def _describe(prefix, urls):
+    text = f"{prefix}: " + ", ".join(urls)
+    return text if len(text) <= DESCRIPTION_LIMIT else text[:DESCRIPTION_LIMIT - 3] + "..."
+
+
+class SiteAlarmShard(NestedStack):
+    # 一個 nested stack：負責 groups 內所有網站的 metric-math 告警與 composite 告警
+
+    def __init__(self, scope: Construct, construct_id: str, *, groups, latency_threshold: float,
+                 availability_threshold: float, latency_statistic: str = "Average",
+                 latency_metric: str = "LatencyAnomaly", percentile_threshold: float = None,
+                 percentile_statistic: str = "p90", **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        self.availability_alarms: list[cloudwatch.Alarm] = []
+        self.latency_alarms: list[cloudwatch.Alarm] = []
+        self.group_alarms: list[cloudwatch.CompositeAlarm] = []
+        self.urls = {u for _, urls in groups for u in urls}   # 這個 shard 負責的網站（明細頁也放在這裡）
+
+        for name, urls in groups:
+            avail = cloudwatch.MathExpression(
+                expression="MIN([" + ",".join(f"a{i}" for i in range(len(urls))) + "])",
+                using_metrics={f"a{i}": site_metric(u, "Availability", "Average", cloudwatch.Unit.COUNT)
+                               for i, u in enumerate(urls)},
+                label=f"Min availability ({name})",
+                period=Duration.minutes(5),
+            )
+            latency = cloudwatch.MathExpression(
+                expression="MAX([" + ",".join(f"l{i}" for i in range(len(urls))) + "])",
+                using_metrics={f"l{i}": site_metric(u, latency_metric, latency_statistic, latency_unit(latency_metric))
+                               for i, u in enumerate(urls)},
+                label=f"Max latency ({name})",
+                period=Duration.minutes(5),
+            )
+
+            a1 = cloudwatch.Alarm(
+                self,
+                f"AvailGroupAlarm-{name}",
+                metric=avail,
+                threshold=availability_threshold,
+                evaluation_periods=1,
+                comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                alarm_description=_describe(f"Availability below {availability_threshold:g} for a site in", urls),
+            )
+            a2 = cloudwatch.Alarm(
+                self,
+                f"LatencyGroupAlarm-{name}",
+                metric=latency,
+                threshold=latency_threshold,
+                evaluation_periods=LATENCY_EVALUATION_PERIODS,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                alarm_description=_describe(
+                    f"{latency_metric} ({latency_statistic}) above {latency_threshold:g} for a site in", urls),
+            )
+            members = [a1, a2]
+            if percentile_threshold is not None:
+                a3 = cloudwatch.Alarm(
+                    self,
+                    f"LatencyPctGroupAlarm-{name}",
+                    metric=cloudwatch.MathExpression(
+                        expression="MAX([" + ",".join(f"p{i}" for i in range(len(urls))) + "])",
+                        using_metrics={f"p{i}": site_metric(u, "Latency", percentile_statistic,
+                                                            cloudwatch.Unit.MILLISECONDS)
+                                       for i, u in enumerate(urls)},
+                        label=f"Max {percentile_statistic} latency ({name})",
+                        period=Duration.minutes(5),
+                    ),
+                    threshold=percentile_threshold,
+                    evaluation_periods=1,
+                    comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                    treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+                    alarm_description=_describe(
+                        f"Latency ({percentile_statistic}) above {percentile_threshold:g} ms for a site in", urls),
+                )
+                self.latency_alarms.append(a3)
+                members.append(a3)
+            group = cloudwatch.CompositeAlarm(
+                self,
+                f"GroupHealth-{name}",
+                alarm_rule=cloudwatch.AlarmRule.any_of(
+                    *(cloudwatch.AlarmRule.from_alarm(a, cloudwatch.AlarmState.ALARM) for a in members)
+                ),
+                alarm_description=_describe(f"Site group {name} unhealthy", urls),
+            )
+            self.availability_alarms.append(a1)
+            self.latency_alarms.append(a2)
+            self.group_alarms.append(group)
+
+
+def build_alarm_shards(scope: Construct, sites, *, latency_threshold: float, availability_threshold: float,
+                       latency_statistic: str = "Average", latency_metric: str = "LatencyAnomaly",
+                       percentile_threshold: float = None,
+                       group_size: int = GROUP_SIZE,
+                       groups_per_shard: int = GROUPS_PER_SHARD) -> list[SiteAlarmShard]:
+    # 分組後每 groups_per_shard 組建立一個 SiteAlarmShard
+    groups = group_sites(sites, group_size)
+    return [
+        SiteAlarmShard(
+            scope,
+            f"AlarmShard{i // groups_per_shard}",
+            groups=groups[i:i + groups_per_shard],
+            latency_threshold=latency_threshold,
+            latency_statistic=latency_statistic,
+            availability_threshold=availability_threshold,
+            latency_metric=latency_metric,
+            percentile_threshold=percentile_threshold,
+        )
+        for i in range(0, len(groups), groups_per_shard)
+    ]
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Lambda 程式碼放在 lambda/（非 Python 套件名稱），測試時直接加入 sys.path
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "lambda")
+sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
+
+# boto3 建立 client 需要 region；測試中不會真的呼叫 AWS
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-southeast-2")
@@ -0,0 +1,175 @@
+import json
+import os
+
+os.environ.setdefault("TABLE_NAME", "WebHealth_AlarmHistory")
+
+import alarm_history  # noqa: E402
+import alarm_logger  # noqa: E402
+
+T0 = 1714568400.0   # 2024-05-01T13:00:00Z
+
+
+class LocalDynamo:
+    # 本機 DynamoDB 替身：支援 create_table / batch_get_item / batch_write_item / query（alarm_history 用到的寫法），
+    # 依 table_definition 的 key schema 與 GSI（含 INCLUDE 投影）建立索引，query 每頁最多 page_size 筆
+    def __init__(self, page_size=3):
+        self.tables = {}
+        self.page_size = page_size
+        self.queries = []
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(), **_):
+        keys = {"": [k["AttributeName"] for k in KeySchema]}
+        projections = {}
+        for index in GlobalSecondaryIndexes:
+            keys[index["IndexName"]] = [k["AttributeName"] for k in index["KeySchema"]]
+            if index["Projection"]["ProjectionType"] == "INCLUDE":
+                projections[index["IndexName"]] = (set(keys[""]) | set(keys[index["IndexName"]])
+                                                   | set(index["Projection"]["NonKeyAttributes"]))
+        self.tables[TableName] = {"keys": keys, "projections": projections, "items": {}}
+
+    def batch_get_item(self, RequestItems):
+        (name, request), = RequestItems.items()
+        table = self.tables[name]
+        pk, sk = table["keys"][""]
+        found = [table["items"][(k[pk]["S"], k[sk]["S"])] for k in request["Keys"]
+                 if (k[pk]["S"], k[sk]["S"]) in table["items"]]
+        return {"Responses": {name: [{pk: i[pk], sk: i[sk]} for i in found]}}
+
+    def batch_write_item(self, RequestItems):
+        for name, requests in RequestItems.items():
+            table = self.tables[name]
+            pk, sk = table["keys"][""]
+            for r in requests:
+                item = r["PutRequest"]["Item"]
+                table["items"][(item[pk]["S"], item[sk]["S"])] = item
+        return {"UnprocessedItems": {}}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeNames,
+              ExpressionAttributeValues, IndexName="", ExclusiveStartKey=None):
+        assert KeyConditionExpression == "#pk = :pk AND #sk BETWEEN :lo AND :hi"
+        table = self.tables[TableName]
+        pk, sk = table["keys"][IndexName]
+        assert [ExpressionAttributeNames["#pk"], ExpressionAttributeNames["#sk"]] == [pk, sk]
+        self.queries.append((IndexName, ExpressionAttributeValues[":pk"]["S"]))
+        values = {k: v["S"] for k, v in ExpressionAttributeValues.items()}
+        matches = sorted(
+            (item for item in table["items"].values()
+             if pk in item and item[pk]["S"] == values[":pk"] and values[":lo"] <= item[sk]["S"] <= values[":hi"]),
+            key=lambda item: item[sk]["S"],
+        )
+        start = ExclusiveStartKey or 0
+        page = matches[start:start + self.page_size]
+        if IndexName in table["projections"]:
+            page = [{k: v for k, v in item.items() if k in table["projections"][IndexName]} for item in page]
+        resp = {"Items": page}
+        if start + self.page_size < len(matches):
+            resp["LastEvaluatedKey"] = start + self.page_size
+        return resp
+
+
+def alarm(name, state, at, site=None):
+    msg = {
+        "AlarmName": name,
+        "NewStateValue": state,
+        "OldStateValue": "OK" if state == "ALARM" else "ALARM",
+        "NewStateReason": "threshold crossed",
+        "StateChangeTime": alarm_history.iso(at).replace("Z", "+0000"),
+    }
+    if site:
+        msg["Trigger"] = {"Dimensions": [{"name": "Site", "value": site}]}
+    return msg
+
+
+def sqs_record(i, msg):
+    envelope = {"Type": "Notification", "MessageId": f"sns-{i}", "Message": json.dumps(msg)}
+    return {"messageId": f"msg-{i}", "eventSource": "aws:sqs", "body": json.dumps(envelope)}
+
+
+def logged_history(monkeypatch, messages):
+    # 經由 alarm_logger.handler 寫入本機替身，回傳查詢 API
+    local = LocalDynamo()
+    local.create_table(**alarm_history.table_definition(alarm_logger.table_name()))
+    monkeypatch.setattr(alarm_logger, "dynamodb", local)
+    alarm_logger.RECENT.clear()
+    result = alarm_logger.handler({"Records": [sqs_record(i, m) for i, m in enumerate(messages)]}, None)
+    assert result["batchItemFailures"] == []
+    return alarm_history.AlarmHistory(alarm_logger.table_name(), local), local
+
+
+def test_record_keys_are_time_bucketed_with_ttl():
+    record = alarm_history.build_record(alarm("AvailAlarm-bbc", "ALARM", T0 + 65, "https://www.bbc.com/"))
+
+    assert record["Bucket"].startswith("2024050113#")
+    assert record["SortKey"] == "2024-05-01T13:01:05.000Z#AvailAlarm-bbc"
+    assert record["StateDay"] == "ALARM#20240501"
+    assert record["Site"] == "https://www.bbc.com/"
+    assert record["ExpiresAt"] == int(T0 + 65) + alarm_history.RETENTION_DAYS * 86400
+
+
+def test_recent_uses_state_index_without_scan(monkeypatch):
+    bbc, nhk = "https://www.bbc.com/", "https://www3.nhk.or.jp/"
+    history, local = logged_history(monkeypatch, [
+        alarm("AvailAlarm-bbc", "ALARM", T0 - 7200, bbc),    # 窗外
+        alarm("AvailAlarm-bbc", "ALARM", T0 + 60, bbc),
+        alarm("AvailAlarm-bbc", "OK", T0 + 120, bbc),
+        alarm("LatencyAlarm-nhk", "ALARM", T0 + 300, nhk),
+    ])
+
+    recent = history.recent(T0, T0 + 3600)
+
+    assert [(r["AlarmName"], r["Epoch"]) for r in recent] == [
+        ("AvailAlarm-bbc", int(T0 + 60)), ("LatencyAlarm-nhk", int(T0 + 300))]
+    assert local.queries == [("ByState", "ALARM#20240501")]
+
+
+def test_full_message_is_kept_compressed_and_restorable(monkeypatch):
+    msg = dict(
+        alarm("canary-AvailAlarmhttpswwwbbccom1A2B3C4D-ABCDEFGHIJKL", "ALARM", T0 + 60, "https://www.bbc.com/"),
+        AlarmDescription="Availability below 1 for https://www.bbc.com/",
+        AWSAccountId="123456789012",
+        NewStateReason="Threshold Crossed: 1 out of the last 1 datapoints [0.0 (01/05/24 12:59:00)] was less "
+                       "than the threshold (1.0) (minimum 1 datapoint for OK -> ALARM transition). " * 3,
+        Region="Asia Pacific (Sydney)",
+        AlarmArn="arn:aws:cloudwatch:ap-southeast-2:123456789012:alarm:canary-AvailAlarmhttpswwwbbccom1A2B3C4D",
+        AlarmActions=["arn:aws:sns:ap-southeast-2:123456789012:canary-AvailabilityTopic-ABCDEFG"],
+        OKActions=[], InsufficientDataActions=[],
+    )
+    msg["Trigger"].update(MetricName="Availability", Namespace="WebHealth", Statistic="AVERAGE", Period=300,
+                          EvaluationPeriods=1, ComparisonOperator="LessThanThreshold", Threshold=1.0,
+                          TreatMissingData="notBreaching")
+    history, local = logged_history(monkeypatch, [msg])
+    (item,) = local.tables[alarm_logger.table_name()]["items"].values()
+
+    assert len(json.dumps(msg)) > 1024
+    assert alarm_history.item_size(item) < 1024                      # 一個 write unit 內
+    assert len(item["Reason"]["S"]) == alarm_history.REASON_LIMIT
+    assert alarm_history.restore_message(item) == msg                 # 截掉的 Reason、Trigger 都還在
+    assert alarm_history.decode_payload(item["Payload"]["B"]) == json.dumps(msg)
+
+    (recent,) = history.recent(T0, T0 + 3600)
+    assert "Payload" not in recent and recent["Site"] == "https://www.bbc.com/"
+    (transition,) = history.transitions(T0, T0 + 3600)
+    assert alarm_history.restore_message(transition) == msg
+
+
+def test_flap_counts_and_mttr_per_site(monkeypatch):
+    bbc, nhk = "https://www.bbc.com/", "https://www3.nhk.or.jp/"
+    messages = []
+    for i in range(4):   # bbc：每 10 分鐘掛一次，2 分鐘後恢復
+        messages.append(alarm("AvailAlarm-bbc", "ALARM", T0 + i * 600, bbc))
+        messages.append(alarm("AvailAlarm-bbc", "OK", T0 + i * 600 + 120, bbc))
+    messages.append(alarm("LatencyAlarm-nhk", "ALARM", T0 + 3000, nhk))
+    messages.append(alarm("LatencyAlarm-nhk", "OK", T0 + 3900, nhk))     # 跨到下一個小時分桶
+    history, _ = logged_history(monkeypatch, messages)
+
+    assert history.flap_counts(T0, T0 + 7200) == {bbc: 4, nhk: 1}
+    assert history.mttr(T0, T0 + 7200) == {
+        bbc: {"incidents": 4, "mttr_s": 120.0},
+        nhk: {"incidents": 1, "mttr_s": 900.0},
+    }
+    assert len(history.alarm_history("AvailAlarm-bbc", T0, T0 + 7200)) == 8
+
+
+def test_busy_alarm_is_spread_over_write_shards():
+    buckets = {alarm_history.build_record(alarm("AvailAlarm-bbc", "ALARM", T0 + i))["Bucket"] for i in range(200)}
+    assert len(buckets) == alarm_history.WRITE_SHARDS
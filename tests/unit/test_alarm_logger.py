@@ -0,0 +1,115 @@
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("TABLE_NAME", "WebHealth_AlarmHistory")
+
+import alarm_logger  # noqa: E402
+
+
+class StubDynamo:
+    # BatchGetItem / BatchWriteItem；fail 內的告警一直被回傳為 UnprocessedItems（模擬持續 throttling）
+    def __init__(self, fail=()):
+        self.items = {}
+        self.calls = {"get": 0, "write": 0}
+        self.fail = set(fail)
+
+    def batch_get_item(self, RequestItems):
+        self.calls["get"] += 1
+        (table, request), = RequestItems.items()
+        assert len(request["Keys"]) <= alarm_logger.BATCH_GET_LIMIT
+        found = [self.items[k] for k in map(alarm_logger.item_key, request["Keys"]) if k in self.items]
+        return {"Responses": {table: [{"Bucket": i["Bucket"], "SortKey": i["SortKey"]} for i in found]}}
+
+    def batch_write_item(self, RequestItems):
+        self.calls["write"] += 1
+        (table, requests), = RequestItems.items()
+        assert len(requests) <= alarm_logger.BATCH_WRITE_LIMIT
+        keys = [alarm_logger.item_key(r["PutRequest"]["Item"]) for r in requests]
+        assert len(set(keys)) == len(keys)     # 同一個請求裡不能有重複主鍵
+        unprocessed = []
+        for r in requests:
+            item = r["PutRequest"]["Item"]
+            if item["AlarmName"]["S"] in self.fail:
+                unprocessed.append(r)
+            else:
+                self.items[alarm_logger.item_key(item)] = item
+        return {"UnprocessedItems": {table: unprocessed} if unprocessed else {}}
+
+
+def alarm(i, state="ALARM"):
+    return {"AlarmName": f"AvailAlarm-{i}", "NewStateValue": state, "NewStateReason": "down",
+            "StateChangeTime": f"2024-05-01T13:{i % 60:02d}:00.000+0000"}
+
+
+def sqs_record(i, msg=None, sns_id=None, msg_id=None):
+    envelope = {"Type": "Notification", "MessageId": sns_id or f"sns-{i}", "Message": json.dumps(msg or alarm(i))}
+    return {"messageId": msg_id or f"msg-{i}", "eventSource": "aws:sqs", "body": json.dumps(envelope)}
+
+
+@pytest.fixture
+def stub_dynamo(monkeypatch):
+    alarm_logger.RECENT.clear()
+    monkeypatch.setattr(alarm_logger, "BACKOFF_BASE_SECONDS", 0)
+
+    def install(stub):
+        monkeypatch.setattr(alarm_logger, "dynamodb", stub)
+        return stub
+    yield install
+    alarm_logger.RECENT.clear()
+
+
+def test_writes_one_row_per_state_transition(stub_dynamo):
+    stub = stub_dynamo(StubDynamo())
+    records = [sqs_record(i) for i in range(30)]
+    records += [sqs_record(3, msg_id="redelivery")]                               # SNS 重送：同一 MessageId
+    records += [sqs_record(4, sns_id="latency-topic", msg_id="other-topic")]      # 另一個 Topic 的同一次狀態變化
+    result = alarm_logger.handler({"Records": records}, None)
+
+    assert len(stub.items) == 30
+    assert stub.calls == {"get": 1, "write": 2}   # 30 則訊息：一次 BatchGetItem + 兩批 BatchWriteItem
+    assert result["batchItemFailures"] == []
+
+
+def test_existing_row_is_kept_on_cold_container(stub_dynamo):
+    stub = stub_dynamo(StubDynamo())
+    alarm_logger.handler({"Records": [sqs_record(1)]}, None)
+    first = dict(stub.items)
+
+    alarm_logger.RECENT.clear()       # 模擬另一個 container：LRU 是空的
+    redelivered = sqs_record(1, msg=dict(alarm(1), NewStateReason="changed text"))
+    result = alarm_logger.handler({"Records": [redelivered]}, None)
+
+    assert stub.items == first and stub.calls == {"get": 2, "write": 1}   # 已存在：只讀不寫
+    assert result["batchItemFailures"] == []
+
+
+def test_reports_partial_batch_failures_and_retries_them(stub_dynamo):
+    stub = stub_dynamo(StubDynamo(fail={"AvailAlarm-1"}))
+    result = alarm_logger.handler({"Records": [sqs_record(i) for i in range(3)]}, None)
+    assert [f["itemIdentifier"] for f in result["batchItemFailures"]] == ["msg-1"]
+
+    stub.fail.clear()                 # SQS 重新投遞失敗的那一則
+    result = alarm_logger.handler({"Records": [sqs_record(1)]}, None)
+    assert result["batchItemFailures"] == [] and len(stub.items) == 3
+
+
+def test_parses_sns_envelope_from_sqs_body():
+    msg = alarm_logger.parse_message(sqs_record(7))
+    assert msg["AlarmName"] == "AvailAlarm-7"
+
+
+def test_malformed_message_does_not_fail_the_rest_of_the_batch(stub_dynamo):
+    stub = stub_dynamo(StubDynamo())
+    bad = [
+        sqs_record(90, msg=None, msg_id="not-an-object"),
+        sqs_record(91, msg_id="bad-fields"),
+    ]
+    bad[0]["body"] = json.dumps({"Type": "Notification", "MessageId": "sns-90", "Message": "{not json"})
+    bad[1]["body"] = json.dumps({"Type": "Notification", "MessageId": "sns-91",
+                                 "Message": json.dumps({"AlarmName": "x", "NewStateReason": 5})})
+    result = alarm_logger.handler({"Records": bad + [sqs_record(1)]}, None)
+
+    assert result["batchItemFailures"] == []
+    assert [i["AlarmName"]["S"] for i in stub.items.values()] == ["AvailAlarm-1"]
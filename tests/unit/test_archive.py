@@ -0,0 +1,55 @@
+import io
+import random
+
+import archive
+import archive_query
+
+
+def result(url, latency, available=1, status=200, error=None):
+    return {"target_url": url, "availability": available, "latency_ms": latency,
+            "status_code": status, "error": error}
+
+
+def test_round_trip_preserves_fields():
+    results = [result("https://a.example/", 12.5),
+               result("https://b.example/", None, 0, None, "timed out")]
+    data = archive.encode_run(1714568400.25, results)
+
+    records = list(archive.iter_records(io.BytesIO(data)))
+
+    assert records[0]["latency_ms"] == 12.5 and records[0]["status_code"] == 200
+    assert records[1] == {"ts": 1714568400.25, "target_url": "https://b.example/", "availability": 0,
+                          "latency_ms": None, "status_code": None, "error": "timed out"}
+
+
+def test_query_streams_partitions_and_computes_percentiles(tmp_path):
+    sink = archive.LocalDirSink(str(tmp_path))
+    rng = random.Random(3)
+    base = 1714568400  # 2024-05-01T13:00:00Z
+    latencies = []
+    for run in range(120):                       # 每分鐘一次，橫跨 2 個小時分區
+        ts = base + run * 60
+        latency = rng.uniform(10, 1000)
+        latencies.append(latency)
+        archive.write_run(sink, [result("https://a.example/", latency, run % 10 != 0),
+                                 result("https://b.example/", 5.0)], ts)
+
+    assert len(sink.list("probes/2024/05/01/13/")) == 60
+    stats = archive_query.query(sink, base, base + 7200)
+
+    a = stats["https://a.example/"]
+    assert a["probes"] == 120 and a["availability"] == 0.9
+    exact_p95 = sorted(latencies)[int(0.95 * 120) - 1]
+    assert abs(a["p95"] - exact_p95) / exact_p95 < 0.02
+
+    window = archive_query.query(sink, base, base + 600, sites=["https://b.example/"])
+    assert list(window) == ["https://b.example/"] and window["https://b.example/"]["probes"] == 10
+
+
+def test_default_sink_reuses_the_s3_client_across_invocations(monkeypatch):
+    client = object()
+    monkeypatch.setattr(archive, "S3", client)
+    monkeypatch.setenv("ARCHIVE_BUCKET", "probe-archive")
+
+    first, second = archive.default_sink(), archive.default_sink()
+    assert first.client is client and second.client is client and first.bucket == "probe-archive"
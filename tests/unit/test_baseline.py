@@ -0,0 +1,64 @@
+import random
+
+import baseline
+import state_store
+
+
+def warm_up(baselines, url, latency_ms, jitter, n=60, seed=1):
+    rng = random.Random(seed)
+    for _ in range(n):
+        baselines.observe(url, latency_ms * (1 + rng.uniform(-jitter, jitter)))
+
+
+def test_scores_are_relative_to_each_sites_own_normal():
+    baselines = baseline.Baselines()
+    warm_up(baselines, "https://fast.example/", 80, 0.05)
+    warm_up(baselines, "https://www3.nhk.or.jp/", 900, 0.05)
+
+    # 快網站慢到 250ms 就很異常；遠端網站 950ms 仍是平常
+    assert baselines.observe("https://fast.example/", 250) > 3
+    assert abs(baselines.observe("https://www3.nhk.or.jp/", 950)) < 1
+
+
+def test_warm_up_scores_zero_and_single_spike_does_not_shift_baseline():
+    baselines = baseline.Baselines()
+    scores = [baselines.observe("https://a.example/", 100) for _ in range(baseline.WARMUP_SAMPLES)]
+    assert scores == [0.0] * baseline.WARMUP_SAMPLES
+
+    before = baselines.get("https://a.example/")["mean"]
+    assert baselines.observe("https://a.example/", 5000) == baseline.MAX_SCORE
+    assert baselines.get("https://a.example/")["mean"] - before < 0.02
+
+
+def test_baseline_survives_a_new_container_through_the_state_store():
+    store = state_store.MemoryStateStore()
+    first = baseline.Baselines()
+    warm_up(first, "https://a.example/", 120, 0.05)
+    first.save(["https://a.example/"], store)
+
+    second = baseline.Baselines()     # 新 container
+    second.load(["https://a.example/"], store)
+    assert second.get("https://a.example/") == first.get("https://a.example/")
+    assert second.observe("https://a.example/", 400) > 3
+
+
+def test_warm_container_reloads_state_written_by_another_container():
+    # 分片 worker 分散在多個 container：A 的舊狀態不能覆寫 B 之後寫回的新狀態
+    store = state_store.MemoryStateStore()
+    url = "https://a.example/"
+    a, b = baseline.Baselines(), baseline.Baselines()
+    a.load([url], store)
+    warm_up(a, url, 120, 0.05)
+    a.save([url], store)
+
+    b.load([url], store)
+    for _ in range(10):
+        b.observe(url, 120)
+    b.save([url], store)
+
+    a.load([url], store)          # warm container 再次量測同一站
+    assert a.get(url) == b.get(url)
+    a.observe(url, 120)
+    a.save([url], store)
+    assert store.get_many(baseline.STATE_KIND, [url])[url]["n"] == b.get(url)["n"] + 1
+
@@ -0,0 +1,37 @@
+import importlib.util
+import json
+import os
+
+BENCH = os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks", "bench_canary_handler.py")
+
+
+def test_benchmark_emits_one_json_line_per_size(capsys, monkeypatch):
+    import canary_handler
+    for name in ("SITES_FILE", "SCHEDULE_MODE", "METRIC_MODE", "MAX_CONCURRENCY"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(canary_handler, "CW", None)
+    spec = importlib.util.spec_from_file_location("bench_canary_handler", BENCH)
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    bench.main(["--sizes", "3,6", "--servers", "2", "--latency-ms", "1", "--jitter-ms", "0"])
+
+    reports = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r["sites"] for r in reports] == [3, 6]
+    assert all(r["available"] == r["sites"] and r["metric_calls"] == 1 for r in reports)
+    # benchmark 不留下副作用：環境變數與 CloudWatch client 都已還原
+    assert not any(name in os.environ for name in ("SITES_FILE", "SCHEDULE_MODE", "METRIC_MODE"))
+    assert canary_handler.CW is None
+
+
+def test_cold_start_benchmark_reports_lazy_boto3(capsys):
+    path = os.path.join(os.path.dirname(BENCH), "bench_cold_start.py")
+    spec = importlib.util.spec_from_file_location("bench_cold_start", path)
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    bench.main(["--runs", "1"])
+
+    reports = {r["handler"]: r for r in map(json.loads, capsys.readouterr().out.splitlines())}
+    assert set(reports) == {"canary_handler", "alarm_logger"}
+    assert not any(r["boto3_loaded"] for r in reports.values())
@@ -0,0 +1,497 @@
+import hashlib
+import io
+import json
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import canary_handler
+import circuit_breaker
+import http_pool
+import metric_sink
+import site_registry
+import state_store
+
+
+class StubCloudWatch:
+    def __init__(self):
+        self.calls = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.calls.append((Namespace, list(MetricData)))
+
+
+def test_probe_all_runs_concurrently_and_keeps_order(monkeypatch):
+    def fake_check(site, timeout=None):
+        time.sleep(0.2)
+        return {"target_url": site.url, "availability": 1, "latency_ms": 200.0,
+                "status_code": 200, "error": None, "phases_ms": {}}
+
+    monkeypatch.setattr(canary_handler, "check_one", fake_check)
+    sink = metric_sink.CloudWatchSink("WebHealth", StubCloudWatch())
+
+    urls = [f"https://site{i}.example/" for i in range(8)]
+    start = time.perf_counter()
+    results = canary_handler.probe_all([site_registry.Site(url=u) for u in urls], sink, 8)
+    elapsed = time.perf_counter() - start
+
+    assert [r["target_url"] for r in results] == urls
+    assert elapsed < 0.2 * len(urls) / 2
+
+
+def test_max_concurrency_falls_back_on_bad_value(monkeypatch):
+    monkeypatch.setenv("MAX_CONCURRENCY", "abc")
+    assert canary_handler.max_concurrency() == canary_handler.DEFAULT_MAX_CONCURRENCY
+    monkeypatch.setenv("MAX_CONCURRENCY", "4")
+    assert canary_handler.max_concurrency() == 4
+
+
+def test_cloudwatch_sink_flushes_in_max_size_batches():
+    client = StubCloudWatch()
+    sink = metric_sink.CloudWatchSink("WebHealth", client)
+    for i in range(1500):
+        for datum in canary_handler.metric_datums(f"https://site{i}.example/", 1, 12.5):
+            sink.add(datum)
+
+    assert sink.flush() == 3
+    assert [len(data) for _, data in client.calls] == [1000, 1000, 1000]
+    assert sink.flush() == 0
+
+
+def test_emf_sink_writes_one_line_per_site_without_api_calls():
+    out = io.StringIO()
+    sink = metric_sink.EmfSink("WebHealth", stream=out)
+    for datum in canary_handler.metric_datums("https://a.example/", 0, None):
+        sink.add(datum)
+
+    assert sink.flush() == 1
+    record = json.loads(out.getvalue())
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "WebHealth"
+    assert directive["Dimensions"] == [["Site"]]
+    assert record["Site"] == "https://a.example/"
+    assert record["Availability"] == 0.0
+    assert record["Latency"] == 0.0
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/big":
+            # 4 MiB 的首頁：關鍵字在最前面
+            body = b"<html><title>Home</title>" + b"x" * (4 * 1024 * 1024)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == "/slow-body":
+            # 標頭馬上回傳，body 0.3 秒後才送出
+            body = b"ok"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.flush()
+            time.sleep(0.3)
+            self.wfile.write(body)
+            return
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        status = 503 if self.path == "/down" else 200
+        body = b"ok"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    http_pool.POOL.clear()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    http_pool.POOL.clear()
+
+
+def test_check_one_reuses_connection_on_second_probe(local_server):
+    first = canary_handler.check_one(local_server + "/")
+    second = canary_handler.check_one(local_server + "/")
+
+    assert first["availability"] == 1 and first["connection"] == "cold"
+    assert second["availability"] == 1 and second["connection"] == "reused"
+
+
+def test_latency_stops_at_response_headers_and_body_time_is_its_own_phase(local_server):
+    result = canary_handler.check_one(local_server + "/slow-body")
+
+    assert result["availability"] == 1 and result["connection"] == "cold"
+    assert result["latency_ms"] < 250 and result["phases_ms"]["body"] >= 250
+    assert canary_handler.check_one(local_server + "/")["connection"] == "reused"   # body 讀完，連線可重用
+
+
+def test_check_one_follows_redirects_and_reports_http_errors(local_server):
+    moved = canary_handler.check_one(local_server + "/moved")
+    down = canary_handler.check_one(local_server + "/down")
+
+    assert moved["status_code"] == 200 and moved["availability"] == 1
+    assert down["status_code"] == 503 and down["availability"] == 0
+    assert down["error"].startswith("HTTP Error 503")
+
+
+def test_check_one_content_checks_stream_with_a_byte_cap(local_server):
+    check = site_registry.parse_site({"url": local_server + "/big", "content": {
+        "contains": "<title>Home", "max_read_bytes": 256 * 1024}}, 0)
+    found = canary_handler.check_one(check)
+
+    assert found["availability"] == 1 and found["error"] is None
+    assert found["body_bytes"] < 256 * 1024 and found["body_ms"] is not None
+
+    error_page = site_registry.parse_site({"url": local_server + "/", "content": {"contains": "Welcome"}}, 0)
+    result = canary_handler.check_one(error_page)
+    assert result["status_code"] == 200 and result["availability"] == 0
+    assert result["error"] == "Content Error: 'Welcome' not found"
+    assert result["body_bytes"] == 2
+
+    hashed = site_registry.parse_site({"url": local_server + "/", "content": {
+        "sha256": hashlib.sha256(b"ok").hexdigest()}}, 0)
+    assert canary_handler.check_one(hashed)["availability"] == 1
+
+
+def test_connect_falls_back_to_the_next_resolved_address(local_server, monkeypatch):
+    port = int(local_server.rsplit(":", 1)[1])
+    # 第一個位址沒有人在聽（連線被拒），第二個才是本機伺服器
+    infos = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.2", port)),
+             (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: infos)
+    http_pool.DNS.clear()
+    try:
+        result = canary_handler.check_one(f"http://multi.example:{port}/")
+        assert result["availability"] == 1 and result["connection"] == "cold"
+        assert http_pool.DNS.resolve("multi.example", port) == ([(socket.AF_INET, ("127.0.0.2", port)),
+                                                                  (socket.AF_INET, ("127.0.0.1", port))], True)
+    finally:
+        http_pool.DNS.clear()
+
+
+def test_stale_connection_retry_starts_from_clean_phases_and_body(local_server, monkeypatch):
+    canary_handler.check_one(local_server + "/")      # 留下一條 keep-alive 連線
+    real_send = http_pool._send_once
+    calls = []
+
+    def flaky_send(conn, method, path, headers, phases, consumer=None):
+        calls.append(conn)
+        if len(calls) == 1:
+            # 重用的連線讀了一部分 body 後被伺服器重設
+            phases["ttfb"] += 5000.0
+            consumer.feed(b"ok")
+            raise ConnectionResetError()
+        return real_send(conn, method, path, headers, phases, consumer)
+
+    monkeypatch.setattr(http_pool, "_send_once", flaky_send)
+    check = site_registry.parse_site({"url": local_server + "/", "content": {"max_bytes": 3}}, 0)
+    result = canary_handler.check_one(check)
+
+    assert len(calls) == 2 and result["connection"] == "cold"
+    assert result["availability"] == 1 and result["body_bytes"] == 2
+    assert result["phases_ms"]["ttfb"] < 5000
+
+
+@pytest.fixture
+def local_tls_server(tmp_path, monkeypatch):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not available")
+    cert, key = str(tmp_path / "cert.pem"), str(tmp_path / "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_ctx.load_cert_chain(cert, key)
+    server.socket = server_ctx.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(http_pool, "TLS_CONTEXT", ssl.create_default_context(cafile=cert))
+    http_pool.POOL.clear()
+    yield f"https://localhost:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    http_pool.POOL.clear()
+
+
+def test_check_one_reports_phase_timings_over_tls(local_tls_server):
+    cold = canary_handler.check_one(local_tls_server + "/")
+    warm = canary_handler.check_one(local_tls_server + "/")
+
+    assert cold["availability"] == 1
+    assert set(cold["phases_ms"]) == set(http_pool.PHASES)
+    assert cold["phases_ms"]["tls"] > 0 and cold["phases_ms"]["ttfb"] > 0
+    assert warm["connection"] == "reused"
+    assert warm["phases_ms"]["tls"] == 0 and warm["phases_ms"]["connect"] == 0
+
+
+def test_https_connections_share_the_module_tls_context():
+    conn = http_pool.POOL.new_connection("https", "a.example", 443, 5)
+
+    assert conn._context is http_pool.TLS_CONTEXT
+
+
+def test_metric_datums_include_phase_metrics():
+    datums = canary_handler.metric_datums(
+        "https://a.example/", 1, 30.0,
+        {"dns": 1.0, "connect": 2.0, "tls": 3.0, "ttfb": 20.0, "body": 4.0})
+    names = [d["MetricName"] for d in datums]
+
+    assert names[:2] == ["Availability", "Latency"]
+    assert set(names[2:]) == set(canary_handler.PHASE_METRICS.values())
+    assert all(d["Dimensions"] == [{"Name": "Site", "Value": "https://a.example/"}] for d in datums)
+
+
+class StubSqs:
+    def __init__(self):
+        self.batches = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append(Entries)
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+
+def test_dispatcher_sends_shards_and_worker_probes_only_its_shard(monkeypatch):
+    stub = StubSqs()
+    monkeypatch.setattr(canary_handler, "SQS", stub)
+    urls = [f"https://site{i}.example/" for i in range(25)]
+
+    summary = canary_handler.dispatch_shards(urls, "https://sqs.example/q", 2)
+
+    assert summary["shards"] == 13 and summary["ok"]
+    assert [len(b) for b in stub.batches] == [10, 3]
+
+    probed = []
+    monkeypatch.setattr(canary_handler, "run_probes",
+                        lambda sites, context=None: probed.append([s.url for s in sites]) or {"ok": True})
+    body = stub.batches[1][2]["MessageBody"]
+    canary_handler.handler({"Records": [{"eventSource": "aws:sqs", "body": body}]}, None)
+
+    assert probed == [["https://site24.example/"]]
+
+
+def test_multi_sample_run_publishes_one_histogram_datum_per_metric(monkeypatch):
+    calls = iter([0, 1, 1, 1])  # 第一個樣本失敗，其餘成功
+
+    def fake_check(site, timeout=None):
+        up = next(calls)
+        return {"target_url": site.url, "availability": up, "latency_ms": 100.0 + up * 10,
+                "status_code": 200 if up else None, "error": None if up else "timed out",
+                "connection": "cold", "phases_ms": {"ttfb": 90.0}}
+
+    monkeypatch.setattr(canary_handler, "check_one", fake_check)
+    client = StubCloudWatch()
+    sink = metric_sink.CloudWatchSink("WebHealth", client)
+    site = site_registry.Site(url="https://a.example/")
+
+    results = canary_handler.probe_sampled([site], sink, 4, 4, 0)
+    sink.flush()
+
+    assert results[0]["availability"] == 1 and len(results[0]["samples"]) == 4
+    (_, data), = client.calls
+    by_name = {d["MetricName"]: d for d in data}
+    assert set(by_name) == {"Availability", "Latency", "LatencyTtfb"}
+    assert by_name["Availability"]["Values"] == [0.0, 1.0]
+    assert by_name["Availability"]["Counts"] == [1.0, 3.0]
+
+
+def test_emf_sink_expands_histograms_into_value_arrays():
+    out = io.StringIO()
+    sink = metric_sink.EmfSink("WebHealth", stream=out)
+    sink.add(canary_handler.histogram_datum("Latency", "https://a.example/", [5.0, 5.0, 7.0], "Milliseconds"))
+    sink.flush()
+
+    assert json.loads(out.getvalue())["Latency"] == [5.0, 5.0, 7.0]
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.deadline = time.monotonic() + remaining_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def test_breaker_opens_after_repeated_failures_and_shortens_timeout():
+    breakers = circuit_breaker.CircuitBreakers()
+    for _ in range(circuit_breaker.FAILURE_THRESHOLD):
+        breakers.record("https://dead.example/", 0, 0)
+    sites = [site_registry.Site(url=f"https://site{i}.example/") for i in range(31)]
+    sites.append(site_registry.Site(url="https://dead.example/"))
+
+    assert breakers.is_open("https://dead.example/")
+    assert canary_handler.plan_timeouts(sites, breakers, None, 16)[-2:] == [10.0, circuit_breaker.OPEN_TIMEOUT]
+    # 預算 8 秒、兩輪併發 → 每個量測最多 4 秒
+    assert canary_handler.plan_timeouts(sites, breakers, 8.0, 16)[:2] == [4.0, 4.0]
+
+    breakers.record("https://dead.example/", 1, 1)
+    assert not breakers.is_open("https://dead.example/")
+
+
+def test_run_finishes_within_budget_and_reports_dead_sites_down(monkeypatch):
+    healthy = [site_registry.Site(url=f"https://up{i}.example/") for i in range(4)]
+    dead = [site_registry.Site(url=f"https://down{i}.example/") for i in range(6)]
+    breakers = circuit_breaker.CircuitBreakers()
+    for site in dead:
+        for _ in range(circuit_breaker.FAILURE_THRESHOLD):
+            breakers.record(site.url, 0, 0)
+
+    def fake_check(site, timeout=None):
+        if site in dead:
+            time.sleep(timeout)    # 掛掉的網站：每次都等到逾時
+            return canary_handler.down_result(site, "timed out")
+        time.sleep(0.05)
+        return {"target_url": site.url, "availability": 1, "latency_ms": 50.0,
+                "status_code": 200, "error": None, "phases_ms": {}}
+
+    client = StubCloudWatch()
+    monkeypatch.setattr(canary_handler, "check_one", fake_check)
+    monkeypatch.setattr(canary_handler, "CW", client)
+    monkeypatch.setattr(circuit_breaker, "BREAKERS", breakers)
+    monkeypatch.setenv("MAX_CONCURRENCY", "2")
+    for name in ("SCHEDULE_MODE", "SAMPLES_PER_RUN", "STATE_TABLE", "ARCHIVE_BUCKET", "ARCHIVE_DIR", "METRIC_MODE"):
+        monkeypatch.delenv(name, raising=False)
+
+    start = time.monotonic()
+    summary = canary_handler.run_probes(healthy + dead, FakeContext(canary_handler.BUDGET_RESERVE_MS + 1000))
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 1.3
+    by_url = {r["target_url"]: r for r in summary["results"]}
+    assert all(by_url[s.url]["availability"] == 1 for s in healthy)
+    assert all(by_url[s.url]["availability"] == 0 for s in dead)
+    assert any(by_url[s.url]["error"].startswith("circuit open") for s in dead)
+    published = {d["Dimensions"][0]["Value"] for _, data in client.calls for d in data
+                 if d["MetricName"] == "Availability"}
+    assert published == {s.url for s in healthy + dead}
+    anomalies = {d["Dimensions"][0]["Value"] for _, data in client.calls for d in data
+                 if d["MetricName"] == "LatencyAnomaly"}
+    assert anomalies == {s.url for s in healthy}
+
+
+def test_sampled_run_returns_by_the_deadline_when_a_round_is_slow(monkeypatch):
+    fast = site_registry.Site(url="https://fast.example/")
+    slow = site_registry.Site(url="https://slow.example/")
+
+    def fake_check(site, timeout=None):
+        time.sleep(2.0 if site is slow else 0.01)
+        return {"target_url": site.url, "availability": 1, "latency_ms": 10.0,
+                "status_code": 200, "error": None, "connection": "cold", "phases_ms": {}}
+
+    client = StubCloudWatch()
+    monkeypatch.setattr(canary_handler, "check_one", fake_check)
+    monkeypatch.setattr(canary_handler, "CW", client)
+    monkeypatch.setattr(circuit_breaker, "BREAKERS", circuit_breaker.CircuitBreakers())
+    monkeypatch.setenv("SAMPLES_PER_RUN", "3")
+    monkeypatch.setenv("SAMPLE_SPREAD_SECONDS", "0")
+    for name in ("SCHEDULE_MODE", "STATE_TABLE", "ARCHIVE_BUCKET", "ARCHIVE_DIR", "METRIC_MODE"):
+        monkeypatch.delenv(name, raising=False)
+
+    start = time.monotonic()
+    summary = canary_handler.run_probes([fast, slow], FakeContext(canary_handler.BUDGET_RESERVE_MS + 500))
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.9
+    by_url = {r["target_url"]: r for r in summary["results"]}
+    assert by_url[fast.url]["availability"] == 1
+    assert by_url[slow.url]["availability"] == 0 and by_url[slow.url]["latency_ms"] is None
+
+
+def test_probe_region_adds_region_dimension_copies(monkeypatch):
+    def fake_check(site, timeout=None):
+        return {"target_url": site.url, "availability": 1, "latency_ms": 80.0,
+                "status_code": 200, "error": None, "phases_ms": {"ttfb": 40.0}}
+
+    client = StubCloudWatch()
+    monkeypatch.setattr(canary_handler, "check_one", fake_check)
+    monkeypatch.setattr(canary_handler, "CW", client)
+    monkeypatch.setattr(circuit_breaker, "BREAKERS", circuit_breaker.CircuitBreakers())
+    monkeypatch.setenv("PROBE_REGION", "eu-west-1")
+    for name in ("SCHEDULE_MODE", "SAMPLES_PER_RUN", "STATE_TABLE", "ARCHIVE_BUCKET", "ARCHIVE_DIR", "METRIC_MODE"):
+        monkeypatch.delenv(name, raising=False)
+
+    canary_handler.run_probes([site_registry.Site(url="https://a.example/")])
+
+    dims = {(d["MetricName"], tuple(x["Name"] for x in d["Dimensions"])) for _, data in client.calls for d in data}
+    assert ("Availability", ("Site",)) in dims and ("Availability", ("Site", "Region")) in dims
+    assert ("Latency", ("Site", "Region")) in dims
+    assert ("LatencyTtfb", ("Site", "Region")) not in dims and ("LatencyAnomaly", ("Site", "Region")) not in dims
+    regions = {x["Value"] for _, data in client.calls for d in data for x in d["Dimensions"] if x["Name"] == "Region"}
+    assert regions == {"eu-west-1"}
+
+
+def test_probe_finishing_after_deadline_publishes_only_the_down_result(monkeypatch):
+    def slow_check(site, timeout=None):
+        time.sleep(0.3)     # 超過 deadline 才完成
+        return {"target_url": site.url, "availability": 1, "latency_ms": 300.0,
+                "status_code": 200, "error": None, "phases_ms": {}}
+
+    client = StubCloudWatch()
+    monkeypatch.setattr(canary_handler, "check_one", slow_check)
+    sink = metric_sink.CloudWatchSink("WebHealth", client)
+
+    site = site_registry.Site(url="https://slow.example/")
+    (result,) = canary_handler.probe_all([site], sink, 1, deadline=time.monotonic() + 0.05)
+    sink.flush()
+    time.sleep(0.4)         # worker thread 在這段時間內完成
+    sink.flush()
+
+    assert result["availability"] == 0
+    published = [(d["MetricName"], d["Value"]) for _, data in client.calls for d in data]
+    assert published == [("Availability", 0.0)]
+
+
+def test_breaker_trip_recorded_elsewhere_is_not_lost():
+    store = state_store.MemoryStateStore()
+    url = "https://down.example/"
+    a, b = circuit_breaker.CircuitBreakers(), circuit_breaker.CircuitBreakers()
+    a.load([url], store)
+    a.record_many([{"target_url": url, "availability": 0}], store, now=0)
+
+    for now in (60, 120):
+        b.load([url], store)
+        b.record_many([{"target_url": url, "availability": 0}], store, now=now)
+    assert b.is_open(url)
+
+    a.load([url], store)
+    assert a.is_open(url)
+    a.record_many([{"target_url": url, "availability": 0}], store, now=180)
+    assert store.get_many(circuit_breaker.STATE_KIND, [url])[url] == {"failures": 4, "opened": 120}
+
+
+def test_cloudwatch_sink_splits_large_histograms_by_request_size():
+    client = StubCloudWatch()
+    sink = metric_sink.CloudWatchSink("WebHealth", client)
+    for i in range(1000):
+        values = [round(100 + j * 0.37, 2) for j in range(canary_handler.MAX_SAMPLES)]
+        sink.add(canary_handler.histogram_datum("Latency", f"https://site{i}.example/", values, "Milliseconds"))
+
+    calls = sink.flush()
+    assert calls > 1 and sum(len(data) for _, data in client.calls) == 1000
+    assert all(sum(map(metric_sink.encoded_size, data)) <= metric_sink.MAX_REQUEST_BYTES for _, data in client.calls)
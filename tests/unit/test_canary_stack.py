@@ -0,0 +1,203 @@
+import json
+
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+
+from project1.canary_stack import CanaryStack
+
+
+def synth_canary_stack():
+    app = core.App()
+    stack = CanaryStack(app, "canary", target_url="https://example.com/")
+    return assertions.Template.from_stack(stack)
+
+
+def test_canary_lambda_environment():
+    template = synth_canary_stack()
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "canary_handler.handler",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "METRIC_NAMESPACE": "WebHealth",
+            "MAX_CONCURRENCY": "16",
+            "METRIC_MODE": "api",
+        })},
+    })
+
+
+def test_dashboard_has_phase_breakdown():
+    template = synth_canary_stack()
+    body = template.find_resources("AWS::CloudWatch::Dashboard")
+    rendered = str(body)
+
+    assert "LatencyTtfb" in rendered
+    assert "ORDER BY AVG() DESC LIMIT 10" in rendered
+
+
+def test_dispatcher_feeds_shard_queue_consumed_by_worker():
+    template = synth_canary_stack()
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({
+            "SHARD_SIZE": "50",
+            "SHARD_QUEUE_URL": assertions.Match.any_value(),
+        })},
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 1,
+        "ScalingConfig": {"MaximumConcurrency": 20},
+    })
+
+
+def test_alarm_logger_consumes_alert_queues_in_batches():
+    template = synth_canary_stack()
+
+    template.resource_properties_count_is("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 25,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"],
+    }, 2)
+    template.resource_properties_count_is("AWS::SNS::Subscription", {"Protocol": "lambda"}, 0)
+
+
+def test_alarm_history_table_is_time_bucketed_with_indexes_and_ttl():
+    template = synth_canary_stack()
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "TableName": "WebHealth_AlarmHistory",
+        "KeySchema": [{"AttributeName": "Bucket", "KeyType": "HASH"},
+                      {"AttributeName": "SortKey", "KeyType": "RANGE"}],
+        "TimeToLiveSpecification": {"AttributeName": "ExpiresAt", "Enabled": True},
+        "GlobalSecondaryIndexes": assertions.Match.array_with([
+            assertions.Match.object_like({
+                "IndexName": "ByState",
+                "Projection": {"ProjectionType": "INCLUDE", "NonKeyAttributes": assertions.Match.array_with(
+                    ["AlarmName", "Site", "NewStateValue"])},
+            }),
+            assertions.Match.object_like({
+                "IndexName": "ByAlarm",
+                "Projection": assertions.Match.object_like({"ProjectionType": "INCLUDE"}),
+            }),
+        ]),
+    })
+
+
+def test_rule_only_ticks_and_scheduler_state_is_persisted():
+    template = synth_canary_stack()
+
+    template.has_resource_properties("AWS::Events::Rule", {"ScheduleExpression": "rate(1 minute)"})
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({
+            "SCHEDULE_MODE": "adaptive",
+            "STATE_TABLE": assertions.Match.any_value(),
+        })},
+    })
+
+
+def test_latency_alarms_fire_on_deviation_from_site_baseline():
+    template = synth_canary_stack()
+
+    template.resource_properties_count_is("AWS::CloudWatch::Alarm", {
+        "MetricName": "LatencyAnomaly", "Threshold": 3, "EvaluationPeriods": 2,
+    }, 3)
+    template.resource_properties_count_is("AWS::CloudWatch::Alarm", {"MetricName": "Latency"}, 0)
+
+
+def test_multi_sample_mode_uses_majority_availability_alarms():
+    app = core.App()
+    stack = CanaryStack(app, "canary", target_url="https://example.com/", samples_per_run=5)
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({"SAMPLES_PER_RUN": "5"})},
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "Availability", "Threshold": 0.5,
+    })
+    # 基準線只看中位數：多次取樣時仍保留 p90 延遲告警
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "Latency", "ExtendedStatistic": "p90", "Threshold": 1000,
+    })
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "MetricName": "LatencyAnomaly", "Statistic": "Average",
+    })
+
+
+def test_grouped_alarm_mode_scales_to_thousands_of_sites(tmp_path):
+    sites = [{"url": f"https://site{i}.example/", "tags": {"group": f"g{i % 3}"}} for i in range(3000)]
+    sites_file = tmp_path / "sites.json"
+    sites_file.write_text(json.dumps(sites), encoding="utf-8")
+
+    app = core.App()
+    stack = CanaryStack(app, "canary", target_url="https://example.com/", sites_file=str(sites_file))
+    template = assertions.Template.from_stack(stack)
+
+    # 主 stack 只多出 nested stack 資源；告警全部在 nested stack 中
+    template.resource_count_is("AWS::CloudWatch::Alarm", 0)
+    template.resource_count_is("AWS::CloudFormation::Stack", 3)
+    assert len(template.to_json()["Resources"]) < 100
+
+    pages = 0
+    for shard in (c for c in stack.node.children if isinstance(c, core.NestedStack)):
+        nested = assertions.Template.from_stack(shard)
+        assert len(nested.to_json()["Resources"]) <= 330
+        pages += len(nested.find_resources("AWS::CloudWatch::Dashboard"))
+        nested.resource_count_is("AWS::CloudWatch::CompositeAlarm", 100)
+        nested.has_resource_properties("AWS::CloudWatch::Alarm", {
+            "Metrics": assertions.Match.array_with([
+                assertions.Match.object_like({"Expression": assertions.Match.string_like_regexp("^MIN\\(")}),
+            ]),
+        })
+
+    # 明細頁：每個 group 1000 站 / 每頁 50 站 → 60 頁，都在 nested stack 中；主 stack 只有總覽
+    assert pages == 60
+    template.resource_count_is("AWS::CloudWatch::Dashboard", 1)
+
+
+def overview_body(tmp_path, count):
+    sites = [f"https://site{i}.example/" for i in range(count)]
+    sites_file = tmp_path / f"sites-{count}.json"
+    sites_file.write_text(json.dumps(sites), encoding="utf-8")
+    app = core.App()
+    stack = CanaryStack(app, f"canary{count}", target_url="https://example.com/",
+                        sites_file=str(sites_file), alarm_mode="grouped")
+    dashboards = assertions.Template.from_stack(stack).find_resources("AWS::CloudWatch::Dashboard")
+    overview, = (d for d in dashboards.values() if d["Properties"]["DashboardName"] == "WebHealth-Dashboard")
+    return json.dumps(overview["Properties"]["DashboardBody"])
+
+
+def test_overview_dashboard_size_does_not_depend_on_site_count(tmp_path):
+    small, large = overview_body(tmp_path, 60), overview_body(tmp_path, 1500)
+
+    assert len(small) == len(large)
+    assert "site1499.example" not in large
+
+
+def test_multi_region_deploys_probe_stacks_and_quorum_alarms_in_home_region():
+    app = core.App()
+    regions = ["ap-southeast-2", "us-east-1", "eu-west-1"]
+    stacks = {
+        region: CanaryStack(app, f"canary-{region}", target_url="https://example.com/", regions=regions,
+                            env=core.Environment(account="123456789012", region=region))
+        for region in regions
+    }
+    home = assertions.Template.from_stack(stacks["ap-southeast-2"])
+    probe = assertions.Template.from_stack(stacks["eu-west-1"])
+
+    probe.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "canary_handler.handler",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "PROBE_REGION": "eu-west-1", "METRIC_REGION": "ap-southeast-2",
+        })},
+    })
+    probe.resource_count_is("AWS::Events::Rule", 1)
+    for kind in ("AWS::CloudWatch::Alarm", "AWS::CloudWatch::Dashboard", "AWS::SNS::Topic"):
+        probe.resource_count_is(kind, 0)
+
+    quorum_alarms = home.find_resources("AWS::CloudWatch::Alarm", {"Properties": {
+        "ComparisonOperator": "GreaterThanOrEqualToThreshold", "Threshold": 2,
+    }})
+    assert quorum_alarms
+    rendered = json.dumps(quorum_alarms)
+    assert "IF(FILL(r0, 1) < 1, 1, 0) + IF(FILL(r1, 1) < 1, 1, 0) + IF(FILL(r2, 1) < 1, 1, 0)" in rendered
+    assert all(region in rendered for region in regions)
+    assert "GROUP BY Region" in json.dumps(home.find_resources("AWS::CloudWatch::Dashboard"))
@@ -0,0 +1,65 @@
+import hashlib
+
+import content_check
+import site_registry
+
+
+def matcher(**content):
+    return content_check.ContentMatcher(site_registry.parse_site({"url": "https://a.example/", "content": content}, 0).content)
+
+
+def feed_all(m, body, chunk=7):
+    # 與 http_pool 相同的讀法：每次最多 chunk bytes，總共不超過 m.limit，讀到結尾時呼叫 finish()
+    offset = 0
+    while offset < m.limit:
+        piece = body[offset:offset + min(chunk, m.limit - offset)]
+        if not piece:
+            m.finish()
+            break
+        offset += len(piece)
+        if not m.feed(piece):
+            break
+    return m
+
+
+def test_keywords_and_regex_match_across_chunk_boundaries():
+    body = b"<html><head><title>Status page</title></head><body>All systems operational</body></html>"
+    m = feed_all(matcher(contains=["systems operational", "Status"], regex=r"<title>[^<]+</title>"), body)
+
+    assert m.error() is None
+    # 全部找到後就停止讀取
+    assert m.bytes_read < len(body)
+
+
+def test_reports_missing_keyword_within_the_byte_cap():
+    m = feed_all(matcher(contains="footer", max_read_bytes=64), b"a" * 1000 + b"footer")
+
+    assert m.bytes_read == 65      # 多讀 1 byte 確認超過上限
+    assert m.error() == "Content Error: 'footer' not found in first 64 bytes"
+
+
+def test_size_limits_and_sha256():
+    assert feed_all(matcher(max_bytes=10), b"x" * 50).error() == "Content Error: body larger than 10 bytes"
+    assert feed_all(matcher(max_bytes=10), b"x" * 50).bytes_read == 11
+    assert "at least 100" in feed_all(matcher(min_bytes=100), b"x" * 50).error()
+
+    body = b"hello world" * 10
+    same = feed_all(matcher(sha256=hashlib.sha256(body).hexdigest()), body)
+    assert same.error() is None and same.digest == hashlib.sha256(body).hexdigest()
+    changed = feed_all(matcher(sha256=hashlib.sha256(b"old").hexdigest()), body)
+    assert changed.error().startswith("Content Error: sha256 changed")
+
+
+def test_digest_only_covers_a_fully_read_body():
+    body = b"<html>ok</html>" + b"x" * 100
+    # 關鍵字找到就停止讀取：沒讀完，不能當成整個 body 的雜湊
+    early = feed_all(matcher(contains="ok"), body)
+    assert early.error() is None and not early.eof and early.digest is None
+
+    # 剛好等於上限的 body 可以驗證；多 1 byte 就超過上限
+    exact = b"y" * 64
+    same = feed_all(matcher(sha256=hashlib.sha256(exact).hexdigest(), max_read_bytes=64), exact)
+    assert same.error() is None and same.digest == hashlib.sha256(exact).hexdigest()
+    over = feed_all(matcher(sha256=hashlib.sha256(exact + b"y").hexdigest(), max_read_bytes=64), exact + b"y")
+    assert over.capped and over.digest is None
+    assert over.error() == "Content Error: body exceeds 64 bytes, cannot verify sha256"
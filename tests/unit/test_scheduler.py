@@ -0,0 +1,102 @@
+import pytest
+
+import scheduler
+import site_registry
+import state_store
+
+
+def make_registry(*sites):
+    return site_registry.Registry(sites)
+
+
+def test_new_sites_are_due_immediately_then_wait_their_interval():
+    site = site_registry.Site(url="https://a.example/", interval=300)
+    registry = make_registry(site)
+    store = state_store.MemoryStateStore()
+
+    assert scheduler.select_due(registry, store, now=1000) == [site]
+    scheduler.record_results([site], [{"availability": 1}], store, now=1000)
+
+    assert scheduler.select_due(registry, store, now=1060) == []
+    assert scheduler.select_due(registry, store, now=1300) == [site]
+
+
+def test_dispatched_sites_are_leased_until_the_worker_reports():
+    site = site_registry.Site(url="https://a.example/", interval=60)
+    registry = make_registry(site)
+    store = state_store.MemoryStateStore()
+
+    assert scheduler.select_due(registry, store, now=1000) == [site]
+    scheduler.lease([site], store, now=1000)
+    # 分片還在佇列裡：之後的 tick 不再派送
+    assert scheduler.select_due(registry, store, now=1060) == []
+    assert scheduler.select_due(registry, store, now=1000 + scheduler.DISPATCH_LEASE_SECONDS) == [site]
+
+    # worker 回報後回到正常間隔
+    scheduler.record_results([site], [{"availability": 1}], store, now=1090)
+    assert scheduler.select_due(registry, store, now=1150) == [site]
+
+
+def test_interval_adapts_to_site_state():
+    site = site_registry.Site(url="https://a.example/", interval=300)
+    state, now = None, 0
+    state = scheduler.update_state(site, state, 1, now)
+    assert state["next_due"] - now == 300
+
+    state = scheduler.update_state(site, state, 0, now)
+    assert state["next_due"] - now == scheduler.FAST_INTERVAL
+
+    state = scheduler.update_state(site, state, 1, now)
+    assert state["next_due"] - now == 150      # 剛恢復：flapping 期間加快
+
+    for _ in range(scheduler.VERY_STABLE_STREAK):
+        state = scheduler.update_state(site, state, 1, now)
+    assert state["next_due"] - now == 1200     # 長期穩定：放慢到 4 倍
+
+
+def test_due_sites_are_ordered_by_next_due():
+    a, b, c = (site_registry.Site(url=f"https://{n}.example/") for n in "abc")
+    states = {a.url: {"next_due": 50}, b.url: {"next_due": 10}, c.url: {"next_due": 500}}
+
+    assert scheduler.due_sites(make_registry(a, b, c), states, now=100) == [b, a]
+
+
+def test_elevated_latency_score_keeps_site_on_fast_interval():
+    # 穩定網站放慢到 1200 秒一次；分數超標後改為每分鐘量測，延遲告警才有連續兩個 period 的資料
+    site = site_registry.Site(url="https://a.example/", interval=300)
+    state, now = None, 0
+    for _ in range(scheduler.VERY_STABLE_STREAK + 1):
+        state = scheduler.update_state(site, state, 1, now, anomaly_score=0.5)
+    assert state["next_due"] - now == 1200
+
+    state = scheduler.update_state(site, state, 1, now, anomaly_score=scheduler.baseline.ALARM_SCORE + 1)
+    assert state["next_due"] - now == scheduler.FAST_INTERVAL
+    assert scheduler.update_state(site, state, 1, now, anomaly_score=4.5)["next_due"] - now == scheduler.FAST_INTERVAL
+
+    state = scheduler.update_state(site, state, 1, now, anomaly_score=0.2)
+    assert state["next_due"] - now == 1200     # 恢復正常：回到原本的間隔
+
+
+class ThrottledDynamo:
+    # 最後一個 key 每次都回到 UnprocessedKeys，其餘正常回傳
+    def __init__(self, table):
+        self.table = table
+        self.calls = 0
+
+    def batch_get_item(self, RequestItems):
+        self.calls += 1
+        keys = RequestItems[self.table]["Keys"]
+        responses = [{"Key": k["Key"], "Data": {"S": '{"next_due": 5000}'}} for k in keys[:-1]]
+        return {"Responses": {self.table: responses}, "UnprocessedKeys": {self.table: {"Keys": keys[-1:]}}}
+
+
+def test_throttled_state_read_fails_instead_of_dropping_leases(monkeypatch):
+    monkeypatch.setattr(state_store, "BACKOFF_BASE_SECONDS", 0)
+    client = ThrottledDynamo("state")
+    store = state_store.DynamoStateStore("state", client)
+    registry = make_registry(*(site_registry.Site(url=f"https://{n}.example/") for n in "ab"))
+
+    # 讀不到 b 的租約時不能把 b 當成新網站派送出去
+    with pytest.raises(state_store.StateReadError):
+        scheduler.select_due(registry, store, now=1000)
+    assert client.calls == state_store.MAX_ATTEMPTS
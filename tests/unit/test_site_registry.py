@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+
+import site_registry
+
+
+def write_sites(path, data):
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+def test_accepts_bare_urls_and_rich_entries(tmp_path):
+    path = write_sites(tmp_path / "sites.json", [
+        " https://a.example/ ",
+        {"url": "https://b.example/health", "method": "head", "expected_status": 204,
+         "timeout": 3, "headers": {"Accept": "text/plain"}, "tags": {"group": "api"}, "interval": 60},
+        "https://a.example/",
+    ])
+    registry = site_registry.load_registry(path)
+
+    assert registry.urls() == ["https://a.example/", "https://b.example/health"]
+    b = registry.get("https://b.example/health")
+    assert (b.method, b.expected_status, b.timeout, b.interval) == ("HEAD", (204, 204), 3.0, 60)
+    assert b.status_ok(204) and not b.status_ok(200)
+    assert registry.get("https://unknown.example/").expected_status == (200, 399)
+
+
+@pytest.mark.parametrize("entry, message", [
+    ({"url": "ftp://a.example/"}, "absolute http"),
+    ({"url": "https://a.example/", "method": "POST"}, "method"),
+    ({"url": "https://a.example/", "expected_status": [500, 200]}, "expected_status"),
+    ({"url": "https://a.example/", "timeout": 0}, "timeout"),
+    ({"url": "https://a.example/", "colour": "red"}, "unknown field"),
+    ({"url": "https://a.example/", "method": "HEAD", "content": {"contains": "ok"}}, "method GET"),
+    ({"url": "https://a.example/", "content": {"regex": "("}}, "content.regex"),
+    ({"url": "https://a.example/", "content": {"max_bytes": 2048, "max_read_bytes": 1024}}, "max_bytes"),
+    ({"url": "https://a.example/", "content": {}}, "at least one check"),
+])
+def test_rejects_invalid_entries(tmp_path, entry, message):
+    path = write_sites(tmp_path / "sites.json", [entry])
+    with pytest.raises(ValueError, match=message):
+        site_registry.load_registry(path)
+
+
+def test_reparses_only_when_file_content_changes(tmp_path):
+    path = write_sites(tmp_path / "sites.json", ["https://a.example/"])
+    first = site_registry.load_registry(path)
+    assert site_registry.load_registry(path) is first
+
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert site_registry.load_registry(path) is first
+
+    write_sites(tmp_path / "sites.json", ["https://a.example/", "https://b.example/"])
+    assert len(site_registry.load_registry(path)) == 2